@@ -0,0 +1,52 @@
+# Benchmark: cost of authenticators for R = 4, 7, 10 and 31 replicas.
+#
+# Measures sealing a message (one HMAC per replica), verifying it for the
+# first time, and verifying it again through the cache, against the cost
+# of encoding the same message.
+#
+# Run with: python benchmarks/bench_auth.py
+
+import sys
+sys.path += ["."]
+
+import timeit
+
+from pybft.replica import replica
+from pybft.auth import authenticator, keyring
+from pybft.codec import wirecodec
+
+
+def main():
+    keys = keyring(b"secret")
+    codec = wirecodec()
+    r = replica(0, 4)
+    request = (r._REQUEST, b"x" * 64, 10, b"client")
+    msgs = [("PREPARE", (r._PREPARE, 0, 1, r.hash(request), 1)),
+            ("PREPREPARE", (r._PREPREPARE, 0, 1, request, 1))]
+
+    reps = 5000
+    print("%4s %11s %12s %12s %12s %12s" % ("R", "message", "encode (us)", \
+          "seal (us)", "verify (us)", "cached (us)"))
+    for R in [4, 7, 10, 31]:
+        sender = authenticator(1, R, keys)
+        me = authenticator(0, R, keys, cache_size=reps + 1)
+        for name, msg in msgs:
+            payload = codec.encode(msg)
+            envs = [sender.seal(payload + b"%d" % x) for x in range(reps)]
+            opened = [me.open(env) for env in envs]
+
+            t_enc = timeit.timeit(lambda: codec.encode(msg), number=reps)
+            t_seal = timeit.timeit(lambda: sender.seal(payload), number=reps)
+
+            it = iter(opened)
+            t_miss = timeit.timeit(lambda: me.verify(*next(it)), number=reps)
+            it = iter(opened)
+            t_hit = timeit.timeit(lambda: me.verify(*next(it)), number=reps)
+
+            print("%4d %11s %12.2f %12.2f %12.2f %12.2f" % (R, name, \
+                  1e6 * t_enc / reps, 1e6 * t_seal / reps, \
+                  1e6 * t_miss / reps, 1e6 * t_hit / reps))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+# Benchmark suite: closed-loop throughput against the client window.
+#
+# Runs `clients` clients of pybft.client in an f=1 simulation, each
+# submitting `ops` operations with a window of outstanding requests, and
+# prints the simulated throughput, median and 99th percentile latency,
+# and the retries. With a window of 1 each client waits for a reply
+# quorum before its next request; larger windows keep the replicas busy
+# until batching or the links saturate.
+#
+# Run with: python benchmarks/bench_client.py [--window 1 2 4 8 16]
+#                                             [--clients 4] [--ops 200]
+#                                             [--latency 0.005] [--batch 16]
+
+import sys
+sys.path += ["."]
+
+import argparse
+
+from pybft.client import client
+from pybft.sim import simulator, link
+
+
+def run(clients, ops, window, latency, batch):
+    sim = simulator(f=1, seed=1, default_link=link(latency=latency), batch_size=batch, \
+                    batch_timeout=latency)
+    cls = [client(b"c%d" % k, sim.R, window=window, timeout=20 * latency) \
+           for k in range(clients)]
+    rep = sim.run_clients(cls, [[b"op%d" % x for x in range(ops)] for _ in cls])
+    rep["retries"] = sum(cl.stat["retries"] for cl in cls)
+    return rep
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--window", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    parser.add_argument("--clients", type=int, default=4)
+    parser.add_argument("--ops", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.005)
+    parser.add_argument("--batch", type=int, default=16)
+    args = parser.parse_args()
+
+    print("%7s %10s %10s %10s %8s" % ("window", "req/s", "p50 ms", "p99 ms", "retries"))
+    for window in args.window:
+        rep = run(args.clients, args.ops, window, args.latency, args.batch)
+        print("%7d %10.1f %10.2f %10.2f %8d" % (window, rep["throughput"], \
+              rep["latency_p50"] * 1e3, rep["latency_p99"] * 1e3, rep["retries"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+# Benchmark: encode and decode rates of the binary wire codec against
+# pickle, for the common message shapes. Every request has its own
+# payload, as on the wire. The codec is smaller for PREPAREs and COMMITs,
+# larger for batches and VIEWCHANGEs, and several times slower.
+#
+# Run with: python benchmarks/bench_codec.py
+
+import sys
+sys.path += ["."]
+
+import pickle
+import random
+import timeit
+
+from pybft.replica import replica
+from pybft.codec import wirecodec
+
+
+def messages():
+    r = replica(0, 4)
+    rng = random.Random(1)
+
+    # Distinct payloads, so that pickle cannot memoize a shared object.
+    def request(c):
+        return (r._REQUEST, bytes(rng.getrandbits(8) for _ in range(64)), 10, b"%d" % c)
+
+    reqs = [request(c) for c in range(20)]
+    hm = r.hash(reqs[0])
+    batch = (r._BATCH, tuple(reqs[:10]))
+    P = frozenset([(r._PREPREPARE, 0, n, reqs[n], 0) for n in range(1, 11)] + \
+                  [(r._PREPARE, 0, n, r.hash(reqs[n]), j) for n in range(1, 11) for j in (1, 2)])
+    chkpt = (r._CHECKPOINT, 0, 0, r.stable_chkpt(), 1)
+    return [
+        ("REQUEST", reqs[0]),
+        ("PREPARE", (r._PREPARE, 0, 1, hm, 1)),
+        ("COMMIT", (r._COMMIT, 0, 1, hm, 2)),
+        ("PREPREPARE", (r._PREPREPARE, 0, 1, reqs[0], 0)),
+        ("PREPREPARE/10", (r._PREPREPARE, 0, 1, batch, 0)),
+        ("VIEWCHANGE", (r._VIEWCHANGE, 1, 0, chkpt[3], frozenset([chkpt]), P, 1)),
+    ]
+
+
+def main():
+    codec = wirecodec()
+    reps = 20000
+    print("%14s %6s %6s %12s %12s %12s %12s" % ("message", "bytes", "pickle", \
+          "enc (k/s)", "pickle enc", "dec (k/s)", "pickle dec"))
+    for name, msg in messages():
+        buf = codec.encode(msg)
+        pbuf = pickle.dumps(msg, protocol=pickle.HIGHEST_PROTOCOL)
+        assert codec.decode(buf) == msg
+
+        rates = []
+        for f in [lambda: codec.encode(msg),
+                  lambda: pickle.dumps(msg, protocol=pickle.HIGHEST_PROTOCOL),
+                  lambda: codec.decode(buf),
+                  lambda: pickle.loads(pbuf)]:
+            rates.append(reps / timeit.timeit(f, number=reps) / 1000.)
+
+        print("%14s %6d %6d %12.1f %12.1f %12.1f %12.1f" % \
+              ((name, len(buf), len(pbuf)) + tuple(rates)))
+
+
+if __name__ == "__main__":
+    main()
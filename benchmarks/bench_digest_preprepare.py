@@ -0,0 +1,60 @@
+# Benchmark suite: outbound bandwidth of the primary with full and with
+# digest-only PREPREPAREs.
+#
+# Runs a simulated cluster (see pybft.sim) whose clients send requests to
+# every replica, over links of limited bandwidth, for payloads of
+# increasing size, with PREPREPAREs carrying the requests and carrying
+# their digests only (see pybft.fetch). Prints the bytes sent by the
+# primary, the total bytes, the simulated throughput and the number of
+# fetches for missing bodies.
+#
+# Run with: python benchmarks/bench_digest_preprepare.py [--f 1 2] [--size 1024 65536]
+#                                                        [--n 200] [--bandwidth 1.25e7]
+
+import sys
+sys.path += ["."]
+
+import argparse
+
+from pybft.replica import replica
+from pybft.sim import simulator, link
+
+
+def run(f, N, size, digest, bandwidth):
+    # Clients retry after the time to send a few requests over a link.
+    sim = simulator(f=f, seed=1, batch_size=4, batch_timeout=0.001, wire=True, \
+                    multicast=True, default_link=link(bandwidth=bandwidth), \
+                    retry=max(0.05, 40.0 * size / bandwidth))
+    for r in sim.replicas:
+        r.digest_preprepares = digest
+    reqs = [(replica._REQUEST, (b"%08d" % x) * (size // 8), x // 10 + 1, \
+             b"client%d" % (x % 10)) for x in range(N)]
+    rep = sim.run(reqs)
+    assert rep["requests"] == N, rep
+    return rep
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--f", type=int, nargs="+", default=[1, 2])
+    parser.add_argument("--size", type=int, nargs="+", default=[64, 1024, 16384, 65536])
+    parser.add_argument("--n", type=int, default=200)
+    parser.add_argument("--bandwidth", type=float, default=1.25e7, \
+                        help="bytes per second of every link")
+    args = parser.parse_args()
+
+    print("%4s %8s %8s %14s %14s %10s %8s" % ("f", "payload", "mode", "primary (KB)", \
+          "total (KB)", "req/s", "fetches"))
+    for f in args.f:
+        for size in args.size:
+            for digest in (False, True):
+                rep = run(f, args.n, size, digest, args.bandwidth)
+                print("%4d %8d %8s %14.1f %14.1f %10.0f %8d" % (f, size, \
+                      "digest" if digest else "full", rep["bytes_from"][0] / 1024.0, \
+                      rep["bytes"] / 1024.0, rep["throughput"], \
+                      rep["messages_by_type"].get(replica._FETCH, 0)))
+            sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+# Benchmark suite: cost of taking a checkpoint against the number of
+# clients in the reply table.
+#
+# For tables of increasing size, executes `updates` requests between two
+# checkpoints, then checkpoints the table the old way, serialising and
+# digesting the whole sorted table, and the incremental way, with the
+# Merkle tree of pybft.merkle only hashing the buckets changed since the
+# previous checkpoint. Prints the time of a checkpoint and the number of
+# hashes of the tree; the old cost grows with the clients, the new one
+# with the updates.
+#
+# Run with: python benchmarks/bench_merkle.py [--clients 1000 10000 100000]
+#                                             [--updates 128] [--depth 16]
+#                                             [--repeat 5]
+
+import sys
+sys.path += ["."]
+
+import argparse
+import random
+import time
+from hashlib import sha256
+
+from pybft.merkle import merkle, canon, checkpoint_digest
+
+
+def full(table):
+    return sha256(canon(tuple(sorted(table.items())))).hexdigest()
+
+
+def incremental(tree):
+    return checkpoint_digest(None, tree.root())
+
+
+def measure(clients, updates, depth, repeat):
+    rand = random.Random(clients)
+    table = {}
+    tree = merkle(depth)
+    for c in range(clients):
+        key = b"client%d" % c
+        table[key] = (1, b"result")
+        tree.update(key, (1, b"result"))
+    tree.root()
+
+    best_full, best_inc, hashes = None, None, 0
+    for t in range(2, 2 + repeat):
+        keys = [b"client%d" % rand.randrange(clients) for _ in range(updates)]
+        for key in keys:
+            table[key] = (t, b"result")
+            tree.update(key, (t, b"result"))
+
+        t0 = time.perf_counter()
+        full(table)
+        t1 = time.perf_counter()
+        before = tree.stat["hashes"]
+        incremental(tree)
+        t2 = time.perf_counter()
+        hashes = tree.stat["hashes"] - before
+
+        best_full = t1 - t0 if best_full is None else min(best_full, t1 - t0)
+        best_inc = t2 - t1 if best_inc is None else min(best_inc, t2 - t1)
+    return best_full, best_inc, hashes
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--updates", type=int, default=128)
+    parser.add_argument("--depth", type=int, default=16)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print("%9s %12s %12s %8s %8s" % ("clients", "full ms", "merkle ms", "hashes", "speedup"))
+    for clients in args.clients:
+        f, m, h = measure(clients, args.updates, args.depth, args.repeat)
+        print("%9d %12.3f %12.3f %8d %7.1fx" % (clients, f * 1000, m * 1000, h, f / m))
+
+
+if __name__ == "__main__":
+    main()
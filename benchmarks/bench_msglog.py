@@ -0,0 +1,54 @@
+# Benchmark: cost per message of route_receive as the message log grows.
+#
+# Fills the log of a backup with pending requests, then replays the same
+# three-phase workload (PREPREPARE, PREPAREs and COMMITs for a window of
+# slots) through `route_receive`. With the indexed log, the cost per
+# message should stay flat as |in_i| grows.
+#
+# Run with: python benchmarks/bench_msglog.py
+
+import sys
+sys.path += ["."]
+
+import time
+
+from pybft.replica import replica
+
+
+def fill(r, size):
+    # Requests from distinct clients, never proposed: they stay in the log.
+    r.in_i |= set((r._REQUEST, b"pending%d" % x, 1, b"client%d" % x) \
+                  for x in range(size))
+    r.garbage_collect()
+
+
+def workload(r, slots):
+    msgs = []
+    for n in range(1, slots + 1):
+        request = (r._REQUEST, b"message%d" % n, n, b"%d" % n)
+        hm = r.hash(request)
+        msgs += [(r._PREPREPARE, 0, n, request, 0)]
+        msgs += [(r._PREPARE, 0, n, hm, j) for j in range(2, r.R)]
+        msgs += [(r._COMMIT, 0, n, hm, j) for j in range(r.R) if j != r.i]
+    return msgs
+
+
+def main():
+    print("%8s %8s %14s" % ("|in_i|", "msgs", "per msg (us)"))
+    for size in [10, 100, 1000, 10000, 50000]:
+        r = replica(1, 4)
+        fill(r, size)
+        msgs = workload(r, r.max_out - 1)
+        L = len(r.in_i)
+
+        t0 = time.perf_counter()
+        for msg in msgs:
+            r.route_receive(msg)
+        t1 = time.perf_counter()
+
+        assert r.last_exec_i == r.max_out - 1
+        print("%8d %8d %14.2f" % (L, len(msgs), 1e6 * (t1 - t0) / len(msgs)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+# Benchmark: closed-loop throughput of a cluster of TCP servers on
+# loopback, for a few batch sizes.
+#
+# Run with: python benchmarks/bench_net.py
+
+import sys
+sys.path += ["."]
+
+import asyncio
+import time
+
+from pybft.replica import replica
+from pybft.net import server, frame, unframe
+from pybft.codec import wirecodec
+
+
+async def run(f, N, batch_size):
+    R = 3*f + 1
+    servers = []
+    for i in range(R):
+        r = replica(i, R)
+        r.batch_size = batch_size
+        r.batch_timeout = 0.001
+        servers.append(server(r, tick_interval=0.001))
+
+    peers = {}
+    for s in servers:
+        peers[s.rep.i] = await s.start()
+    for s in servers:
+        s.peers = peers
+
+    codec = wirecodec()
+    conns = [await asyncio.open_connection(*peers[j]) for j in range(R)]
+    reqs = [(replica._REQUEST, b"message%d" % x, 10, b"%d" % x) for x in range(N)]
+
+    t0 = time.perf_counter()
+    payload = b"".join(frame(codec.encode(req)) for req in reqs)
+    for _, writer in conns:
+        writer.write(payload)
+        await writer.drain()
+
+    # Wait for f+1 replies to every request.
+    votes = {}
+    done = set()
+
+    async def collect(reader):
+        buf = bytearray()
+        while len(done) < N:
+            data = await reader.read(1 << 16)
+            if not data:
+                return
+            buf += data
+            for p in unframe(buf):
+                (_, v, t, c, i, r) = codec.decode(p)
+                votes[c] = votes.get(c, 0) + 1
+                if votes[c] == f + 1:
+                    done.add(c)
+
+    tasks = [asyncio.ensure_future(collect(reader)) for reader, _ in conns]
+    while len(done) < N:
+        await asyncio.sleep(0.001)
+    t1 = time.perf_counter()
+
+    for t in tasks:
+        t.cancel()
+    for _, writer in conns:
+        writer.close()
+    writes = sum(s.stat["writes"] for s in servers)
+    frames = sum(s.stat["frames_out"] for s in servers)
+    for s in servers:
+        await s.close()
+    return N / (t1 - t0), frames / float(writes)
+
+
+def main():
+    print("%3s %6s %6s %12s %14s" % ("f", "N", "batch", "requests/s", "frames/write"))
+    for f in [1, 2]:
+        for batch_size in [1, 10, 50]:
+            N = 500
+            rate, coalesce = asyncio.run(run(f, N, batch_size))
+            print("%3d %6d %6d %12.1f %14.1f" % (f, N, batch_size, rate, coalesce))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+# Benchmark suite: memory held by the message logs, with and without the
+# request store.
+#
+# Runs a simulated cluster (see pybft.sim) delivering decoded copies of
+# every message, as a transport does, for requests with payloads of
+# increasing size, then has every replica start a view change, so that
+# the VIEWCHANGEs carry the prepared requests since the last checkpoint.
+# Measures the bytes held by the log of each replica, counting objects
+# shared between messages once, at their peak over the run and at its
+# end, with the store interning request bodies and without.
+#
+# Run with: python benchmarks/bench_request_store.py [--f 1 2] [--size 1024 65536]
+#                                                    [--n 39] [--every 10]
+
+import sys
+sys.path += ["."]
+
+import argparse
+import heapq
+
+from pybft.replica import replica
+from pybft.sim import simulator, CLIENT
+from pybft.store import footprint
+
+
+def run(f, N, size, interned, every):
+    sim = simulator(f=f, seed=1, wire=True)
+    peak = [0]
+    for r in sim.replicas:
+        if not interned:
+            r.in_i.watchers.remove(r.store)
+            r.store = None
+        deliveries = [0]
+        def sampled(msg, r=r, deliver=r.route_receive, deliveries=deliveries):
+            deliver(msg)
+            deliveries[0] += 1
+            if deliveries[0] % every == 0:
+                peak[0] = max(peak[0], footprint(r.in_i))
+        r.route_receive = sampled
+
+    reqs = [(replica._REQUEST, (b"%08d" % x) * (size // 8), x // 10 + 1, \
+             b"client%d" % (x % 10)) for x in range(N)]
+    rep = sim.run(reqs)
+    assert rep["requests"] == N, rep
+
+    # Every replica moves to the next view, and their VIEWCHANGEs are
+    # delivered until none is left in flight.
+    for r in sim.replicas:
+        r.send_viewchange(r.view_i + 1)
+        sim.flush(r)
+    while any(kind == "deliver" for (_, _, kind, _) in sim.events):
+        t, _, kind, data = heapq.heappop(sim.events)
+        sim.now = t
+        if kind == "deliver" and data[0] != CLIENT:
+            r = sim.replicas[data[0]]
+            r.route_receive(data[1])
+            sim.flush(r)
+
+    return peak[0], max(footprint(r.in_i) for r in sim.replicas)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--f", type=int, nargs="+", default=[1, 2])
+    parser.add_argument("--size", type=int, nargs="+", default=[64, 1024, 16384, 65536])
+    parser.add_argument("--n", type=int, default=39, \
+                        help="requests; the ones after the last checkpoint stay in the log")
+    parser.add_argument("--every", type=int, default=10)
+    args = parser.parse_args()
+
+    print("%4s %8s %8s %12s %12s %8s" % ("f", "payload", "log", "plain (KB)", \
+          "store (KB)", "saving"))
+    for f in args.f:
+        for size in args.size:
+            plain = run(f, args.n, size, False, args.every)
+            shared = run(f, args.n, size, True, args.every)
+            for k, phase in enumerate(["peak", "end"]):
+                print("%4d %8d %8s %12.1f %12.1f %7.1f%%" % (f, size, phase, \
+                      plain[k] / 1024.0, shared[k] / 1024.0, \
+                      100.0 * (plain[k] - shared[k]) / plain[k]))
+            sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
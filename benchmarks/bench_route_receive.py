@@ -0,0 +1,133 @@
+# Benchmark suite: throughput of route_receive across cluster sizes.
+#
+# Replays a fixed, normal-case workload against a backup (replica 1) for
+# every cluster size f and request count N: per request a REQUEST from
+# the client, the PREPREPARE of the primary, the PREPAREs of the other
+# backups and the COMMITs of all the other replicas, plus the CHECKPOINTs
+# of the other replicas every chkpt_int slots so the window keeps moving.
+# Requests come from a fixed population of clients, so checkpoints keep a
+# bounded size.
+#
+# Records messages per second, time spent per message type and the peak
+# size of in_i, prints a table and optionally writes JSON results, to
+# compare runs before and after a change.
+#
+# With --probes, the replica is instrumented (see pybft.instrument) and
+# the time of every internal step is printed after each run.
+#
+# Run with: python benchmarks/bench_route_receive.py [--f 1 2] [--n 100 1000]
+#                                                    [--json results.json] [--probes]
+
+import sys
+sys.path += ["."]
+
+import argparse
+import json
+import platform
+import time
+from collections import defaultdict
+
+from pybft.replica import replica
+from pybft.instrument import probes
+from pybft.merkle import merkle, checkpoint_digest
+
+
+CLIENTS = 100
+
+
+def workload(r, N):
+    # Yields the messages a backup receives for N requests, in order.
+    R = r.R
+    tree = merkle(r.chkpts.depth)
+    for n in range(1, N + 1):
+        c = b"client%d" % (n % CLIENTS)
+        t = n // CLIENTS + 1
+        request = (r._REQUEST, b"operation%d" % n, t, c)
+        hm = r.hash(request)
+        yield request
+        yield (r._PREPREPARE, 0, n, request, 0)
+        for j in range(1, R):
+            if j != r.i:
+                yield (r._PREPARE, 0, n, hm, j)
+        for j in range(R):
+            if j != r.i:
+                yield (r._COMMIT, 0, n, hm, j)
+
+        # The checkpoint every replica takes with the null service.
+        tree.update(c, (t, None))
+        if n % r.chkpt_int == 0:
+            chkpt = checkpoint_digest(None, tree.root())
+            for j in range(R):
+                if j != r.i:
+                    yield (r._CHECKPOINT, 0, n, chkpt, j)
+
+
+def run(f, N, instrument=False):
+    r = replica(1, 3*f + 1)
+    p = probes(r)
+    if instrument:
+        p.enable()
+    clock = time.perf_counter
+    per_type = defaultdict(float)
+    counts = defaultdict(int)
+    peak = 0
+
+    for msg in workload(r, N):
+        t0 = clock()
+        r.route_receive(msg)
+        per_type[msg[0]] += clock() - t0
+        counts[msg[0]] += 1
+        r.out_i.drain()
+        L = len(r.in_i)
+        if L > peak:
+            peak = L
+
+    assert r.last_exec_i == N, (f, N, r.last_exec_i)
+    if instrument:
+        print(p.text())
+    total = sum(per_type.values())
+    msgs = sum(counts.values())
+    return {
+        "f": f,
+        "R": r.R,
+        "requests": N,
+        "messages": msgs,
+        "seconds": total,
+        "msgs_per_sec": msgs / total,
+        "us_per_msg": dict((k, 1e6 * per_type[k] / counts[k]) for k in counts),
+        "peak_in_i": peak,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--f", type=int, nargs="+", default=[1, 2, 3, 5, 10])
+    parser.add_argument("--n", type=int, nargs="+", default=[100, 1000, 10000, 100000])
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--probes", action="store_true", \
+                        help="print the time of every internal step")
+    args = parser.parse_args()
+
+    types = [replica._REQUEST, replica._PREPREPARE, replica._PREPARE, \
+             replica._COMMIT, replica._CHECKPOINT]
+    print("%4s %8s %10s %10s %8s  %s" % ("f", "requests", "messages", "msgs/s", \
+          "peak", "us/msg " + " ".join(t.strip("_")[:6] for t in types)))
+
+    results = []
+    for f in args.f:
+        for N in args.n:
+            res = run(f, N, args.probes)
+            results.append(res)
+            print("%4d %8d %10d %10.0f %8d  %s" % (f, N, res["messages"], \
+                  res["msgs_per_sec"], res["peak_in_i"], \
+                  " ".join("%6.1f" % res["us_per_msg"][t] for t in types)))
+            sys.stdout.flush()
+
+    if args.json:
+        with open(args.json, "w") as out:
+            json.dump({"python": platform.python_version(), "time": time.time(), \
+                       "results": results}, out, indent=1, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
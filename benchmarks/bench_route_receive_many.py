@@ -0,0 +1,67 @@
+# Benchmark suite: throughput of route_receive_many against route_receive.
+#
+# Replays the normal-case workload of bench_route_receive against a
+# backup, delivering the messages one by one with route_receive, then in
+# batches of increasing size with route_receive_many, as a transport does
+# with the messages of one read. Checks that every run ends in the same
+# state, and prints the best messages per second of a few repeats and
+# the gain over sequential delivery for every batch size.
+#
+# Run with: python benchmarks/bench_route_receive_many.py [--f 1 3] [--n 1000]
+#                                                         [--batch 4 16 64] [--repeat 3]
+
+import sys
+sys.path += [".", "benchmarks"]
+
+import argparse
+import time
+
+from pybft.replica import replica
+from bench_route_receive import workload
+
+
+def run(f, N, batch):
+    r = replica(1, 3*f + 1)
+    msgs = list(workload(r, N))
+    clock = time.perf_counter
+
+    total = 0.0
+    for i in range(0, len(msgs), batch):
+        t0 = clock()
+        if batch == 1:
+            r.route_receive(msgs[i])
+        else:
+            r.route_receive_many(msgs[i:i+batch])
+        total += clock() - t0
+        r.out_i.drain()
+
+    assert r.last_exec_i == N, (f, N, batch, r.last_exec_i)
+    return len(msgs) / total, (r.last_exec_i, frozenset(r.in_i), frozenset(r.checkpts_i))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--f", type=int, nargs="+", default=[1, 3, 5])
+    parser.add_argument("--n", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--batch", type=int, nargs="+", default=[4, 16, 64])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    def best(f, N, batch):
+        runs = [run(f, N, batch) for _ in range(args.repeat)]
+        return max(rate for rate, _ in runs), runs[0][1]
+
+    print("%4s %8s %6s %10s %6s" % ("f", "requests", "batch", "msgs/s", "gain"))
+    for f in args.f:
+        for N in args.n:
+            base, state = best(f, N, 1)
+            print("%4d %8d %6d %10.0f %6.2f" % (f, N, 1, base, 1.0))
+            for batch in args.batch:
+                rate, state_b = best(f, N, batch)
+                assert state_b == state, (f, N, batch)
+                print("%4d %8d %6d %10.0f %6.2f" % (f, N, batch, rate, rate / base))
+            sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+# Benchmark suite: checkpoints in memory against checkpoints on disk.
+#
+# For reply tables of increasing size, takes `checkpoints` checkpoints of
+# `updates` executions each, the stable one trailing by `window`, with
+# the checkpoints held in memory and with pybft.snapstore. Prints the
+# memory the held checkpoints reference at the end, the time and
+# bytes written per checkpoint, and for the store the time to restart a
+# replica from it. Memory grows with the clients in memory, and stays flat
+# on disk.
+#
+# Run with: python benchmarks/bench_snapstore.py [--clients 1000 10000 100000]
+#                                                [--checkpoints 50] [--updates 100]
+#                                                [--window 3] [--dir /path/on/disk]
+
+import sys
+sys.path += ["."]
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+from sys import getsizeof
+
+from pybft.replica import replica
+from pybft.snapstore import snapstore
+
+
+def deep(x):
+    # Bytes reachable from x, counting shared objects once.
+    seen, total, stack = set(), 0, [x]
+    while stack:
+        y = stack.pop()
+        if id(y) in seen:
+            continue
+        seen.add(id(y))
+        total += getsizeof(y)
+        if isinstance(y, dict):
+            stack.extend(y.keys())
+            stack.extend(y.values())
+        elif isinstance(y, (tuple, list)):
+            stack.extend(y)
+        elif hasattr(y, "__dict__") and not isinstance(y, type):
+            stack.extend(v for v in vars(y).values() if isinstance(v, (dict, tuple, list)))
+    return total
+
+
+def run(clients, checkpoints, updates, window, path):
+    r = replica(0, 4)
+    for c in range(clients):
+        r.chkpts.update(b"client%d" % c, 1, b"result")
+
+    s = None
+    if path is not None:
+        s = snapstore(path)
+        s.attach(r)
+
+    took = 0.0
+    for k in range(1, checkpoints + 1):
+        for u in range(updates):
+            r.chkpts.update(b"client%d" % ((k * updates + u) % clients), k + 1, b"result")
+        t0 = time.perf_counter()
+        r.to_checkpoint(10 * k)
+        if k > window:
+            r.chkpts.stable(10 * (k - window))
+        took += time.perf_counter() - t0
+
+    held = deep(r.chkpts.held)
+    if s is None:
+        return held, took / checkpoints, None, None
+
+    written = s.stat["bytes"] / float(checkpoints)
+    s.close()
+    t0 = time.perf_counter()
+    snapstore(path).recover(replica(0, 4))
+    return held, took / checkpoints, written, time.perf_counter() - t0
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--checkpoints", type=int, default=50)
+    parser.add_argument("--updates", type=int, default=100)
+    parser.add_argument("--window", type=int, default=3)
+    parser.add_argument("--dir", default=None)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp(dir=args.dir)
+    try:
+        print("%8s %8s %10s %10s %12s %11s" % \
+              ("clients", "held in", "MB", "ms/chkpt", "bytes/chkpt", "restart ms"))
+        for clients in args.clients:
+            held, took, _, _ = run(clients, args.checkpoints, args.updates, args.window, None)
+            print("%8d %8s %10.2f %10.3f" % (clients, "memory", held / 1e6, took * 1e3))
+            path = os.path.join(tmp, "chk%d" % clients)
+            held, took, written, restart = run(clients, args.checkpoints, args.updates, \
+                                               args.window, path)
+            print("%8d %8s %10.2f %10.3f %12d %11.1f" % (clients, "disk", held / 1e6, \
+                  took * 1e3, written, restart * 1e3))
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__ == "__main__":
+    main()
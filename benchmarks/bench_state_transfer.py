@@ -0,0 +1,97 @@
+# Benchmark suite: catching up a replica by state transfer.
+#
+# Cuts replica 3 of an f=1 simulation off while the others order `lag`
+# requests from a fixed set of `clients`, then heals the links and keeps
+# the load going until replica 3 installed a checkpoint fetched from its
+# peers. Prints the simulated time from the heal to the install, less the
+# patience before a transfer starts, and the bytes of state received. The
+# log the replica missed grows with the lag, its state with the clients:
+# the time follows the bytes, and the bytes the clients only.
+#
+# Run with: python benchmarks/bench_state_transfer.py [--lag 100 400 1600]
+#                                                     [--clients 100 1000 5000]
+#                                                     [--bandwidth 1.25e7]
+
+import sys
+sys.path += ["."]
+
+import argparse
+
+from pybft.replica import replica
+from pybft.sim import simulator, link
+
+
+class tally(simulator):
+    # Counts the bytes of state delivered to replica 3.
+
+    state_bytes = 0
+
+    def send(self, src, dst, msg):
+        if msg[0] == replica._STATE and dst == 3:
+            self.state_bytes += len(self.codec.encode(msg))
+        simulator.send(self, src, dst, msg)
+
+
+def requests(t, clients):
+    # One request of every client, at timestamp t: a client never has two
+    # requests outstanding.
+    return [(replica._REQUEST, b"op%d.%d" % (t, c), t, b"%d" % c) for c in range(clients)]
+
+
+def catch_up(lag, clients, bandwidth):
+    sim = tally(f=1, seed=1, default_link=link(bandwidth=bandwidth), retry=0.2)
+    cut = link(loss=1.0)
+    for j in range(3):
+        sim.set_link(j, 3, cut)
+        sim.set_link(3, j, cut)
+
+    # Every client has an entry in the state, then more rounds make the
+    # lag.
+    t = 1
+    sim.run(requests(t, clients), in_flight=50)
+    while sim.replicas[0].last_exec_i < clients + lag:
+        t += 1
+        sim.run(requests(t, min(clients, clients + lag - sim.replicas[0].last_exec_i)), \
+                in_flight=50)
+
+    for j in range(3):
+        sim.set_link(j, 3, link(bandwidth=bandwidth))
+        sim.set_link(3, j, link(bandwidth=bandwidth))
+    healed = sim.now
+
+    r3 = sim.replicas[3]
+    installed = []
+    install = r3.transfer.install
+    def timed():
+        install()
+        installed.append(sim.now)
+    r3.transfer.install = timed
+
+    while not installed and t < 100:
+        t += 1
+        sim.run(requests(t, min(clients, 100)), in_flight=10)
+    if not installed:
+        return None, sim.state_bytes, r3.transfer.stat["chunks"]
+    took = installed[0] - healed - r3.transfer.patience
+    return took, sim.state_bytes, r3.transfer.stat["chunks"]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lag", type=int, nargs="+", default=[100, 400, 1600])
+    parser.add_argument("--clients", type=int, nargs="+", default=[100, 1000, 5000])
+    parser.add_argument("--bandwidth", type=float, default=1.25e7)
+    args = parser.parse_args()
+
+    print("%6s %8s %10s %10s %7s" % ("lag", "clients", "time ms", "KB", "chunks"))
+    for clients in args.clients:
+        for lag in args.lag:
+            took, size, chunks = catch_up(lag, clients, args.bandwidth)
+            if took is None:
+                print("%6d %8d %10s" % (lag, clients, "-"))
+                continue
+            print("%6d %8d %10.1f %10.1f %7d" % (lag, clients, took * 1000, size / 1024.0, chunks))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+# Benchmark suite: cost of the write-ahead log on local disk.
+#
+# First appends PREPARE records straight to a log, with an fsync for every
+# record and with group commit over groups of increasing size, and prints
+# records per second and fsyncs. Then replays the normal-case workload of
+# bench_route_receive against a backup without a log, with a log synced
+# for every message (the outbox drains after each one), and with a log
+# synced once per batch of messages delivered with route_receive_many.
+#
+# Run with: python benchmarks/bench_wal.py [--records 2000] [--group 1 8 64 512]
+#                                          [--f 1 3] [--n 200] [--batch 64]
+#                                          [--dir /path/on/disk]
+
+import sys
+sys.path += [".", "benchmarks"]
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from pybft.replica import replica
+from pybft.wal import wal
+from bench_route_receive import workload
+
+
+def appends(path, records, group):
+    if os.path.exists(path):
+        os.remove(path)
+    w = wal(path, group=group)
+    msgs = [(replica._PREPARE, 0, n, "%064x" % n, 1) for n in range(records)]
+    t0 = time.perf_counter()
+    for msg in msgs:
+        w.append(("M", msg))
+    w.close()
+    return records / (time.perf_counter() - t0), w.stat["fsyncs"]
+
+
+def replay(path, f, N, batch, logged):
+    if os.path.exists(path):
+        os.remove(path)
+    r = replica(1, 3*f + 1)
+    w = wal(path, group=1 << 20)
+    if logged:
+        w.attach(r)
+    msgs = list(workload(r, N))
+    t0 = time.perf_counter()
+    for i in range(0, len(msgs), batch):
+        if batch == 1:
+            r.route_receive(msgs[i])
+        else:
+            r.route_receive_many(msgs[i:i+batch])
+        r.out_i.drain()
+    total = time.perf_counter() - t0
+    assert r.last_exec_i == N
+    return len(msgs) / total, w.stat["fsyncs"] + w.stat["compactions"]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--records", type=int, default=2000)
+    parser.add_argument("--group", type=int, nargs="+", default=[1, 8, 64, 512])
+    parser.add_argument("--f", type=int, nargs="+", default=[1, 3])
+    parser.add_argument("--n", type=int, default=200)
+    parser.add_argument("--batch", type=int, default=64)
+    parser.add_argument("--dir", help="directory for the logs, on the disk to measure")
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp(dir=args.dir)
+    path = os.path.join(tmp, "wal")
+    try:
+        print("%8s %8s %12s %8s" % ("records", "group", "records/s", "fsyncs"))
+        for group in args.group:
+            rate, fsyncs = appends(path, args.records, group)
+            print("%8d %8d %12.0f %8d" % (args.records, group, rate, fsyncs))
+            sys.stdout.flush()
+
+        print()
+        print("%4s %8s %16s %10s %8s" % ("f", "requests", "log", "msgs/s", "fsyncs"))
+        for f in args.f:
+            for name, batch, logged in [("none", 1, False), ("per message", 1, True), \
+                                        ("per batch", args.batch, True)]:
+                rate, fsyncs = replay(path, f, args.n, batch, logged)
+                print("%4d %8d %16s %10.0f %8d" % (f, args.n, name, rate, fsyncs))
+                sys.stdout.flush()
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+# Admission control for client requests. A replica only logs a new
+# request while its client has fewer than `per_client` requests in the
+# log, and the log fewer than `total` requests overall; otherwise the
+# client gets a _BUSY signal and should retry later. The requests in the
+# log are counted from the per-client index of the collector, so the
+# bounds cost two lookups per request. Requests ordered by the primary,
+# inside accepted PREPREPAREs, are not subject to admission; those taken
+# from rejected PREPREPAREs are.
+#
+# The requests awaiting a PREPREPARE at the primary are served round
+# robin across clients, and in arrival order for each client, so that a
+# client sending many requests cannot delay the others.
+
+from collections import Counter, OrderedDict, deque
+
+
+class admission(object):
+
+    def __init__(self, rep, per_client=16, total=10000):
+        self.rep = rep
+        self.per_client = per_client
+        self.total = total
+        self.stat = Counter()
+
+    def admit(self, msg):
+        rep = self.rep
+        if msg in rep.in_i:
+            return True
+        if len(rep.gc.by_client.get(msg[3], ())) >= self.per_client:
+            self.stat["client_busy"] += 1
+            return False
+        if len(rep.in_i.of_type(rep._REQUEST)) >= self.total:
+            self.stat["busy"] += 1
+            return False
+        self.stat["admitted"] += 1
+        return True
+
+    def busy(self, msg):
+        # The signal for a client whose request was not admitted.
+        rep = self.rep
+        (_, o, t, c) = msg
+        return (rep._BUSY, rep.view_i, t, c, rep.i)
+
+
+class pending(object):
+    # Requests awaiting a PREPREPARE, with their arrival times.
+
+    def __init__(self):
+        # Request -> arrival time, in arrival order.
+        self.since = OrderedDict()
+
+        # Client -> its requests in arrival order, in round robin order.
+        self.clients = OrderedDict()
+
+    def __len__(self):
+        return len(self.since)
+
+    def __contains__(self, req):
+        return req in self.since
+
+    def __iter__(self):
+        return iter(list(self.since))
+
+    def __setitem__(self, req, since):
+        if req in self.since:
+            return
+        self.since[req] = since
+        q = self.clients.get(req[3])
+        if q is None:
+            q = self.clients[req[3]] = deque()
+        q.append(req)
+
+    def pop(self):
+        # The next request, and its arrival time, round robin by client.
+        c, q = next(iter(self.clients.items()))
+        req = q.popleft()
+        if q:
+            self.clients.move_to_end(c)
+        else:
+            del self.clients[c]
+        return req, self.since.pop(req)
+
+    def push_front(self, req, since):
+        # Put a popped request back, to be served first.
+        self.since[req] = since
+        self.since.move_to_end(req, last=False)
+        c = req[3]
+        q = self.clients.get(c)
+        if q is None:
+            q = self.clients[c] = deque()
+        q.appendleft(req)
+        self.clients.move_to_end(c, last=False)
@@ -0,0 +1,130 @@
+# Incremental quorum certificates. The book watches the message log of a
+# replica, and counts the distinct PREPARE and COMMIT senders of each
+# (view, seqno, digest) as messages arrive, so that the prepared and
+# commited predicates become lookups. The null PREPREPAREs of a new view
+# count like any other, under the NULL digest (see pybft.digest).
+#
+# The book also records which seqno slots were touched by new messages
+# since the replica last made progress.
+
+
+class certificate(object):
+
+    __slots__ = ["v", "n", "d", "f", "preprepare", "prepares", "commits"]
+
+    def __init__(self, v, n, d, f):
+        self.v, self.n, self.d, self.f = v, n, d, f
+        self.preprepare = None
+        self.prepares = set()
+        self.commits = set()
+
+    def prepared(self):
+        return self.preprepare is not None and len(self.prepares) >= 2*self.f
+
+    def committed(self):
+        return len(self.commits) >= 2*self.f + 1
+
+    def empty(self):
+        return self.preprepare is None and not self.prepares and not self.commits
+
+
+class certificates(object):
+
+    def __init__(self, rep):
+        self.rep = rep
+        self.certs = {}
+
+        # Number of PREPREPAREs from a primary per (seqno, digest), in any view.
+        self.proposed = {}
+
+        # PREPREPAREs from a primary per seqno, and slots touched.
+        self.at_n = {}
+        self.touched = set()
+
+        # PREPREPAREs from a primary per request they order.
+        self.by_request = {}
+
+    def get(self, v, n, d):
+        return self.certs.get((v, n, d))
+
+    def is_proposed(self, n, d):
+        return (n, d) in self.proposed
+
+    def proposals(self, req):
+        return self.by_request.get(req, ())
+
+    def preprepares(self, n):
+        return self.at_n.get(n, ())
+
+    def take_touched(self):
+        touched, self.touched = self.touched, set()
+        return touched
+
+    def _cert(self, v, n, d):
+        key = (v, n, d)
+        cert = self.certs.get(key)
+        if cert is None:
+            cert = certificate(v, n, d, self.rep.f)
+            self.certs[key] = cert
+        return cert
+
+    def _clean(self, cert):
+        if cert.empty():
+            del self.certs[(cert.v, cert.n, cert.d)]
+
+    # Watcher interface of the message log.
+
+    def added(self, msg, d):
+        xtype, rep = msg[0], self.rep
+        if xtype == rep._PREPARE:
+            (_, v, n, _, j) = msg
+            if j != rep.primary(v):
+                self._cert(v, n, d).prepares.add(j)
+                self.touched.add(n)
+
+        elif xtype == rep._COMMIT:
+            (_, v, n, _, j) = msg
+            self._cert(v, n, d).commits.add(j)
+            self.touched.add(n)
+
+        elif xtype == rep._PREPREPARE:
+            (_, v, n, _, j) = msg
+            if j == rep.primary(v):
+                self._cert(v, n, d).preprepare = msg
+                self.proposed[(n, d)] = self.proposed.get((n, d), 0) + 1
+                self.at_n.setdefault(n, set()).add(msg)
+                self.touched.add(n)
+                for req in rep.requests_of(msg[3]):
+                    self.by_request.setdefault(req, set()).add(msg)
+
+    def discarded(self, msg, d):
+        xtype, rep = msg[0], self.rep
+        if xtype == rep._PREPARE or xtype == rep._COMMIT:
+            (_, v, n, _, j) = msg
+            cert = self.certs.get((v, n, d))
+            if cert is not None:
+                if xtype == rep._PREPARE:
+                    cert.prepares.discard(j)
+                else:
+                    cert.commits.discard(j)
+                self._clean(cert)
+
+        elif xtype == rep._PREPREPARE:
+            (_, v, n, _, j) = msg
+            cert = self.certs.get((v, n, d))
+            if cert is not None and cert.preprepare == msg:
+                cert.preprepare = None
+                self._clean(cert)
+
+                self.proposed[(n, d)] -= 1
+                if self.proposed[(n, d)] == 0:
+                    del self.proposed[(n, d)]
+
+                self.at_n[n].discard(msg)
+                if not self.at_n[n]:
+                    del self.at_n[n]
+
+                for req in rep.requests_of(msg[3]):
+                    self.by_request[req].discard(msg)
+                    if not self.by_request[req]:
+                        del self.by_request[req]
@@ -0,0 +1,154 @@
+# A client library. A client orders operations through the replicas with
+# their (t, c) scheme: every request carries a timestamp, increasing for
+# its client id, and a replica executes a request only if its timestamp
+# is newer than the last one it executed for that id, and replies with
+# (_REPLY, v, t, c, i, result). An operation completes once f+1 replicas
+# sent the same result for its request, as at least one of them is
+# correct.
+#
+# A request goes to the primary of the last view seen in replies, or to
+# every replica with `multicast`, as they should when PREPREPAREs only
+# carry digests. A request not complete after `timeout` is re-sent to
+# every replica, the timeout doubling up to `max_timeout` at each retry;
+# a _BUSY signal only pushes the next retry back.
+#
+# Since a replica keeps a single timestamp per client id, a request
+# overtaken by a newer one of the same id would never execute. A client
+# with a `window` of outstanding requests therefore spreads them over as
+# many lanes, ids c/0, c/1, ..., each with its own timestamps and at most
+# one request outstanding; with a window of 1 the only lane is c. Ids are
+# bytes, and should not end in /<k> themselves, or lanes could collide.
+#
+# To the replicas every lane is a client of its own: it costs an entry in
+# the reply table, hence a leaf of the Merkle tree of every checkpoint
+# (see pybft.merkle), for as long as the replicas run, and it has its own
+# admission bound (see pybft.admission). Windows should stay small, a few
+# times the batch size of the primary at most.
+#
+# Like the replica, the client does no I/O: transports deliver messages
+# with `receive`, call `tick` periodically, and send what `drain` returns
+# (see pybft.sim for a closed loop driven by clients).
+
+from collections import Counter, OrderedDict, deque
+from time import perf_counter
+
+from pybft.replica import replica
+
+
+class client(object):
+
+    def __init__(self, c, R, window=1, timeout=0.1, max_timeout=1.0, multicast=False):
+        if not isinstance(c, bytes):
+            raise TypeError("Client id must be bytes, not %s" % type(c).__name__)
+        if window < 1:
+            raise ValueError("Window must be at least 1: %d" % window)
+        self.c = c
+        self.R = R
+        self.f = (R - 1) // 3
+        self.window = window
+        self.timeout = timeout
+        self.max_timeout = max_timeout
+        self.multicast = multicast
+        self.clock = perf_counter
+
+        # Lanes, the last timestamp of each, and those without a request.
+        if window == 1:
+            self.lanes = [c]
+        else:
+            self.lanes = [c + b"/%d" % k for k in range(window)]
+        self.last_t = dict((lane, 0) for lane in self.lanes)
+        self.idle = deque(self.lanes)
+
+        # Operations waiting for a lane, and (t, lane) -> [request, sent
+        # at, retry at, timeout, {result: {replica: view}}] for the
+        # outstanding ones.
+        self.queue = deque()
+        self.outstanding = OrderedDict()
+        self.view = 0
+
+        # Messages to send as (destination, msg), and the operations
+        # completed as (o, result) since the last call to `completed`.
+        self.out = []
+        self.done = []
+
+        self.latencies = []
+        self.stat = Counter()
+
+    def primary(self):
+        return self.view % self.R
+
+    def submit(self, o):
+        self.queue.append(o)
+        self.fill()
+
+    def fill(self):
+        # Start the waiting operations on the idle lanes.
+        now = self.clock()
+        while self.queue and self.idle:
+            lane = self.idle.popleft()
+            self.last_t[lane] += 1
+            req = (replica._REQUEST, self.queue.popleft(), self.last_t[lane], lane)
+            self.outstanding[(req[2], lane)] = [req, now, now + self.timeout, self.timeout, {}]
+            self.send(req, self.multicast)
+            self.stat["requests"] += 1
+
+    def send(self, req, everyone):
+        if everyone:
+            self.out += [(j, req) for j in range(self.R)]
+        else:
+            self.out.append((self.primary(), req))
+
+    def receive(self, msg):
+        xtype = msg[0]
+        if xtype == replica._REPLY and len(msg) == 6:
+            (_, v, t, c, i, result) = msg
+            entry = self.outstanding.get((t, c))
+            if entry is None or not isinstance(i, int) or not 0 <= i < self.R:
+                return
+            votes = entry[4].setdefault(result, {})
+            votes[i] = v
+            if len(votes) > self.f:
+                self.complete((t, c), result, votes)
+
+        elif xtype == replica._BUSY and len(msg) == 5:
+            (_, v, t, c, i) = msg
+            entry = self.outstanding.get((t, c))
+            if entry is not None:
+                entry[2] = self.clock() + entry[3]
+                self.stat["busy"] += 1
+
+    def complete(self, key, result, votes):
+        (req, sent, _, _, _) = self.outstanding.pop(key)
+        # f+1 replicas are in a view at least as high as the lowest one
+        # among them.
+        self.view = max(self.view, sorted(votes.values())[-(self.f + 1)])
+        self.done.append((req[1], result))
+        self.latencies.append(self.clock() - sent)
+        self.idle.append(key[1])
+        self.stat["completed"] += 1
+        self.fill()
+
+    def tick(self):
+        # Re-send to every replica the requests past their timeout.
+        now = self.clock()
+        for entry in self.outstanding.values():
+            if now >= entry[2]:
+                entry[3] = min(2 * entry[3], self.max_timeout)
+                entry[2] = now + entry[3]
+                self.send(entry[0], True)
+                self.stat["retries"] += 1
+
+    def drain(self):
+        # The messages to send as [(replica, [msgs])], in order.
+        bundles = OrderedDict()
+        for j, msg in self.out:
+            bundles.setdefault(j, []).append(msg)
+        self.out = []
+        return list(bundles.items())
+
+    def completed(self):
+        done, self.done = self.done, []
+        return done
+
+    def busy(self):
+        return len(self.outstanding) + len(self.queue) > 0
@@ -0,0 +1,175 @@
+# A compact binary wire codec for replica messages. Values are encoded
+# with a one byte tag followed by struct-packed fields; protocol messages
+# are tuples starting with a type tag, and travel with the numeric type
+# code of that tag instead of its string. PREPAREs and COMMITs, the bulk
+# of the traffic, have a fixed layout carrying their SHA256 digest as 32
+# raw bytes.
+#
+# The decoder reads from a memoryview over the buffer and only copies the
+# leaf bytes and strings out of it. It never builds anything but None,
+# booleans, numbers, bytes, strings, tuples and frozensets, so it is safe
+# to use across a trust boundary.
+#
+# That safety is what it buys over pickle, which is neither. It costs
+# speed and, for large messages, size: written in Python, it encodes and
+# decodes 3 to 10 times slower than pickle, and while PREPAREs and COMMITs
+# take about half the bytes, batches and VIEWCHANGEs take 10 to 30% more:
+# every integer takes 8 bytes and every length 4, where pickle uses one or
+# two for small ones (see benchmarks/bench_codec.py).
+
+from struct import Struct
+
+from pybft.replica import replica
+
+
+# Numeric type codes of the protocol messages.
+CODES = {
+    replica._PREPREPARE : 1000,
+    replica._PREPARE    : 1001,
+    replica._REPLY      : 1002,
+    replica._REQUEST    : 1003,
+    replica._COMMIT     : 1004,
+    replica._VIEWCHANGE : 1005,
+    replica._NEWVIEW    : 1006,
+    replica._CHECKPOINT : 1007,
+    replica._BATCH      : 1008,
+    replica._BUSY       : 1009,
+    replica._REF        : 1010,
+    replica._FETCH      : 1011,
+    replica._GETSTATE   : 1012,
+    replica._STATE      : 1013,
+}
+TYPES = dict((code, xtype) for (xtype, code) in CODES.items())
+
+_U8 = Struct(">B")
+_U16 = Struct(">H")
+_U32 = Struct(">I")
+_I64 = Struct(">q")
+_F64 = Struct(">d")
+_VOTE = Struct(">Hqq32sI")
+
+_MIN_I64, _MAX_I64 = -(1 << 63), (1 << 63) - 1
+_HEX = frozenset("0123456789abcdef")
+
+
+class wirecodec(object):
+
+    def encode(self, msg):
+        out = []
+        self._enc(msg, out)
+        return b"".join(out)
+
+    def decode(self, buf):
+        mv = memoryview(buf)
+        try:
+            x, pos = self._dec(mv, 0)
+        except Exception as e:
+            raise ValueError("Malformed message: %s" % e)
+        if pos != len(mv):
+            raise ValueError("Trailing bytes after message")
+        return x
+
+    # Encoder
+
+    def _enc(self, x, out):
+        t = type(x)
+        if t is tuple:
+            self._enc_tuple(x, out)
+        elif t is bytes:
+            out.append(b"b" + _U32.pack(len(x)))
+            out.append(x)
+        elif t is int:
+            if _MIN_I64 <= x <= _MAX_I64:
+                out.append(b"i" + _I64.pack(x))
+            else:
+                s = str(x).encode("ascii")
+                out.append(b"J" + _U32.pack(len(s)) + s)
+        elif x is None:
+            out.append(b"N")
+        elif t is str:
+            s = x.encode("utf-8")
+            out.append(b"s" + _U32.pack(len(s)))
+            out.append(s)
+        elif t is bool:
+            out.append(b"1" if x else b"0")
+        elif t is float:
+            out.append(b"d" + _F64.pack(x))
+        elif t is frozenset:
+            out.append(b"f" + _U32.pack(len(x)))
+            for y in x:
+                self._enc(y, out)
+        else:
+            raise TypeError("Cannot encode %s" % t.__name__)
+
+    def _enc_tuple(self, x, out):
+        code = CODES.get(x[0]) if x and type(x[0]) is str and len(x) <= 256 else None
+        if code is None:
+            out.append(b"t" + _U32.pack(len(x)))
+            for y in x:
+                self._enc(y, out)
+            return
+
+        if (code == 1001 or code == 1004) and len(x) == 5:
+            (_, v, n, d, j) = x
+            if type(v) is int and type(n) is int and type(j) is int and \
+               _MIN_I64 <= v <= _MAX_I64 and _MIN_I64 <= n <= _MAX_I64 and \
+               0 <= j < (1 << 32) and type(d) is str and len(d) == 64 and \
+               _HEX.issuperset(d):
+                out.append(b"v" + _VOTE.pack(code, v, n, bytes.fromhex(d), j))
+                return
+
+        out.append(b"m" + _U16.pack(code) + _U8.pack(len(x) - 1))
+        for y in x[1:]:
+            self._enc(y, out)
+
+    # Decoder
+
+    def _dec(self, mv, pos):
+        tag = mv[pos]
+        pos += 1
+        if tag == 0x76: # v
+            (code, v, n, d, j) = _VOTE.unpack_from(mv, pos)
+            return (TYPES[code], v, n, d.hex(), j), pos + _VOTE.size
+        elif tag == 0x6d: # m
+            (code,) = _U16.unpack_from(mv, pos)
+            (size,) = _U8.unpack_from(mv, pos + 2)
+            pos += 3
+            items = [TYPES[code]]
+            for _ in range(size):
+                y, pos = self._dec(mv, pos)
+                items.append(y)
+            return tuple(items), pos
+        elif tag == 0x62: # b
+            (size,) = _U32.unpack_from(mv, pos)
+            pos += 4
+            return self._take(mv, pos, size).tobytes(), pos + size
+        elif tag == 0x69: # i
+            return _I64.unpack_from(mv, pos)[0], pos + 8
+        elif tag == 0x4e: # N
+            return None, pos
+        elif tag == 0x73: # s
+            (size,) = _U32.unpack_from(mv, pos)
+            pos += 4
+            return str(self._take(mv, pos, size), "utf-8"), pos + size
+        elif tag == 0x74 or tag == 0x66: # t, f
+            (size,) = _U32.unpack_from(mv, pos)
+            pos += 4
+            items = []
+            for _ in range(size):
+                y, pos = self._dec(mv, pos)
+                items.append(y)
+            return (tuple(items) if tag == 0x74 else frozenset(items)), pos
+        elif tag == 0x31 or tag == 0x30: # 1, 0
+            return tag == 0x31, pos
+        elif tag == 0x64: # d
+            return _F64.unpack_from(mv, pos)[0], pos + 8
+        elif tag == 0x4a: # J
+            (size,) = _U32.unpack_from(mv, pos)
+            pos += 4
+            return int(str(self._take(mv, pos, size), "ascii")), pos + size
+        raise ValueError("Unknown tag %r" % tag)
+
+    def _take(self, mv, pos, size):
+        if pos + size > len(mv):
+            raise ValueError("Truncated field")
+        return mv[pos:pos + size]
@@ -0,0 +1,100 @@
+# Watermark-driven garbage collection. The collector watches the message
+# log of a replica, counts the CHECKPOINT votes of each (seqno, state) and
+# indexes pending requests by client, so that the replica only collects
+# protocol messages when its low watermark actually advances, and only
+# looks at the requests of clients that changed.
+
+from collections import defaultdict, Counter
+from sys import getsizeof
+
+
+def msg_size(msg):
+    # Approximate memory held by a message tuple and its fields.
+    return getsizeof(msg) + sum(getsizeof(x) for x in msg)
+
+
+class collector(object):
+
+    def __init__(self, rep):
+        self.rep = rep
+
+        # Senders of CHECKPOINTs per (seqno, state), and those with > f.
+        self.votes = defaultdict(set)
+        self.quorums = set()
+        self.dirty = True
+        self.low = -1
+
+        # Requests in the log per client, and clients to re-examine.
+        self.by_client = defaultdict(set)
+        self.dirty_clients = set()
+
+        # Keys: runs, advances, msgs, bytes, time.
+        self.stats = Counter()
+
+    def touch_client(self, c):
+        self.dirty_clients.add(c)
+
+    def touch_checkpoints(self):
+        self.dirty = True
+
+    def advanced_to(self, checkpts):
+        # The new low watermark, or None if it has not moved.
+        if not self.dirty:
+            return None
+        self.dirty = False
+
+        n = max([cn for (cn, cs) in self.quorums if (cn, cs) in checkpts] + [-1])
+        if n > self.low:
+            self.low = n
+            return n
+        return None
+
+    def executed_requests(self):
+        rep = self.rep
+        done = []
+        for c in self.dirty_clients:
+            if c not in rep.last_rep_ti:
+                continue
+            t = rep.last_rep_ti[c]
+            for msg in self.by_client.get(c, ()):
+                if msg[2] == t:
+                    done.append(msg)
+        self.dirty_clients.clear()
+        return done
+
+    # Watcher interface of the message log.
+
+    def added(self, msg, d):
+        xtype, rep = msg[0], self.rep
+        if xtype == rep._CHECKPOINT:
+            (_, _, n, s, j) = msg
+            votes = self.votes[(n, s)]
+            votes.add(j)
+            if len(votes) > rep.f and (n, s) not in self.quorums:
+                self.quorums.add((n, s))
+                self.dirty = True
+
+        elif xtype == rep._REQUEST:
+            c = msg[3]
+            self.by_client[c].add(msg)
+            self.dirty_clients.add(c)
+
+    def discarded(self, msg, d):
+        xtype, rep = msg[0], self.rep
+        if xtype == rep._CHECKPOINT:
+            (_, _, n, s, j) = msg
+            votes = self.votes.get((n, s))
+            if votes is not None:
+                votes.discard(j)
+                if len(votes) <= rep.f:
+                    self.quorums.discard((n, s))
+                if not votes:
+                    del self.votes[(n, s)]
+
+        elif xtype == rep._REQUEST:
+            c = msg[3]
+            reqs = self.by_client.get(c)
+            if reqs is not None:
+                reqs.discard(msg)
+                if not reqs:
+                    del self.by_client[c]
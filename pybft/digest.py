@@ -0,0 +1,86 @@
+# Request digests. A request (_REQUEST, o, t, c) is hashed over a
+# canonical binary encoding of its fields, and a batch over the digests
+# of its requests, so a batch costs one small hash once its requests are
+# known. A reference (ref_tag, d) to a request stands for it and digests
+# to d, so a batch of references digests as the batch of requests. The
+# null request of a new view, None, digests to the fixed NULL. Digests
+# are kept in a per-replica LRU cache with real eviction, and hit, miss
+# and eviction counters to size it.
+
+from hashlib import sha256
+from collections import OrderedDict
+from struct import Struct
+
+
+_LEN = Struct(">I")
+_I64 = Struct(">q")
+_F64 = Struct(">d")
+
+# The digest of the null request.
+NULL = sha256(b"N").hexdigest()
+
+
+def _field(x):
+    # Type-tagged, length-prefixed encoding of a request field. Numbers
+    # that compare equal, such as 10, 10.0 and True, encode the same, as
+    # equal requests share a cache entry.
+    if isinstance(x, bytes):
+        return b"b" + _LEN.pack(len(x)) + x
+    if isinstance(x, float) and x.is_integer():
+        x = int(x)
+    if isinstance(x, int):
+        x = int(x)
+        if -(1 << 63) <= x < (1 << 63):
+            return b"i" + _I64.pack(x)
+        s = str(x).encode("ascii")
+        return b"J" + _LEN.pack(len(s)) + s
+    if isinstance(x, float):
+        return b"d" + _F64.pack(x)
+    if isinstance(x, str):
+        s = x.encode("utf-8")
+        return b"s" + _LEN.pack(len(s)) + s
+    raise TypeError("Cannot digest field of type %s" % type(x).__name__)
+
+
+def encode_request(m):
+    (_, o, t, c) = m
+    return b"R" + _field(o) + _field(t) + _field(c)
+
+
+class digests(object):
+
+    def __init__(self, batch_tag, size=10000, ref_tag=None):
+        self.batch_tag = batch_tag
+        self.ref_tag = ref_tag
+        self.size = size
+        self.cache = OrderedDict()
+        self.stat = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def of(self, m):
+        if m is None:
+            return NULL
+        if m[0] == self.ref_tag and self.ref_tag is not None:
+            return m[1]
+        cache = self.cache
+        h = cache.get(m)
+        if h is not None:
+            cache.move_to_end(m)
+            self.stat["hits"] += 1
+            return h
+
+        self.stat["misses"] += 1
+        if m[0] == self.batch_tag:
+            bts = b"B" + b"".join(self.of(r).encode("ascii") for r in m[1])
+        else:
+            bts = encode_request(m)
+        h = sha256(bts).hexdigest()
+
+        cache[m] = h
+        if len(cache) > self.size:
+            cache.popitem(last=False)
+            self.stat["evictions"] += 1
+        return h
+
+    def hit_rate(self):
+        total = self.stat["hits"] + self.stat["misses"]
+        return self.stat["hits"] / float(total) if total else 0.0
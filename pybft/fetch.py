@@ -0,0 +1,178 @@
+# Digest-only PREPREPAREs. With `digest_preprepares` set, the primary
+# sends its PREPREPAREs with every request replaced by a reference
+# (_REF, d) to its digest, and keeps the full message in its own log.
+# Batches keep their (_BATCH, refs) form, so a PREPREPARE digests the same
+# with references or with bodies. Clients are expected to send requests to
+# every replica, so the bodies reach the backups without the primary.
+#
+# A backup resolves the references from its request store (see
+# pybft.store) and handles the full PREPREPARE. If some bodies are missing
+# it parks the PREPREPARE and asks its sender for them with a
+# (_FETCH, digests, i). Fetched requests are handled as any other, then
+# complete the parked PREPREPAREs, and the fetches still unanswered are
+# repeated on `tick`.
+
+from collections import Counter, OrderedDict
+
+
+class fetcher(object):
+
+    def __init__(self, rep, interval=0.05, max_parked=1000):
+        self.rep = rep
+        self.interval = interval
+        self.max_parked = max_parked
+
+        # Parked PREPREPARE -> [missing digests, when we last asked, the
+        # bodies fetched so far], in arrival order, and digest -> the
+        # PREPREPAREs waiting for it.
+        self.parked = OrderedDict()
+        self.waiting = {}
+
+        self.stat = Counter()
+
+    def refs(self, m):
+        # The payload with its requests replaced by references.
+        rep = self.rep
+        if m is None:
+            return m
+        if m[0] == rep._BATCH:
+            return (m[0], tuple((rep._REF, rep.hash(req)) for req in m[1]))
+        return (rep._REF, rep.hash(m))
+
+    def strip(self, msg):
+        (xtype, v, n, m, j) = msg
+        return (xtype, v, n, self.refs(m), j)
+
+    def is_ref(self, x):
+        return type(x) is tuple and len(x) == 2 and x[0] == self.rep._REF
+
+    def digests_of(self, m):
+        # The digests a payload refers to, or None if it has no references.
+        rep = self.rep
+        if m is None:
+            return None
+        if m[0] == rep._BATCH:
+            ds = [x[1] for x in m[1] if self.is_ref(x)]
+            return ds or None
+        return [m[1]] if self.is_ref(m) else None
+
+    def body_of(self, d):
+        # A request we hold with digest d, or None.
+        rep = self.rep
+        if rep.store is not None:
+            return rep.store.get(d)
+        for msg in rep.in_i.with_digest(d):
+            if msg[0] == rep._REQUEST:
+                return msg
+        return None
+
+    def resolve(self, msg, found=None):
+        # The PREPREPARE with bodies, or None if it waits for some.
+        rep = self.rep
+        (xtype, v, n, m, j) = msg
+        ds = self.digests_of(m)
+        if ds is None:
+            return msg
+
+        def body(x):
+            if not self.is_ref(x):
+                return x
+            req = self.body_of(x[1])
+            if req is None and found is not None:
+                req = found.get(x[1])
+            return req
+
+        if m[0] == rep._BATCH:
+            reqs = tuple(body(x) for x in m[1])
+            full = None if None in reqs else (m[0], reqs)
+        else:
+            full = body(m)
+
+        if full is not None:
+            self.stat["resolved"] += 1
+            return (xtype, v, n, full, j)
+
+        if msg not in self.parked:
+            missing = set(d for d in ds if self.body_of(d) is None and \
+                          (found is None or d not in found))
+            self.park(msg, missing)
+        return None
+
+    def park(self, msg, missing):
+        rep = self.rep
+        self.parked[msg] = [missing, rep.clock(), {}]
+        for d in missing:
+            self.waiting.setdefault(d, set()).add(msg)
+        self.stat["parked"] += 1
+        self.ask(msg, missing)
+
+        if len(self.parked) > self.max_parked:
+            old, (ds, _, _) = self.parked.popitem(last=False)
+            self._unwait(old, ds)
+            self.stat["dropped"] += 1
+
+    def _unwait(self, msg, ds):
+        for d in ds:
+            pps = self.waiting.get(d)
+            if pps is not None:
+                pps.discard(msg)
+                if not pps:
+                    del self.waiting[d]
+
+    def ask(self, msg, missing):
+        rep = self.rep
+        j = msg[-1]
+        if j == rep.i or not missing:
+            return
+        rep.resend((rep._FETCH, tuple(sorted(missing)), rep.i), [j])
+        self.stat["fetches"] += 1
+
+    def wanted(self, req):
+        return bool(self.waiting) and self.rep.hash(req) in self.waiting
+
+    def arrived(self, req):
+        # A fetched request: the parked PREPREPAREs it completes.
+        d = self.rep.hash(req)
+        complete = []
+        for msg in self.waiting.pop(d, ()):
+            entry = self.parked.get(msg)
+            if entry is None:
+                continue
+            entry[0].discard(d)
+            entry[2][d] = req
+            if not entry[0]:
+                del self.parked[msg]
+                complete.append(self.resolve(msg, entry[2]))
+
+        self.stat["arrived"] += 1
+        return complete
+
+    def answer(self, msg):
+        # A peer asks for request bodies we hold.
+        rep = self.rep
+        (_, ds, j) = msg
+        if j == rep.i or not isinstance(j, int) or not 0 <= j < rep.R:
+            return
+        for d in ds:
+            req = self.body_of(d)
+            if req is not None and req[0] == rep._REQUEST:
+                rep.resend(req, [j])
+                self.stat["answered"] += 1
+
+    def tick(self):
+        # Forget the PREPREPAREs whose slot was accepted or collected
+        # meanwhile, and ask again for the bodies of the others parked
+        # for too long.
+        rep = self.rep
+        now, low = rep.clock(), rep.in_i.low
+        for msg, entry in list(self.parked.items()):
+            (_, v, n, _, j) = msg
+            if (low is not None and n < low) or \
+               any(pp[0] == rep._PREPREPARE and pp[-1] == j for pp in rep.in_i.at_slot(v, n)):
+                del self.parked[msg]
+                self._unwait(msg, entry[0])
+                self.stat["forgotten"] += 1
+            elif now - entry[1] >= self.interval:
+                entry[1] = now
+                self.stat["refetches"] += 1
+                self.ask(msg, entry[0])
@@ -0,0 +1,149 @@
+# Instrumentation of a replica: timers and call counters around every
+# handler and internal step, current and peak sizes of in_i, out_i and
+# checkpts_i, per-peer message counts, the hit rates of the digest and
+# authentication caches and the use of the request store, exported as a
+# snapshot dict or text.
+#
+# Probes wrap the methods of one replica instance while enabled, and
+# remove the wrappers when disabled: an uninstrumented replica runs its
+# plain class methods at no cost. Timers are inclusive, so the time of
+# `route_receive` contains the time of the steps it calls.
+
+from collections import Counter, defaultdict
+from time import perf_counter
+
+
+# Handlers and internal steps timed by default.
+STEPS = [
+    "route_receive", "route_receive_many",
+    "receive_request", "receive_preprepare", "receive_prepare",
+    "receive_commit", "receive_checkpoint", "receive_view_change",
+    "receive_new_view",
+    "send_preprepare", "send_batches", "send_commit", "send_viewchange",
+    "send_newview", "execute", "make_progress", "garbage_collect",
+    "compute_P", "compute_C", "tick",
+]
+
+
+class probes(object):
+
+    def __init__(self, rep, steps=STEPS, clock=perf_counter):
+        self.rep = rep
+        self.steps = list(steps)
+        self.clock = clock
+        self.enabled = False
+        self.reset()
+
+    def reset(self):
+        self.calls = Counter()
+        self.time = defaultdict(float)
+        self.peers = Counter()
+        self.sizes = {}
+        self.peaks = Counter()
+
+    def enable(self):
+        if self.enabled:
+            return
+        for name in self.steps:
+            self.rep.__dict__[name] = self._wrap(name, getattr(self.rep, name))
+        self.enabled = True
+
+    def disable(self):
+        for name in self.steps:
+            self.rep.__dict__.pop(name, None)
+        self.enabled = False
+
+    def _wrap(self, name, method):
+        calls, time, clock = self.calls, self.time, self.clock
+        if name == "route_receive":
+            def timed(msg):
+                calls[name] += 1
+                if msg[0] != self.rep._REQUEST:
+                    self.peers[msg[-1]] += 1
+                t0 = clock()
+                try:
+                    return method(msg)
+                finally:
+                    time[name] += clock() - t0
+                    self.sample()
+        elif name == "route_receive_many":
+            rep = self.rep
+            slot_types = (rep._PREPREPARE, rep._PREPARE, rep._COMMIT)
+            def timed(msgs):
+                calls[name] += 1
+                # The other messages go through route_receive, and are
+                # counted there.
+                for msg in msgs:
+                    if msg[0] in slot_types and len(msg) == 5:
+                        self.peers[msg[-1]] += 1
+                t0 = clock()
+                try:
+                    return method(msgs)
+                finally:
+                    time[name] += clock() - t0
+                    self.sample()
+        else:
+            def timed(*args, **kwargs):
+                calls[name] += 1
+                t0 = clock()
+                try:
+                    return method(*args, **kwargs)
+                finally:
+                    time[name] += clock() - t0
+        return timed
+
+    def sample(self):
+        # Current and peak sizes of the replica state.
+        rep = self.rep
+        for name, value in (("in_i", len(rep.in_i)), ("out_i", len(rep.out_i)), \
+                            ("checkpts_i", len(rep.checkpts_i))):
+            self.sizes[name] = value
+            if value > self.peaks[name]:
+                self.peaks[name] = value
+
+    def snapshot(self):
+        rep = self.rep
+        self.sample()
+        snap = {
+            "replica": rep.i,
+            "timers": dict((name, {"calls": self.calls[name], \
+                                   "seconds": self.time[name]}) \
+                           for name in self.steps if self.calls[name]),
+            "sizes": dict((name, {"now": self.sizes[name], "peak": self.peaks[name]}) \
+                          for name in self.sizes),
+            "received": dict(rep.stat),
+            "peers": dict(self.peers),
+            "digests": dict(rep.digests.stat, hit_rate=rep.digests.hit_rate()),
+            "gc": dict(rep.gc.stats),
+        }
+        if rep.store is not None:
+            snap["store"] = dict(rep.store.stat, requests=len(rep.store))
+        if rep.auth is not None:
+            total = rep.auth.stat["hits"] + rep.auth.stat["misses"]
+            snap["auth"] = dict(rep.auth.stat, \
+                hit_rate=rep.auth.stat["hits"] / float(total) if total else 0.0)
+        return snap
+
+    def text(self):
+        snap = self.snapshot()
+        lines = ["replica %s" % snap["replica"]]
+        lines += ["  %-20s %8s %12s %10s" % ("step", "calls", "total (ms)", "us/call")]
+        for name in self.steps:
+            if name in snap["timers"]:
+                t = snap["timers"][name]
+                lines += ["  %-20s %8d %12.3f %10.2f" % (name, t["calls"], \
+                          1e3 * t["seconds"], 1e6 * t["seconds"] / t["calls"])]
+        for name in sorted(snap["sizes"]):
+            s = snap["sizes"][name]
+            lines += ["  |%s| now %d peak %d" % (name, s["now"], s["peak"])]
+        lines += ["  received %s" % ", ".join("%s=%d" % (k.strip("_"), v) \
+                  for k, v in sorted(snap["received"].items()))]
+        lines += ["  peers %s" % ", ".join("%s=%d" % (k, v) \
+                  for k, v in sorted(snap["peers"].items(), key=lambda x: str(x[0])))]
+        lines += ["  digest cache hit rate %.3f" % snap["digests"]["hit_rate"]]
+        if "store" in snap:
+            lines += ["  request store %d bodies, %d copies shared" % \
+                      (snap["store"]["requests"], snap["store"].get("shared", 0))]
+        if "auth" in snap:
+            lines += ["  auth cache hit rate %.3f" % snap["auth"]["hit_rate"]]
+        return "\n".join(lines)
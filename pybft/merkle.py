@@ -0,0 +1,204 @@
+# Incremental Merkle checkpoints. The reply table of a replica, the last
+# timestamp and result of every client, is kept in a sparse Merkle tree:
+# clients hash to one of 2^depth buckets, a bucket digests the sorted
+# digests of its entries, and inner nodes the concatenation of their two
+# children, missing subtrees having a fixed empty digest. Executions mark
+# their bucket dirty, and the root only recomputes the dirty buckets and
+# their paths, so its cost is proportional to the updates since the last
+# checkpoint, not to the number of clients.
+#
+# A checkpoint is a constant-size digest of the root and of the service
+# snapshot. The checkpointer keeps the state of the stable checkpoint,
+# and the entries changed between the later checkpoints, so the state of
+# any checkpoint still held can be rebuilt for a state transfer or the
+# write-ahead log without snapshotting the whole table at every one. They
+# are kept in memory, or on disk (see pybft.snapstore).
+
+from collections import Counter, OrderedDict
+from hashlib import sha256
+from struct import Struct
+
+from pybft.digest import _field
+
+
+_LEN = Struct(">I")
+_IDX = Struct(">I")
+
+
+def canon(x):
+    # Canonical, type-tagged encoding of a value of the reply table or of
+    # a service snapshot.
+    if x is None:
+        return b"N"
+    if isinstance(x, tuple):
+        return b"t" + _LEN.pack(len(x)) + b"".join(canon(y) for y in x)
+    if isinstance(x, frozenset):
+        return b"f" + _LEN.pack(len(x)) + b"".join(sorted(canon(y) for y in x))
+    return _field(x)
+
+
+def checkpoint_digest(snap, root):
+    return sha256(b"C" + sha256(canon(snap)).digest() + root).hexdigest()
+
+
+class merkle(object):
+
+    def __init__(self, depth=16):
+        self.depth = depth
+
+        # Empty subtree digests, from the buckets (depth) to the root (0).
+        self.empty = [None] * (depth + 1)
+        self.empty[depth] = sha256(b"").digest()
+        for l in range(depth - 1, -1, -1):
+            self.empty[l] = sha256(self.empty[l + 1] * 2).digest()
+
+        # Bucket -> {client: entry digest}, and level -> {index: digest}
+        # for the non-empty nodes.
+        self.buckets = {}
+        self.nodes = [dict() for _ in range(depth + 1)]
+        self.dirty = set()
+
+        self.stat = Counter()
+
+    def bucket(self, c):
+        return _IDX.unpack(sha256(canon(c)).digest()[:4])[0] >> (32 - self.depth)
+
+    def update(self, c, value):
+        b = self.bucket(c)
+        leaves = self.buckets.get(b)
+        if leaves is None:
+            leaves = self.buckets[b] = {}
+        leaves[c] = sha256(canon((c,) + tuple(value))).digest()
+        self.dirty.add(b)
+        self.stat["updates"] += 1
+
+    def root(self):
+        if self.dirty:
+            nodes, empty = self.nodes, self.empty
+            for b in self.dirty:
+                nodes[self.depth][b] = sha256(b"".join(sorted(self.buckets[b].values()))).digest()
+            self.stat["hashes"] += len(self.dirty)
+
+            idx = set(b >> 1 for b in self.dirty)
+            for l in range(self.depth - 1, -1, -1):
+                below, e = nodes[l + 1], empty[l + 1]
+                for k in idx:
+                    nodes[l][k] = sha256(below.get(2*k, e) + below.get(2*k + 1, e)).digest()
+                self.stat["hashes"] += len(idx)
+                idx = set(k >> 1 for k in idx)
+            self.dirty.clear()
+        return self.nodes[0].get(0, self.empty[0])
+
+    def node(self, l, k):
+        # The digest of node k at level l, once the root is computed.
+        return self.nodes[l].get(k, self.empty[l])
+
+
+def fold(nodes):
+    # The root over all the node digests of a level, left to right.
+    while len(nodes) > 1:
+        nodes = [sha256(nodes[k] + nodes[k + 1]).digest() for k in range(0, len(nodes), 2)]
+    return nodes[0]
+
+
+class versions(object):
+    # The checkpoints a checkpointer holds, in memory: the state of the
+    # stable one, and the entries changed between the later ones. See
+    # pybft.snapstore for the same on disk.
+
+    durable = False
+
+    def reset(self, n, d, snap, table):
+        # Hold checkpoint n alone, as the stable one.
+        self.base = (n, d, snap, dict(table))
+        self.later = OrderedDict()
+
+    def append(self, n, d, snap, delta):
+        self.later[n] = (d, snap, delta)
+
+    def has(self, n):
+        return n == self.base[0] or n in self.later
+
+    def digest(self, n):
+        if n == self.base[0]:
+            return self.base[1]
+        return self.later[n][0]
+
+    def stable(self, n):
+        # Checkpoint n is stable: fold the earlier ones into the base.
+        (bn, bd, bsnap, table) = self.base
+        for k in list(self.later):
+            if k > n:
+                break
+            (bd, bsnap, delta) = self.later.pop(k)
+            table.update(delta)
+            bn = k
+        self.base = (bn, bd, bsnap, table)
+
+    def state(self, n):
+        # (snapshot, {client: (t, result)}) of checkpoint n.
+        (bn, _, snap, table) = self.base
+        if n != bn:
+            table = dict(table)
+            for k, (_, snap, delta) in self.later.items():
+                if k > n:
+                    break
+                table.update(delta)
+        return (snap, table)
+
+
+class checkpointer(object):
+
+    def __init__(self, rep, depth=16, held=None):
+        self.rep = rep
+        self.depth = depth
+        self.tree = merkle(depth)
+
+        # Entries changed since the last checkpoint.
+        self.delta = {}
+
+        # The checkpoints held, from the stable one on.
+        self.held = held if held is not None else versions()
+        snap = rep.service.snapshot()
+        self.held.reset(0, checkpoint_digest(snap, self.tree.root()), snap, {})
+
+    def update(self, c, t, result):
+        self.tree.update(c, (t, result))
+        self.delta[c] = (t, result)
+
+    def take(self, n):
+        # Checkpoint the current state as seqno n, and return its digest.
+        snap = self.rep.service.snapshot()
+        d = checkpoint_digest(snap, self.tree.root())
+        self.held.append(n, d, snap, self.delta)
+        self.delta = {}
+        return d
+
+    def has(self, n):
+        return self.held.has(n)
+
+    def digest(self, n):
+        return self.held.digest(n)
+
+    def stable(self, n):
+        self.held.stable(n)
+
+    def state(self, n):
+        # (snapshot, ((c, t, result), ...)) of a checkpoint still held.
+        snap, table = self.held.state(n)
+        return (snap, tuple((c, t, r) for c, (t, r) in table.items()))
+
+    def restore(self, n, state):
+        # Install the state of checkpoint n as the stable one, and return
+        # its digest.
+        snap, entries = state
+        self.rep.service.restore(snap)
+        self.tree = merkle(self.depth)
+        table = {}
+        for (c, t, r) in entries:
+            self.tree.update(c, (t, r))
+            table[c] = (t, r)
+        d = checkpoint_digest(snap, self.tree.root())
+        self.held.reset(n, d, snap, table)
+        self.delta = {}
+        return d
@@ -0,0 +1,129 @@
+# An indexed message log. It is a drop-in replacement for the plain set
+# `in_i` of the formal specification, that also keeps secondary indexes
+# by message type, by (view, seqno) slot, by seqno and by digest. This turns the
+# linear scans of the replica into lookups.
+#
+# Watchers, such as the quorum certificates of the replica, are told
+# about every message added or discarded along with its digest.
+
+from collections import defaultdict
+
+
+_EMPTY = frozenset()
+
+
+class msglog(object):
+
+    def __init__(self, slot_types, digest_of, M=()):
+        # Messages of `slot_types` have the form (type, v, n, ...) and are
+        # indexed by (v, n) and by n. The `digest_of` function returns the digest
+        # under which a message is indexed, or None.
+        self.slot_types = frozenset(slot_types)
+        self.digest_of = digest_of
+
+        # Slot messages with a seqno below the low watermark are not
+        # admitted: they would only wait for the next collection.
+        self.low = None
+
+        self.msgs = set()
+        self.by_type = defaultdict(set)
+        self.by_slot = defaultdict(set)
+        self.by_seqno = defaultdict(set)
+        self.by_digest = defaultdict(set)
+        self.watchers = []
+
+        self.update(M)
+
+    # Set interface
+
+    def __contains__(self, msg):
+        return msg in self.msgs
+
+    def __len__(self):
+        return len(self.msgs)
+
+    def __iter__(self):
+        return iter(self.msgs)
+
+    def __ior__(self, M):
+        self.update(M)
+        return self
+
+    def __isub__(self, M):
+        self.difference_update(M)
+        return self
+
+    def add(self, msg):
+        if msg in self.msgs:
+            return
+
+        xtype = msg[0]
+        if self.low is not None and xtype in self.slot_types and msg[2] < self.low:
+            return
+        self.msgs.add(msg)
+
+        self.by_type[xtype].add(msg)
+        if xtype in self.slot_types:
+            self.by_slot[(msg[1], msg[2])].add(msg)
+            self.by_seqno[msg[2]].add(msg)
+
+        d = self.digest_of(msg)
+        if d is not None:
+            self.by_digest[d].add(msg)
+
+        for w in self.watchers:
+            w.added(msg, d)
+
+    def discard(self, msg):
+        if msg not in self.msgs:
+            return
+        self.msgs.remove(msg)
+
+        xtype = msg[0]
+        self._unindex(self.by_type, xtype, msg)
+        if xtype in self.slot_types:
+            self._unindex(self.by_slot, (msg[1], msg[2]), msg)
+            self._unindex(self.by_seqno, msg[2], msg)
+
+        d = self.digest_of(msg)
+        if d is not None:
+            self._unindex(self.by_digest, d, msg)
+
+        for w in self.watchers:
+            w.discarded(msg, d)
+
+    def remove(self, msg):
+        if msg not in self.msgs:
+            raise KeyError(msg)
+        self.discard(msg)
+
+    def update(self, M):
+        for msg in M:
+            self.add(msg)
+
+    def difference_update(self, M):
+        for msg in M:
+            self.discard(msg)
+
+    def _unindex(self, index, key, msg):
+        bucket = index[key]
+        bucket.discard(msg)
+        if not bucket:
+            del index[key]
+
+    # Index lookups: the returned sets must not be mutated.
+
+    def of_type(self, xtype):
+        return self.by_type.get(xtype, _EMPTY)
+
+    def at_slot(self, v, n):
+        return self.by_slot.get((v, n), _EMPTY)
+
+    def at_seqno(self, n):
+        return self.by_seqno.get(n, _EMPTY)
+
+    def seqnos(self):
+        return list(self.by_seqno)
+
+    def with_digest(self, d):
+        return self.by_digest.get(d, _EMPTY)
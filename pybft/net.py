@@ -0,0 +1,324 @@
+# An asyncio network layer for a replica. A server hosts one `replica`,
+# accepts length-prefixed frames from peers and clients over TCP, feeds
+# the messages of every read to `route_receive_many`, and sends the
+# bundles drained from the outbox of the replica (see pybft.outbox) to
+# their destinations.
+#
+# If the replica has an authenticator, every frame is sealed with a
+# vector of MACs, and frames that do not verify, or whose message does
+# not come from the authenticated sender, are dropped before reaching
+# the replica.
+#
+# A replica cannot vouch for the requests of a client, so the envelope a
+# client sealed a request in, its payload and vector of MACs, is kept and
+# forwarded with the request, as a _SEALED message in the bundle of any
+# request or PREPREPARE carrying it. Requests from replicas, alone or in
+# PREPREPAREs, are only accepted once the client's MAC for us verified.
+#
+# Connections to peers are persistent, and open with a _PEER frame so
+# that the requests they forward are not mistaken for client ones. All
+# the messages for a peer produced by a round of processing travel in a
+# single _BUNDLE frame, sealed once, and all the frames for a client are
+# coalesced into a single write.
+
+import asyncio
+import ast
+from collections import OrderedDict
+from struct import Struct
+
+from pybft.codec import wirecodec
+
+
+_LEN = Struct(">I")
+MAX_FRAME = 1 << 24
+
+
+class reprcodec(object):
+    # Messages as Python literals, with frozensets tagged, decoded with
+    # `ast.literal_eval` (never `eval` or pickle). Readable, but slower
+    # than the binary `wirecodec` used by default.
+
+    _FS = "__frozenset__"
+
+    def encode(self, msg):
+        return repr(self._plain(msg)).encode("utf-8")
+
+    def decode(self, buf):
+        return self._restore(ast.literal_eval(bytes(buf).decode("utf-8")))
+
+    def _plain(self, x):
+        if isinstance(x, frozenset):
+            return (self._FS, tuple(self._plain(y) for y in x))
+        if isinstance(x, tuple):
+            return tuple(self._plain(y) for y in x)
+        return x
+
+    def _restore(self, x):
+        if isinstance(x, tuple):
+            if len(x) == 2 and x[0] == self._FS:
+                return frozenset(self._restore(y) for y in x[1])
+            return tuple(self._restore(y) for y in x)
+        return x
+
+
+def frame(payload):
+    return _LEN.pack(len(payload)) + payload
+
+
+def unframe(buf):
+    # Split a bytearray into complete frame payloads, and consume them.
+    frames = []
+    pos = 0
+    while len(buf) - pos >= _LEN.size:
+        (size,) = _LEN.unpack_from(buf, pos)
+        if size > MAX_FRAME:
+            raise ValueError("Frame too large: %d" % size)
+        if len(buf) - pos - _LEN.size < size:
+            break
+        start = pos + _LEN.size
+        frames.append(bytes(buf[start:start + size]))
+        pos = start + size
+    del buf[:pos]
+    return frames
+
+
+class server(object):
+
+    _PEER = "_PEER"
+    _BUNDLE = "_BUNDLE"
+    _SEALED = "_SEALED"
+
+    def __init__(self, rep, codec=None, tick_interval=0.01, sealed_size=10000):
+        self.rep = rep
+        self.codec = codec if codec is not None else wirecodec()
+        self.tick_interval = tick_interval
+
+        # Replica id -> (host, port), and open connections to them.
+        self.peers = {}
+        self.links = {}
+
+        # Client id -> writer of the connection its requests came on.
+        self.clients = {}
+
+        # Request -> (payload, tags) of its client's envelope, in LRU order.
+        self.sealed = OrderedDict()
+        self.sealed_size = sealed_size
+
+        self.tcp = None
+        self.ticker = None
+        self.handlers = set()
+        self.stat = {"frames_in": 0, "frames_out": 0, "msgs_in": 0, "msgs_out": 0, \
+                     "writes": 0, "rejected": 0, "vouched": 0}
+
+    async def start(self, host="127.0.0.1", port=0):
+        self.tcp = await asyncio.start_server(self.handle, host, port)
+        self.ticker = asyncio.ensure_future(self.tick_loop())
+        return self.tcp.sockets[0].getsockname()[:2]
+
+    async def close(self):
+        tasks = list(self.handlers)
+        if self.ticker is not None:
+            tasks.append(self.ticker)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+        for writer in list(self.links.values()) + list(self.clients.values()):
+            writer.close()
+        if self.tcp is not None:
+            self.tcp.close()
+            await self.tcp.wait_closed()
+
+    async def handle(self, reader, writer):
+        task = asyncio.current_task()
+        self.handlers.add(task)
+        buf = bytearray()
+        peer = False
+        try:
+            while True:
+                data = await reader.read(1 << 16)
+                if not data:
+                    break
+                buf += data
+                frames = [self.unseal(p) for p in unframe(buf)]
+                self.stat["frames_in"] += len(frames)
+                batch = []
+                for msg in frames:
+                    if msg is None:
+                        self.stat["rejected"] += 1
+                        continue
+                    if msg[0] == self._PEER:
+                        peer = True
+                        continue
+                    msgs = msg[1:] if msg[0] == self._BUNDLE else (msg,)
+                    self.stat["msgs_in"] += len(msgs)
+                    for m in msgs:
+                        if m[0] == self.rep._REQUEST and not peer:
+                            self.clients[m[3]] = writer
+                    batch += msgs
+                self.rep.route_receive_many(batch)
+                await self.flush()
+        except (Exception, asyncio.CancelledError):
+            # Malformed input, a broken connection or the server closing:
+            # drop the connection.
+            pass
+        finally:
+            self.handlers.discard(task)
+            writer.close()
+
+    def seal(self, msg):
+        payload = self.codec.encode(msg)
+        if self.rep.auth is None:
+            return payload
+        if msg[0] == self.rep._REPLY or msg[0] == self.rep._BUSY:
+            return self.rep.auth.seal(payload, to=msg[3])
+        return self.rep.auth.seal(payload)
+
+    def unseal(self, buf):
+        # The message of a frame, or None if it is not authentic. Bundles
+        # lose the requests not vouched for by their clients.
+        auth = self.rep.auth
+        if auth is None:
+            return self.codec.decode(buf)
+
+        sender, payload, tags = auth.open(buf)
+        if not self.rep.valid_sig(sender, (payload, tags)):
+            return None
+        msg = self.codec.decode(payload)
+        if not isinstance(sender, int):
+            if not self.sent_by(msg, sender):
+                return None
+            if msg[0] == self.rep._REQUEST:
+                self.keep(msg, payload, tags)
+            return msg
+
+        bundle = type(msg) is tuple and len(msg) > 0 and msg[0] == self._BUNDLE
+        msgs = msg[1:] if bundle else (msg,)
+        # Take the client envelopes first, to check the messages after.
+        rest = []
+        for m in msgs:
+            if type(m) is tuple and len(m) == 4 and m[0] == self._SEALED:
+                self.take_sealed(m)
+            else:
+                rest.append(m)
+        if not all(self.sent_by(m, sender) for m in rest):
+            return None
+        ok = [m for m in rest if self.vouched(m)]
+        if bundle:
+            self.stat["rejected"] += len(rest) - len(ok)
+            return (self._BUNDLE,) + tuple(ok)
+        return msg if ok else None
+
+    def sent_by(self, msg, sender):
+        # Clients only send their own requests, replicas sign their own
+        # messages and may forward requests, vouched for by their clients.
+        if type(msg) is not tuple or not msg:
+            return False
+        if msg[0] == self.rep._REQUEST and len(msg) == 4:
+            return isinstance(sender, int) or sender == msg[3]
+        return isinstance(sender, int) and len(msg) > 1 and msg[-1] == sender
+
+    # Client envelopes.
+
+    def requests_in(self, msg):
+        # The requests a message carries with their bodies.
+        rep = self.rep
+        if msg[0] == rep._REQUEST and len(msg) == 4:
+            return (msg,)
+        if msg[0] == rep._PREPREPARE and len(msg) == 5 and type(msg[3]) is tuple:
+            return [req for req in rep.requests_of(msg[3]) \
+                    if type(req) is tuple and req[:1] == (rep._REQUEST,)]
+        return ()
+
+    def keep(self, req, payload, tags):
+        self.sealed[req] = (bytes(payload), bytes(tags))
+        self.sealed.move_to_end(req)
+        if len(self.sealed) > self.sealed_size:
+            self.sealed.popitem(last=False)
+
+    def take_sealed(self, m):
+        # Keep the envelope of a request forwarded by a peer if the
+        # client's MAC for us verifies.
+        (_, c, payload, tags) = m
+        if not isinstance(c, bytes) or not isinstance(payload, bytes) or \
+           not isinstance(tags, bytes) or not self.rep.auth.verify(c, payload, tags):
+            return
+        try:
+            req = self.codec.decode(payload)
+        except ValueError:
+            return
+        if type(req) is tuple and len(req) == 4 and req[0] == self.rep._REQUEST and \
+           req[3] == c:
+            self.keep(req, payload, tags)
+            self.stat["vouched"] += 1
+
+    def vouched(self, msg):
+        # Whether we hold the client envelope of every request in msg.
+        return all(req in self.sealed for req in self.requests_in(msg))
+
+    def envelopes(self, msgs):
+        # The _SEALED messages to send along msgs to a peer.
+        out, seen = [], set()
+        for m in msgs:
+            for req in self.requests_in(m):
+                env = self.sealed.get(req)
+                if env is not None and req not in seen:
+                    seen.add(req)
+                    out.append((self._SEALED, req[3]) + env)
+        return out
+
+    async def tick_loop(self):
+        while True:
+            await asyncio.sleep(self.tick_interval)
+            self.rep.tick()
+            await self.flush()
+
+    async def flush(self):
+        bundles = self.rep.out_i.drain()
+        if not bundles:
+            return
+
+        writers = []
+        for dest, ms in bundles:
+            if isinstance(dest, int):
+                if dest not in self.peers:
+                    continue
+                writer = await self.link(dest)
+                out = list(ms)
+                if self.rep.auth is not None:
+                    out += self.envelopes(ms)
+                frames = [self.seal(out[0] if len(out) == 1 else (self._BUNDLE,) + tuple(out))]
+            else:
+                writer = self.clients.get(dest)
+                frames = [self.seal(m) for m in ms]
+            if writer is None:
+                continue
+            writer.write(b"".join(frame(p) for p in frames))
+            self.stat["frames_out"] += len(frames)
+            self.stat["msgs_out"] += len(ms)
+            self.stat["writes"] += 1
+            writers.append(writer)
+
+        for writer in writers:
+            try:
+                await writer.drain()
+            except ConnectionError:
+                self.drop(writer)
+
+    async def link(self, j):
+        writer = self.links.get(j)
+        if writer is not None and not writer.is_closing():
+            return writer
+        try:
+            _, writer = await asyncio.open_connection(*self.peers[j])
+        except OSError:
+            return None
+        writer.write(frame(self.seal((self._PEER, self.rep.i))))
+        self.links[j] = writer
+        return writer
+
+    def drop(self, writer):
+        for j, w in list(self.links.items()):
+            if w is writer:
+                del self.links[j]
+        writer.close()
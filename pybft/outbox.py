@@ -0,0 +1,104 @@
+# The outbound messages of a replica. Messages are routed when they are
+# added, following the rules of the protocol: requests go to the primary,
+# replies and busy signals to their client, and everything else to the
+# other replicas but its original sender. They wait in order of addition
+# until a transport drains them as one bundle per destination, keeping
+# the order of the messages for each destination.
+#
+# A message already waiting, or recently sent, is not added again, so
+# handlers can emit messages without checking what went out before.
+# Deliberate retransmissions go through `resend`. The outbox also behaves
+# like the set it replaces, for the tests and tools that inspect or clear
+# it directly.
+
+from collections import Counter, OrderedDict
+
+
+class outbox(object):
+
+    def __init__(self, rep, history=10000):
+        self.rep = rep
+
+        # Message -> destinations, in order of addition.
+        self.queued = OrderedDict()
+
+        # Recently sent messages, in LRU order.
+        self.sent = OrderedDict()
+        self.history = history
+
+        self.stat = Counter()
+
+    def route(self, msg):
+        # Destinations: replica ids, or the id of a client for replies.
+        rep = self.rep
+        if msg[0] == rep._REQUEST:
+            p = rep.primary()
+            return (p,) if p != rep.i else ()
+        if msg[0] == rep._REPLY or msg[0] == rep._BUSY:
+            return (msg[3],)
+        return tuple(j for j in range(rep.R) if j != rep.i and j != msg[-1])
+
+    def add(self, msg):
+        if msg in self.queued or msg in self.sent:
+            self.stat["duplicates"] += 1
+            return False
+        self.queued[msg] = self.route(msg)
+        self.stat["added"] += 1
+        return True
+
+    def resend(self, msg, dests=None):
+        # Queue a message again even if it was already sent, to its usual
+        # destinations or to the given ones.
+        if msg in self.queued:
+            self.stat["duplicates"] += 1
+            return False
+        self.queued[msg] = self.route(msg) if dests is None else tuple(dests)
+        self.stat["resent"] += 1
+        return True
+
+    def drain(self):
+        # The waiting messages as [(destination, [msgs])], one bundle per
+        # destination in order of first use, and remember them as sent.
+        # They leave once the write-ahead log of the replica is on disk.
+        if self.rep.wal is not None:
+            self.rep.wal.sync()
+        bundles = OrderedDict()
+        sent = self.sent
+        for msg, dests in self.queued.items():
+            for d in dests:
+                ms = bundles.get(d)
+                if ms is None:
+                    ms = bundles[d] = []
+                ms.append(msg)
+            sent[msg] = True
+            sent.move_to_end(msg)
+
+        while len(sent) > self.history:
+            sent.popitem(last=False)
+
+        self.queued.clear()
+        self.stat["bundles"] += len(bundles)
+        return list(bundles.items())
+
+    # The set interface of the pending messages.
+
+    def __len__(self):
+        return len(self.queued)
+
+    def __contains__(self, msg):
+        return msg in self.queued
+
+    def __iter__(self):
+        return iter(list(self.queued))
+
+    def __ior__(self, msgs):
+        for msg in msgs:
+            self.add(msg)
+        return self
+
+    def pop(self):
+        return self.queued.popitem()[0]
+
+    def clear(self):
+        # Drop the waiting messages without sending them.
+        self.queued.clear()
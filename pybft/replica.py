@@ -3,8 +3,21 @@
 # https://www.microsoft.com/en-us/research/wp-content/uploads/2017/01/tm590.pdf
 
 from collections import defaultdict
-from hashlib import sha256
 from collections import Counter
+from time import perf_counter
+
+from pybft.msglog import msglog
+from pybft.certificate import certificates
+from pybft.collector import collector, msg_size
+from pybft.service import service as null_service
+from pybft.digest import digests
+from pybft.outbox import outbox
+from pybft.retransmit import retransmitter
+from pybft.admission import admission, pending
+from pybft.store import store
+from pybft.fetch import fetcher
+from pybft.merkle import checkpointer
+from pybft.transfer import transfer
 
 
 NoneT = lambda: None
@@ -28,31 +41,108 @@ class replica(object):
     # Checkpoint messages
     _CHECKPOINT = "_CHECKPOINT"
 
+    # A batch of requests ordered by a single PREPREPARE
+    _BATCH      = "_BATCH"
+
+    # A request not admitted, to be retried later
+    _BUSY       = "_BUSY"
+
+    # A request referred to by its digest, and a request for the bodies
+    # of such references
+    _REF        = "_REF"
+    _FETCH      = "_FETCH"
+
+    # State transfer: a request for parts of a checkpoint, and a part
+    _GETSTATE   = "_GETSTATE"
+    _STATE      = "_STATE"
+
     def filter_type(self, xtype, M=None):
         if M is None:
             M = self.in_i
 
-        for msg in M:
-            if msg[0] == xtype:
-                yield msg
+        # Use the index of the log, but iterate over a copy so that
+        # callers may update the log as they go.
+        if isinstance(M, msglog):
+            return iter(tuple(M.of_type(xtype)))
+
+        return (msg for msg in M if msg[0] == xtype)
+
+    def requests_of(self, m):
+        # The requests ordered by the payload of a PREPREPARE.
+        if m is None:
+            return ()
+        if m[0] == self._BATCH:
+            return m[1]
+        return (m,)
+
+    def msg_digest(self, msg):
+        # The digest under which the message log indexes a message.
+        xtype = msg[0]
+        if xtype == self._PREPARE or xtype == self._COMMIT:
+            return msg[3]
+        elif xtype == self._PREPREPARE:
+            return self.hash(msg[3])
+        elif xtype == self._REQUEST:
+            return self.hash(msg)
+        return None
 
 
-    def __init__(self,i, R):
+    def __init__(self,i, R, service=None):
         self.i = i
         self.R = R
         self.f = (R - 1) // 3
-        self.vali = None # v_0
+        self.service = service if service is not None else null_service() # v_0
         self.view_i = 0
-        self.in_i = set()
-
-        self.out_i = set()
+        self.digests = digests(self._BATCH, ref_tag=self._REF)
+        self.in_i = msglog([self._PREPREPARE, self._PREPARE, \
+                            self._COMMIT, self._CHECKPOINT], self.msg_digest)
+        self.certs = certificates(self)
+        self.in_i.watchers.append(self.certs)
+        self.gc = collector(self)
+        self.in_i.watchers.append(self.gc)
+
+        # One body per request in the log, shared by its messages.
+        self.store = store(self)
+        self.in_i.watchers.append(self.store)
+
+        # PREPREPAREs carry request digests only, if set (see pybft.fetch).
+        self.digest_preprepares = False
+        self.fetch = fetcher(self)
+
+        self.out_i = outbox(self)
+        self.retx = retransmitter(self)
         self.last_rep_i = defaultdict(NoneT)
         self.last_rep_ti = defaultdict(int)
         self.seqno_i = 0
         self.last_exec_i = 0
 
-        # Initialize checkpoints
-        initial_checkpoint = self.to_checkpoint(self.vali, self.last_rep_i, self.last_rep_ti)
+        # Authenticator used by transports, if any (see pybft.auth).
+        self.auth = None
+
+        # Lifecycle tracer of the slots, if any (see pybft.trace).
+        self.tracer = None
+
+        # Write-ahead log, if any (see pybft.wal).
+        self.wal = None
+
+        # Requests awaiting a PREPREPARE at the primary, with arrival times,
+        # and the bounds on the requests admitted in the log.
+        self.pending_i = pending()
+        self.admission = admission(self)
+        self.clock = perf_counter
+
+        # PREPREPAREs that overtook the NEWVIEW of their view, replayed once
+        # we accept it.
+        self.early_i = set()
+
+        # Initialize checkpoints: they are digests of the service snapshot
+        # and of a Merkle tree of the reply table (see pybft.merkle).
+        self.chkpts = checkpointer(self)
+        initial_checkpoint = self.chkpts.digest(0)
+
+        # Fetches the state of checkpoints we fell behind (see
+        # pybft.transfer).
+        self.transfer = transfer(self)
 
         self.checkpts_i = set([(0, initial_checkpoint)])
         for i in range(self.R):
@@ -65,25 +155,47 @@ class replica(object):
         self.chkpt_int = 10
         assert self.chkpt_int < self.max_out
 
+        # Batching: a PREPREPARE orders up to batch_size requests, and the
+        # primary waits up to batch_timeout seconds to fill a batch.
+        self.batch_size = 1
+        self.batch_timeout = 0.0
+
         # Testing 
         self.stable_n()
         self.stat = Counter()
 
-    def to_checkpoint(self, vi, rep, rep_t):
-        rep_ser = tuple(sorted(rep.items()))
-        rep_t_ser = tuple(sorted(rep_t.items()))
+    def to_checkpoint(self, n):
+        # Checkpoint the current state as seqno n, and return its digest.
+        return self.chkpts.take(n)
 
-        return (vi, rep_ser, rep_t_ser)
+    def checkpoint_state(self, n):
+        # The state of a checkpoint we hold: the service snapshot and the
+        # entries (c, t, result) of the reply table.
+        return self.chkpts.state(n)
 
-    def from_checkpoint(self, chkpt):
-        vali, rep_s, rep_t_s = chkpt
-        last_rep_i = defaultdict(NoneT).update(rep_s)
-        last_rep_ti = defaultdict(int).update(rep_t_s)
-
-        return (vali, last_rep_i, last_rep_ti)
+    def from_checkpoint(self, n, state):
+        # Restores the service and the reply tables, and returns the
+        # digest of the checkpoint.
+        d = self.chkpts.restore(n, state)
+        snap, entries = state
+        self.last_rep_i = defaultdict(NoneT, ((c, r) for (c, t, r) in entries))
+        self.last_rep_ti = defaultdict(int, ((c, t) for (c, t, r) in entries))
+        return d
 
     def valid_sig(self, i, m):
-        return True
+        # m is the (payload, tags) of an authenticated message from i.
+        if self.auth is None:
+            return True
+        payload, tags = m
+        return self.auth.verify(i, payload, tags)
+
+
+    def resend(self, msg, dests=None):
+        # Retransmissions are not suppressed as duplicates by the outbox.
+        if isinstance(self.out_i, outbox):
+            self.out_i.resend(msg, dests)
+        else:
+            self.out_i.add(msg)
 
 
     def primary(self, v=None):
@@ -114,7 +226,7 @@ class replica(object):
         if v == 0:
             return True
         else:
-            for msg in self.filter_type(self._NEWVIEW):
+            for msg in self.in_i.of_type(self._NEWVIEW):
                 if msg[1] == v:
                     return True
             return False
@@ -123,23 +235,17 @@ class replica(object):
         return (n % self.chkpt_int) == 0
 
 
-    def hash(self, m, cache={}):
-        if m in cache:
-            return cache[m]
-        t = ("%2.2f" % m[2]).encode("utf-8")
-        bts = m[1] + b"||" + t + b"||" + m[3] # TODO: fix formatting
-        h = sha256(bts).hexdigest()
-
-        if len(cache) > 1000:
-            cache.clear()
-        cache[m] = h
-        return h
+    def hash(self, m):
+        return self.digests.of(m)
 
 
     def prepared(self, m, v, n, M=None):
-        if M is None:
-            M = self.in_i
+        if M is None or M is self.in_i:
+            cert = self.certs.get(v, n, self.hash(m))
+            return cert is not None and cert.prepared() and \
+                   cert.preprepare == (self._PREPREPARE, v, n, m, self.primary(v))
 
+        # Reference path: the predicate of the spec over a set of messages.
         cond = (self._PREPREPARE, v, n, m, self.primary(v)) in M
         
         others = set()
@@ -154,9 +260,13 @@ class replica(object):
 
 
     def commited(self, m, v, n, M=None):
-        if M is None:
-            M = self.in_i
+        if M is None or M is self.in_i:
+            hm = self.hash(m)
+            cert = self.certs.get(v, n, hm)
+            return cert is not None and cert.committed() and \
+                   (self.certs.is_proposed(n, hm) or m in self.in_i)
 
+        # Reference path: the predicate of the spec over a set of messages.
         cond = False
         for mx in self.filter_type(self._PREPREPARE, M):
             (_, vp, np, mp, jp) = mx
@@ -196,50 +306,68 @@ class replica(object):
         # We have already replied to the message
         if c in self.last_rep_ti and t == self.last_rep_ti[c]:
             new_reply = (self._REPLY, self.view_i, t, c, self.i, self.last_rep_i[c])
-            self.out_i.add( new_reply )
+            self.resend( new_reply )
+        elif not self.admission.admit(msg):
+            self.resend( self.admission.busy(msg) )
         else:
             self.in_i.add( msg )
             # If not the primary, send message to all.
             if self.primary() != self.i:
-                self.out_i.add( msg )
+                self.resend( msg )
 
-            ## Liveness hack. TODO: check it.
             else: 
                 # If we are the primary, and have send a 
                 # preprepare message for this request, send it
-                # again here.
-
-                for xmsg in self.filter_type(self._PREPREPARE, self.in_i):
-                    if xmsg[1] == self.view_i and \
-                       xmsg[3] == msg:
+                # again here. Otherwise, it waits for a batch.
+                resent = self.retx.proposals(msg)
 
-                       self.out_i.add(xmsg)
+                if not resent and msg not in self.pending_i:
+                    self.pending_i[msg] = self.clock()
 
 
     def receive_preprepare(self, msg):
         (_, v, n, m, j) = msg
         if j == self.i: return
 
+        if v >= self.view_i and not self.has_new_view(v) and j == self.primary(v) \
+           and self.in_w(n):
+            # Only the latest view is kept, a window of it at most.
+            if all(pp[1] <= v for pp in self.early_i):
+                self.early_i = set(pp for pp in self.early_i if pp[1] == v)
+                if len(self.early_i) < self.max_out:
+                    self.early_i.add(msg)
+            return
+
         cond = (self.primary() == j)
         cond &= self.in_wv(v, n)
         cond &= self.has_new_view(v)
 
         hm = self.hash(m)
-        for mx in self.filter_type(self._PREPARE):
+        for mx in self.filter_type(self._PREPARE, self.in_i.at_slot(v, n)):
             (_, vp, np, dp, ip) = mx
             if (vp, np, ip) == (v, n, self.i):
                 cond &= (dp == hm)
 
         if cond:
             # Send a prepare message
-            p = (self._PREPARE, v, n, self.hash(m), self.i)
+            p = (self._PREPARE, v, n, hm, self.i)
             self.in_i |= set([p, msg])
             self.out_i.add(p)
+            if self.tracer is not None:
+                self.tracer.mark(v, n, hm, "preprepare")
 
         else:
-            # Add the request to the received messages
-            if m != None:
-                self.in_i.add(m)
+            # Keep the requests as if their clients sent them, unless they
+            # were already executed: nothing would collect them again. They
+            # go through admission like any other.
+            for req in self.requests_of(m):
+                if req[0] != self._REQUEST or req[2] <= self.last_rep_ti.get(req[3], 0) \
+                   or not self.admission.admit(req):
+                    continue
+                self.in_i.add(req)
+                if self.primary() == self.i and self.is_pending(req) and \
+                   req not in self.pending_i:
+                    self.pending_i[req] = self.clock()
 
 
     def receive_prepare(self, msg):
@@ -264,6 +392,9 @@ class replica(object):
 
         if self.view_i >= v and self.in_w(n):
             self.in_i.add(msg)
+        elif n - self.stable_n() >= self.max_out:
+            # We are far behind: it may call for a state transfer.
+            self.transfer.heard(msg)
 
 
     def receive_view_change(self, msg):
@@ -306,6 +437,12 @@ class replica(object):
             self.in_i |= (O | N | P)
             self.in_i.add(msg)
             self.out_i |= P
+            self.update_state_nv(v, X, msg, maxV)
+
+            early, self.early_i = self.early_i, set()
+            for pp in sorted(early, key=lambda pp: pp[2]):
+                if pp[1] == v:
+                    self.receive_preprepare(pp)
             return True
         else:
             return False
@@ -318,30 +455,83 @@ class replica(object):
         cond &= (n == self.seqno_i + 1)
         cond &= self.in_wv(v, n)
         cond &= self.has_new_view(v)
-        cond &= m in self.in_i
 
         # Ensure we only process once.
-        cond &= m[0] == self._REQUEST
-        for ms in self.filter_type(self._PREPREPARE):
-            (_, vp, np, mp, ip) = ms
-            cond &= ((vp, mp) != (v, m))
+        cond &= m[0] in (self._REQUEST, self._BATCH)
+        for req in self.requests_of(m):
+            cond &= req[0] == self._REQUEST and req in self.in_i
+            for ms in self.certs.proposals(req):
+                cond &= ms[1] != v
 
         if cond:
             self.seqno_i = self.seqno_i + 1
             p = (self._PREPREPARE, v, n, m, self.i)
-            self.out_i.add(p)
+            self.out_i.add(self.fetch.strip(p) if self.digest_preprepares else p)
             self.in_i.add(p)
+            if self.tracer is not None:
+                self.tracer.mark(v, n, self.hash(m), "preprepare")
 
             return True
         else:
             return False
 
 
+    def is_pending(self, req):
+        # A request is pending until it leaves the log or is proposed in
+        # the current view.
+        if req not in self.in_i:
+            return False
+        return all(ms[1] != self.view_i for ms in self.certs.proposals(req))
+
+    def send_batches(self, force=False):
+        # Pack pending requests, round robin across clients, into
+        # PREPREPAREs of up to batch_size requests. A partial batch is only
+        # sent once its oldest request waited batch_timeout, or if forced.
+        if self.primary() != self.i:
+            return False
+
+        sent = False
+        while self.pending_i:
+            batch = []
+            while self.pending_i and len(batch) < self.batch_size:
+                req, since = self.pending_i.pop()
+                if self.is_pending(req):
+                    batch.append((req, since))
+
+            if not batch:
+                break
+
+            ready = force or len(batch) == self.batch_size or \
+                    self.clock() - min(since for _, since in batch) >= self.batch_timeout
+
+            reqs = tuple(req for req, _ in batch)
+            m = reqs[0] if len(reqs) == 1 else (self._BATCH, reqs)
+            if not (ready and self.send_preprepare(m, self.view_i, self.seqno_i+1)):
+                # Put the requests back at the front, in order.
+                for req, since in reversed(batch):
+                    self.pending_i.push_front(req, since)
+                break
+
+            sent = True
+
+        return sent
+
+    def tick(self):
+        # Time-driven entry point: transports call it periodically to
+        # flush the batches whose timeout expired, and to repeat fetches
+        # and state transfer requests.
+        self.fetch.tick()
+        self.transfer.tick()
+        return self.send_batches()
+
+
     def send_commit(self, m, v, n):
         c = (self._COMMIT, v, n, self.hash(m), self.i)
         if c not in self.in_i and self.prepared(m,v,n):
             self.out_i.add(c)
             self.in_i.add(c)
+            if self.tracer is not None:
+                self.tracer.mark(v, n, c[3], "prepared")
             return True
         else:
             return False
@@ -350,25 +540,44 @@ class replica(object):
     def execute(self, m, v, n):
         if n == self.last_exec_i + 1 and self.commited(m, v, n):
             self.last_exec_i = n
-            if m != None: # TODO: check null representation
-                (_, o, t, c) = m
-                if t >= self.last_rep_ti[c]:
-                    if t > self.last_rep_ti[c]:
-                        self.last_rep_ti[c] = t
-                        self.last_rep_i[c], self.vali = None, None # TODO: EXEC
-                        #if self.i == 1:
-                        #    print("********** %s:%s" % (self.last_exec_i, (t, c)) )
+            if self.tracer is not None:
+                hm = self.hash(m)
+                self.tracer.mark(v, n, hm, "committed")
+
+            # Hand the new operations of a batch to the service in one call,
+            # in order. The null request of a new view has none.
+            reqs = self.requests_of(m)
+            fresh = []
+            for (_, o, t, c) in reqs:
+                if t > self.last_rep_ti[c]:
+                    self.last_rep_ti[c] = t
+                    self.gc.touch_client(c)
+                    fresh.append((o, t, c))
+
+            results = {}
+            if fresh:
+                results = dict(zip(fresh, self.service.execute_batch(fresh)))
+
+            for req in reqs:
+                (_, o, t, c) = req
+                if (o, t, c) in results:
+                    self.last_rep_i[c] = results[(o, t, c)]
+                    self.chkpts.update(c, t, results[(o, t, c)])
+                if (o, t, c) in results or t == self.last_rep_ti[c]:
                     rep = (self._REPLY, self.view_i, t, c, self.i, self.last_rep_i[c])
                     self.out_i.add(rep)
-            self.in_i.discard(m)
+                self.in_i.discard(req)
 
             if self.take_chkpt(n):
-                new_chkpt = self.to_checkpoint(self.vali, self.last_rep_i, self.last_rep_ti)
+                new_chkpt = self.to_checkpoint(n)
                 m = (self._CHECKPOINT, self.view_i, n, new_chkpt, self.i)
                 self.in_i.add(m)
                 self.out_i.add(m)
                 self.checkpts_i.add((n, new_chkpt))
+                self.gc.touch_checkpoints()
 
+            if self.tracer is not None:
+                self.tracer.mark(v, n, hm, "executed")
             return True
         else:
             return False
@@ -394,7 +603,7 @@ class replica(object):
             P.add(prep)
             (_, vi2,ni2, mi2, _) = prep
 
-            for mx in self.filter_type(self._PREPARE, self.in_i): 
+            for mx in self.filter_type(self._PREPARE, self.in_i.at_slot(vi2, ni2)): 
                 if mx[:4] == (self._PREPARE, vi2, ni2, self.hash(mi2)):
                     if mx[4] != self.primary(vi2):
                         P.add(mx)
@@ -508,111 +717,117 @@ class replica(object):
             return False
 
     def update_state_nv(self, v, V, m, maxV):
+        # The view changes certify checkpoint maxV: adopt their proof, and
+        # fetch its state if we did not execute up to it (see
+        # pybft.transfer).
         if maxV > self.stable_n():
-            (_, _, xn, xs, C, _, _) = V[0]
-            if xn == maxV:
-                self.in_i |= C
-
-            own_chkpt = (self._CHECKPOINT, v, xn, xs, i)
-            if own_chkpt not in self.in_i:
-                self.in_i.add(own_chkpt)
-                self.out_i.add(own_chkpt)
-
-            for chk in list(self.checkpts_i):
-                ni, si = chk
-                if ni < maxV:
-                    self.checkpts_i.remove(chk)
-
-            if maxV > self.last_exec_i:
-                self.checkpts_i.add( (maxV, s) )
-
-            vx = self.stable_chkpt
-            self.vali, self.last_rep_i, self.last_rep_ti = from_checkpoint(vx)
-            self.last_exec_i = maxV
+            for (_, _, xn, xs, C, _, _) in V:
+                if xn == maxV:
+                    self.in_i |= C
+                    if maxV > self.last_exec_i:
+                        self.transfer.want(xn, xs, [x[-1] for x in C])
+                    break
+            self.gc.touch_checkpoints()
 
 
     def garbage_collect(self):
-        counter = defaultdict(set)
-        X = 0
-        for msg in self.filter_type(self._CHECKPOINT):
-            (_, cv, cn, cs, ci) = msg
-            counter[(cn, cs)].add(ci)
-            X+=1
-
-        n, s = (-1, 0)
-        for (cn, cs) in counter:
-            # NOTE: Additional check not in spec: (cn, cs) in self.checkpts_i
-            if len(counter[(cn, cs)]) > self.f and (cn, cs) in self.checkpts_i:
-                n, s = max((n,s), (cn, cs))
-
-        ## TODO: Check this is correct -- not in the spec
-        # self.checkpts_i.add( (n, s) )
-
-        # Massive clean-up
-        to_delete = set()
-        for msg in self.in_i:
-            xtype = msg[0]
-            if xtype in [self._PREPREPARE, self._PREPARE, \
-                         self._COMMIT, self._CHECKPOINT]:
-                xn = msg[2]
+        # Only collect protocol messages when the low watermark, the
+        # highest checkpoint with more than f votes that we also hold,
+        # advances. From then on the log refuses slot messages below the
+        # watermark, so none are left behind until the next advance.
+        # Executed requests are found through the per-client index of the
+        # collector.
+        start = perf_counter()
+        gc = self.gc
+        gc.stats["runs"] += 1
+
+        to_delete = gc.executed_requests()
+
+        n = gc.advanced_to(self.checkpts_i)
+        if n is not None:
+            gc.stats["advances"] += 1
+            self.in_i.low = n
+
+            # Drop whole per-seqno buckets below the watermark
+            for xn in self.in_i.seqnos():
                 if xn < n:
-                    to_delete.add(msg)
+                    to_delete += list(self.in_i.at_seqno(xn))
 
-        self.in_i -= to_delete
+            # Now delete the checkpoints
+            self.checkpts_i -= set((xn, s) for (xn, s) in self.checkpts_i if xn < n)
+            self.chkpts.stable(n)
 
-        # Now delete the checkpoints
-        to_delete_chk = set()
-        for (xn, s) in self.checkpts_i:
-            if xn < n:
-                to_delete_chk.add( (xn, s) )
-        self.checkpts_i -= to_delete_chk
+        if to_delete:
+            gc.stats["msgs"] += len(to_delete)
+            gc.stats["bytes"] += sum(msg_size(msg) for msg in to_delete)
+            self.in_i -= to_delete
 
-        # Now grabage collect requests
-        to_delete_req = set()
-        for msg in self.filter_type(self._REQUEST):
-            (_, o, t, c) = msg
-            if c in self.last_rep_ti and self.last_rep_ti[c] == t:
-                to_delete_req.add(msg)
-    
-        self.in_i -= to_delete_req        
+        gc.stats["time"] += perf_counter() - start
 
-        # if n > 0 and len(to_delete):
-        #    print("DELETED (%s): %s,%s (in_i=%s stable n=%s)" % (n, len(to_delete), len(to_delete_chk), len(self.in_i), self.stable_n()))
-        #    print(Counter([m[0] for m in self.in_i]))
+        # The log on disk restarts from the new stable checkpoint.
+        if n is not None and self.wal is not None:
+            self.wal.compact()
 
+        # The window moved: requests waiting for it may now be ordered.
+        if n is not None and self.pending_i:
+            self.send_batches()
 
 
     # System's calls
 
     def route_receive(self, msg):
+        if self.store is not None:
+            msg = self.store.message(msg)
 
         xtype = msg[0]
         self.stat.update([xtype])
         xlen = len(msg)
         if xtype == self._REQUEST and xlen == 4:
+            retry = msg in self.in_i
             self.receive_request(msg)
-            ret = self.send_preprepare(msg, self.view_i, self.seqno_i+1)
-
-            # TODO CHECK CORRECTNESS -- NOT IN SPEC:
-            # Check if we are done with this. Then respond again to all:
+            if self.fetch.wanted(msg):
+                # The body of parked PREPREPAREs, once it went through
+                # admission like any request.
+                for pp in self.fetch.arrived(msg):
+                    if pp is not None:
+                        self.route_receive(pp)
+            ret = self.send_batches()
+
+            # A client retrying a request: help the replicas that did not
+            # execute it, or get help if we did not (see pybft.retransmit).
             (_, o, t, c) = msg
             if c in self.last_rep_ti and self.last_rep_ti[c] == t:
-                self.out_i |= set(self.filter_type(self._COMMIT))
-                self.out_i |= set(self.filter_type(self._CHECKPOINT))
+                self.retx.request(msg)
+            elif retry:
+                self.retx.stalled()
 
             
         elif xtype == self._PREPREPARE and xlen == 5:
-            self.receive_preprepare(msg)
+            msg = self.fetch.resolve(msg)
+            if msg is not None:
+                self.retx.received(msg)
+                self.receive_preprepare(msg)
 
         elif xtype == self._PREPARE and xlen == 5:
+            self.retx.received(msg)
             self.receive_prepare(msg)
             
         elif xtype == self._COMMIT and xlen == 5:
+            self.retx.received(msg)
             self.receive_commit(msg)
 
         elif xtype == self._CHECKPOINT and xlen == 5:
             self.receive_checkpoint(msg)
 
+        elif xtype == self._FETCH and xlen == 3:
+            self.fetch.answer(msg)
+
+        elif xtype == self._GETSTATE and xlen == 5:
+            self.transfer.answer(msg)
+
+        elif xtype == self._STATE and xlen == 6:
+            self.transfer.arrived(msg)
+
         elif xtype == self._VIEWCHANGE and xlen == 4 + 3:
             self.receive_view_change(msg)
 
@@ -641,21 +856,89 @@ class replica(object):
             raise Exception("UNKNOWN type: ", msg)
 
         # Make as much progress as possible
-        all_preps = []
-        for prep in self.filter_type(self._PREPREPARE):
-            if not (prep[1] >= self.view_i and prep[2] >= self.last_exec_i + 1): continue
-            all_preps += [ prep ]
-
-        all_preps = sorted(all_preps, key=lambda xmsg: xmsg[2])
-
-        for (_, vx, nx, mx, _) in all_preps:
-                self.send_commit(mx,vx,nx)
-                self.execute(mx,vx,nx)
+        self.make_progress()
 
         # Garbage collect
         self.garbage_collect()
 
 
+    def route_receive_many(self, msgs):
+        # Deliver messages in order, with the same results as calling
+        # route_receive on each. The PREPREPAREs, PREPAREs and COMMITs
+        # only go through their handlers: until the next slot may execute,
+        # progress only sends our COMMITs, which no handler looks at, and
+        # garbage collection has nothing to do. So both run when the next
+        # slot may execute, before any other message, and once at the end.
+        slot_types = (self._PREPREPARE, self._PREPARE, self._COMMIT)
+        handlers = {self._PREPREPARE: self.receive_preprepare, \
+                    self._PREPARE: self.receive_prepare, \
+                    self._COMMIT: self.receive_commit}
+        deferred = False
+        for msg in msgs:
+            xtype = msg[0]
+            if xtype in slot_types and len(msg) == 5:
+                if xtype == self._PREPREPARE:
+                    if self.store is not None:
+                        msg = self.store.message(msg)
+                    msg = self.fetch.resolve(msg)
+                    if msg is None:
+                        continue
+                self.stat.update([xtype])
+                self.retx.received(msg)
+                handlers[xtype](msg)
+                deferred = True
+                if self.may_execute():
+                    self.make_progress()
+                    self.garbage_collect()
+                    deferred = False
+            else:
+                if deferred:
+                    self.make_progress()
+                    self.garbage_collect()
+                    deferred = False
+                self.route_receive(msg)
+
+        if deferred:
+            self.make_progress()
+            self.garbage_collect()
+
+
+    def may_execute(self):
+        # Whether the next slot, if touched, has enough COMMITs to execute
+        # once we add ours.
+        n = self.last_exec_i + 1
+        if n not in self.certs.touched:
+            return False
+        for (_, vx, nx, mx, _) in self.certs.preprepares(n):
+            cert = self.certs.get(vx, nx, self.hash(mx))
+            if cert is not None and len(cert.commits) >= 2*self.f:
+                return True
+        return False
+
+
+    def make_progress(self):
+        # Only re-evaluate the slots touched by new messages since the
+        # last call, then execute in order while the next slot is commited.
+        for n in sorted(self.certs.take_touched()):
+            if n < self.last_exec_i + 1: continue
+            for (_, vx, nx, mx, _) in list(self.certs.preprepares(n)):
+                if vx >= self.view_i:
+                    self.send_commit(mx, vx, nx)
+
+        executed = True
+        while executed:
+            executed = False
+            for (_, vx, nx, mx, _) in list(self.certs.preprepares(self.last_exec_i + 1)):
+                if vx >= self.view_i:
+                    self.send_commit(mx, vx, nx)
+                    if self.execute(mx, vx, nx):
+                        executed = True
+                        break
+
+        # Our own COMMITs touched the slots we just evaluated.
+        self.certs.touched.clear()
+
+
     def unhandled_requests(self):
         unhand = list(self.filter_type(self._REQUEST))
         return unhand
@@ -0,0 +1,179 @@
+# Targeted retransmission. Replicas help each other catch up by
+# re-sending their own messages for single slots, never whole logs:
+#
+# - a client re-sending a request a replica executed gets it to re-send
+#   its messages for the slot that ordered the request: the PREPREPARE of
+#   the primary, and its PREPAREs and COMMITs;
+# - a client re-sending a request a replica did not execute yet gets it
+#   to re-send its messages for the next slot it waits for;
+# - a replica receiving again a message for a slot it executed, from a
+#   peer that is behind, re-sends its messages for that slot to that
+#   peer only.
+#
+# If the slot has been garbage collected, the replica re-sends its
+# CHECKPOINT for the stable checkpoint instead. Only the messages of a
+# replica's own are re-sent, so they authenticate as coming from it, and
+# PREPREPAREs go with digests only if the replica sends them so.
+# Retransmissions to every peer are limited by a token bucket, and help
+# for a slot is asked for, or given to a peer, at most once per interval,
+# so that retries under load do not turn into message storms, and that
+# replicas both up to date do not answer each other's answers. When the
+# tokens for a peer run low, the messages re-sent to it within the
+# interval give way to the others, so that the retries for a few slots
+# cannot take every token and starve the rest.
+
+from collections import Counter, OrderedDict
+
+
+class retransmitter(object):
+
+    def __init__(self, rep, rate=100.0, burst=10, interval=0.1, history=10000):
+        self.rep = rep
+
+        # Retransmissions per second, and in a burst, to each peer.
+        self.rate = rate
+        self.burst = burst
+        self.tokens = {}
+        self.stamps = {}
+
+        # (peer, v, n) -> when we last answered it, in LRU order.
+        self.answered = OrderedDict()
+        self.interval = interval
+        self.history = history
+
+        # (peer, message) -> when we last re-sent it, in LRU order.
+        self.sent = OrderedDict()
+
+        # The slot we last asked help for, and when.
+        self.stall = (None, None)
+
+        self.stat = Counter()
+
+    def level(self, j, now):
+        # The tokens available for peer j.
+        tokens = self.tokens.get(j, self.burst)
+        stamp = self.stamps.get(j, now)
+        return min(self.burst, tokens + (now - stamp) * self.rate)
+
+    def allow(self, j):
+        now = self.rep.clock()
+        tokens = self.level(j, now)
+        self.stamps[j] = now
+        if tokens < 1:
+            self.tokens[j] = tokens
+            self.stat["limited"] += 1
+            return False
+        self.tokens[j] = tokens - 1
+        return True
+
+    def own(self, msgs):
+        rep = self.rep
+        types = (rep._PREPREPARE, rep._PREPARE, rep._COMMIT)
+        return [msg for msg in msgs if msg[0] in types and msg[-1] == rep.i]
+
+    def checkpoint_messages(self):
+        # Our CHECKPOINT for the stable checkpoint, if it is not the first.
+        rep = self.rep
+        n, s = rep.stable_n(), rep.stable_chkpt()
+        return [msg for msg in rep.in_i.at_seqno(n) if msg[0] == rep._CHECKPOINT \
+                and msg[3] == s and msg[-1] == rep.i and n > 0]
+
+    def slot_messages(self, v, n):
+        # Our messages for slot (v, n), or our checkpoint if it is gone.
+        low = self.rep.in_i.low
+        if low is not None and n < low:
+            return self.checkpoint_messages()
+        return self.own(self.rep.in_i.at_slot(v, n)) or self.checkpoint_messages()
+
+    def request(self, req):
+        # A client re-sent `req`, which we executed.
+        rep = self.rep
+        self.stat["requests"] += 1
+        msgs = []
+        for pp in rep.certs.proposals(req):
+            msgs += self.own(rep.in_i.at_slot(pp[1], pp[2]))
+        self.send(msgs or self.checkpoint_messages())
+
+    def stalled(self):
+        # A client re-sent a request we did not execute yet: re-send what
+        # we have for the next slot, for the others to answer.
+        rep = self.rep
+        n, now = rep.last_exec_i + 1, rep.clock()
+        if self.stall[0] == n and now - self.stall[1] < self.interval:
+            return
+        self.stall = (n, now)
+        self.stat["stalled"] += 1
+        self.send(self.own(rep.in_i.at_seqno(n)))
+
+    def received(self, msg):
+        # Called before handling a PREPREPARE, PREPARE or COMMIT: a peer
+        # re-sending a message for a slot we executed is behind.
+        rep = self.rep
+        (_, v, n, _, j) = msg
+        if j == rep.i or n > rep.last_exec_i:
+            return
+        low = rep.in_i.low
+        if msg in rep.in_i or (low is not None and n < low):
+            now = rep.clock()
+            last = self.answered.get((j, v, n))
+            if last is not None and now - last < self.interval:
+                return
+            self.answered[(j, v, n)] = now
+            self.answered.move_to_end((j, v, n))
+            if len(self.answered) > self.history:
+                self.answered.popitem(last=False)
+
+            self.stat["behind"] += 1
+            self.send(self.slot_messages(v, n), [j])
+
+    def proposals(self, req):
+        # The primary re-sends its PREPREPAREs of `req` in the current
+        # view, and tells whether there were any.
+        rep = self.rep
+        msgs = [pp for pp in rep.certs.proposals(req) if pp[1] == rep.view_i]
+        self.send(msgs)
+        return len(msgs) > 0
+
+    def fresh(self, msgs, j, now):
+        # The messages not re-sent to peer j within the interval, or all
+        # of them while its tokens are plentiful.
+        if self.level(j, now) >= self.burst / 2:
+            return msgs
+        sent = self.sent
+        out = []
+        for msg in msgs:
+            last = sent.get((j, msg))
+            if last is None or now - last >= self.interval:
+                out.append(msg)
+            else:
+                self.stat["recent"] += 1
+        return out
+
+    def send(self, msgs, peers=None):
+        if not msgs:
+            return
+        rep = self.rep
+        if peers is None:
+            peers = range(rep.R)
+        now, sent = rep.clock(), self.sent
+
+        # Message -> the peers to re-send it to.
+        dests = OrderedDict()
+        for j in peers:
+            if j == rep.i:
+                continue
+            todo = self.fresh(msgs, j, now)
+            if not todo or not self.allow(j):
+                continue
+            for msg in todo:
+                dests.setdefault(msg, []).append(j)
+                sent[(j, msg)] = now
+                sent.move_to_end((j, msg))
+        while len(sent) > self.history:
+            sent.popitem(last=False)
+
+        for msg, js in dests.items():
+            if rep.digest_preprepares and msg[0] == rep._PREPREPARE:
+                msg = rep.fetch.strip(msg)
+            rep.resend(msg, js)
+            self.stat["msgs"] += len(js)
@@ -0,0 +1,29 @@
+# Application state machines. The replica hands the operations of
+# committed requests to its service in sequence order, and uses the
+# snapshot and restore hooks of the service to build and install the
+# application part of checkpoints.
+#
+# The base class is the null service of the specification: every
+# operation returns None and the state never changes.
+
+
+class service(object):
+
+    def execute(self, o, t, c):
+        # Apply operation `o` of client `c` at timestamp `t`, and return
+        # the result sent back in the _REPLY.
+        return None
+
+    def execute_batch(self, ops):
+        # Apply a list of (o, t, c) operations in order, and return the
+        # list of their results. Services with a high cost per operation
+        # should override this to apply them in one go.
+        return [self.execute(o, t, c) for (o, t, c) in ops]
+
+    def snapshot(self):
+        # A hashable value capturing the state, embedded in checkpoints.
+        return None
+
+    def restore(self, snap):
+        # Install the state captured by `snapshot`.
+        pass
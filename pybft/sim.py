@@ -0,0 +1,287 @@
+# A deterministic discrete-event simulator for a cluster of replicas.
+# Events live in a heap ordered by simulated time, all randomness comes
+# from one seeded generator, and every directed link between endpoints
+# has a latency, jitter, bandwidth and loss model. Messages go where the
+# outbox of their replica routes them, all clients being one endpoint.
+#
+# Clients run a closed loop: up to `in_flight` requests are outstanding,
+# a request completes once f+1 replicas replied, and requests without
+# enough replies, or that got a busy signal, are re-sent to all replicas
+# after `retry` seconds. The report gives simulated throughput, request
+# latency percentiles, and message and byte counts. `run_clients` runs
+# the loop with client objects instead (see pybft.client), each keeping
+# its own window of requests outstanding.
+#
+# With `wire`, every delivery is a copy decoded from the encoded message,
+# as with a real transport, instead of the object that was sent. With
+# `multicast`, clients send new requests to every replica rather than to
+# one, as they should when PREPREPAREs only carry digests.
+
+import heapq
+import math
+import random
+from collections import Counter, deque
+
+from pybft.replica import replica
+from pybft.codec import wirecodec
+
+
+CLIENT = "client"
+
+
+class link(object):
+
+    def __init__(self, latency=0.001, jitter=0.0, bandwidth=1.25e8, loss=0.0):
+        # Seconds, seconds, bytes per second and drop probability.
+        self.latency = latency
+        self.jitter = jitter
+        self.bandwidth = bandwidth
+        self.loss = loss
+
+        # Messages are serialised on the link one after the other.
+        self.busy_until = 0.0
+
+    def arrival(self, rng, now, size):
+        # The arrival time of a message sent now, or None if it is lost.
+        if self.loss > 0 and rng.random() < self.loss:
+            return None
+        start = max(now, self.busy_until)
+        self.busy_until = start + size / float(self.bandwidth)
+        jitter = rng.uniform(0, self.jitter) if self.jitter > 0 else 0.0
+        return self.busy_until + self.latency + jitter
+
+
+def _order(x):
+    # A sort key independent of set iteration order.
+    if isinstance(x, (tuple, frozenset)):
+        items = [_order(y) for y in x]
+        if isinstance(x, frozenset):
+            items.sort()
+        return (1, tuple(items))
+    return (0, repr(x))
+
+
+def percentile(xs, p):
+    # Nearest-rank percentile of a sorted list.
+    if not xs:
+        return None
+    k = max(0, min(len(xs) - 1, int(math.ceil(p / 100.0 * len(xs))) - 1))
+    return xs[k]
+
+
+class simulator(object):
+
+    def __init__(self, f=1, seed=0, default_link=None, batch_size=1, \
+                 batch_timeout=0.0, service=None, tick_interval=0.001, \
+                 retry=0.05, wire=False, multicast=False):
+        self.R = 3*f + 1
+        self.f = f
+        self.rng = random.Random(seed)
+        self.now = 0.0
+
+        self.replicas = []
+        for i in range(self.R):
+            r = replica(i, self.R, service() if service else None)
+            r.batch_size = batch_size
+            r.batch_timeout = batch_timeout
+            r.clock = lambda: self.now
+            self.replicas.append(r)
+
+        self.default_link = default_link if default_link is not None else link()
+        self.links = {}
+        self.codec = wirecodec()
+        self.tick_interval = tick_interval
+        self.retry = retry
+        self.wire = wire
+        self.multicast = multicast
+
+        self.events = []
+        self.seq = 0
+
+        # Accounting
+        self.messages = Counter()
+        self.bytes = 0
+        self.bytes_from = Counter()
+        self.dropped = 0
+        self.busy = 0
+        self.sent_at = {}
+        self.replies = {}
+        self.latencies = []
+
+    def set_link(self, src, dst, model):
+        self.links[(src, dst)] = model
+
+    def get_link(self, src, dst):
+        model = self.links.get((src, dst))
+        if model is None:
+            d = self.default_link
+            model = link(d.latency, d.jitter, d.bandwidth, d.loss)
+            self.links[(src, dst)] = model
+        return model
+
+    def schedule(self, t, kind, data):
+        self.seq += 1
+        heapq.heappush(self.events, (t, self.seq, kind, data))
+
+    def send(self, src, dst, msg):
+        data = self.codec.encode(msg)
+        size = len(data)
+        self.messages[msg[0]] += 1
+        self.bytes += size
+        self.bytes_from[src] += size
+        t = self.get_link(src, dst).arrival(self.rng, self.now, size)
+        if t is None:
+            self.dropped += 1
+        else:
+            if self.wire:
+                msg = self.codec.decode(data)
+            self.schedule(t, "deliver", (dst, msg))
+
+    def flush(self, r):
+        for dest, msgs in sorted(r.out_i.drain(), key=lambda x: _order(x[0])):
+            if not isinstance(dest, int):
+                dest = CLIENT
+            for m in sorted(msgs, key=_order):
+                self.send(r.i, dest, m)
+
+    def submit(self, req):
+        key = (req[2], req[3])
+        self.sent_at[key] = self.now
+        self.replies[key] = set()
+        if self.multicast:
+            for j in range(self.R):
+                self.send(CLIENT, j, req)
+        else:
+            self.send(CLIENT, self.rng.randrange(self.R), req)
+        self.schedule(self.now + self.retry, "retry", req)
+
+    def run(self, requests, in_flight=10, max_time=60.0):
+        queue = deque(requests)
+        outstanding = set()
+        done = 0
+
+        for i in range(self.R):
+            self.schedule(self.tick_interval, "tick", i)
+
+        def refill():
+            while queue and len(outstanding) < in_flight:
+                req = queue.popleft()
+                outstanding.add((req[2], req[3]))
+                self.submit(req)
+
+        refill()
+        while self.events and (queue or outstanding) and self.now <= max_time:
+            t, _, kind, data = heapq.heappop(self.events)
+            self.now = t
+
+            if kind == "deliver":
+                dst, msg = data
+                if dst == CLIENT:
+                    if msg[0] == replica._BUSY:
+                        # Not admitted: the retry timer sends it again.
+                        self.busy += 1
+                        continue
+                    (_, v, rt, c, i, res) = msg
+                    key = (rt, c)
+                    if key in outstanding:
+                        self.replies[key].add(i)
+                        if len(self.replies[key]) >= self.f + 1:
+                            outstanding.discard(key)
+                            self.latencies.append(self.now - self.sent_at[key])
+                            done += 1
+                            refill()
+                else:
+                    r = self.replicas[dst]
+                    r.route_receive(msg)
+                    self.flush(r)
+
+            elif kind == "tick":
+                r = self.replicas[data]
+                r.tick()
+                self.flush(r)
+                self.schedule(self.now + self.tick_interval, "tick", data)
+
+            elif kind == "retry":
+                req = data
+                if (req[2], req[3]) in outstanding:
+                    for j in range(self.R):
+                        self.send(CLIENT, j, req)
+                    self.schedule(self.now + self.retry, "retry", req)
+
+        return self.report(done)
+
+    def push(self, cl):
+        for dest, msgs in cl.drain():
+            for m in msgs:
+                self.send(CLIENT, dest, m)
+
+    def run_clients(self, clients, ops, max_time=60.0):
+        # Client clients[k] submits the operations ops[k]; replies go to
+        # the client owning their lane.
+        owner = {}
+        for cl, todo in zip(clients, ops):
+            cl.clock = lambda: self.now
+            for lane in cl.lanes:
+                owner[lane] = cl
+            for o in todo:
+                cl.submit(o)
+            self.push(cl)
+        total = sum(len(todo) for todo in ops)
+        done = 0
+
+        for i in range(self.R):
+            self.schedule(self.tick_interval, "tick", i)
+        self.schedule(self.tick_interval, "clients", None)
+
+        while self.events and done < total and self.now <= max_time:
+            t, _, kind, data = heapq.heappop(self.events)
+            self.now = t
+
+            if kind == "deliver":
+                dst, msg = data
+                if dst == CLIENT:
+                    cl = owner.get(msg[3])
+                    if cl is None:
+                        continue
+                    if msg[0] == replica._BUSY:
+                        self.busy += 1
+                    cl.receive(msg)
+                    done += len(cl.completed())
+                    self.push(cl)
+                else:
+                    r = self.replicas[dst]
+                    r.route_receive(msg)
+                    self.flush(r)
+
+            elif kind == "tick":
+                r = self.replicas[data]
+                r.tick()
+                self.flush(r)
+                self.schedule(self.now + self.tick_interval, "tick", data)
+
+            elif kind == "clients":
+                for cl in clients:
+                    cl.tick()
+                    self.push(cl)
+                self.schedule(self.now + self.tick_interval, "clients", None)
+
+        for cl in clients:
+            self.latencies.extend(cl.latencies)
+        return self.report(done)
+
+    def report(self, done):
+        lat = sorted(self.latencies)
+        return {
+            "requests": done,
+            "time": self.now,
+            "throughput": done / self.now if self.now > 0 else 0.0,
+            "latency_p50": percentile(lat, 50),
+            "latency_p90": percentile(lat, 90),
+            "latency_p99": percentile(lat, 99),
+            "messages": sum(self.messages.values()),
+            "messages_by_type": dict(self.messages),
+            "bytes": self.bytes,
+            "bytes_from": dict(self.bytes_from),
+            "dropped": self.dropped,
+            "busy": self.busy,
+        }
@@ -0,0 +1,304 @@
+# Checkpoints on disk. The checkpoints a replica holds are kept in a log
+# file instead of memory: a checkpoint appends one record with the entries
+# of the reply table changed since the previous one, and the service
+# snapshot only if it changed, so its cost follows the executions and not
+# the size of the state. In memory only an index of the records remains.
+#
+# A record is a header, with the length and CRC32 of the payload, its
+# kind, seqno and digest, followed by the payload encoded with the wire
+# codec (see pybft.codec). The log starts with a base record holding a
+# whole table; the state of a checkpoint folds the records up to it over
+# the base, reading them from a memory map of the file. Stable markers
+# record which checkpoint is stable.
+#
+# When the stable checkpoint advances, the records up to it are folded
+# into a new base, and the log rewritten, once it grew to `slack` times
+# the size of the last base, so compaction costs a constant amount per
+# checkpoint. A replica restarting from the log installs its stable
+# checkpoint without rewriting it, reading the headers to build the index
+# and only the records up to the stable checkpoint.
+
+import mmap
+import os
+import zlib
+from collections import Counter, OrderedDict
+from hashlib import sha256
+from struct import Struct
+from time import perf_counter
+
+from pybft.codec import wirecodec
+from pybft.merkle import canon
+from pybft.wal import sync_dir
+
+
+_HEADER = Struct(">IIBq32s")
+
+# Record kinds: a whole table, the entries changed since the previous
+# record, and a stable checkpoint.
+_BASE = 0
+_DELTA = 1
+_STABLE = 2
+
+# The snapshot of a record that did not change since the previous one.
+_SAME = ("_SAME",)
+
+
+def _raw(d):
+    return bytes.fromhex(d)
+
+
+class snapstore(object):
+
+    durable = True
+
+    def __init__(self, path, sync=os.fsync, slack=2.0):
+        self.path = path
+        self.sync_file = sync
+        self.slack = slack
+        self.codec = wirecodec()
+
+        # seqno -> (kind, digest, offset, size) of the records held, in
+        # file order, the seqno of the stable one, and the digest of the
+        # last snapshot written.
+        self.index = OrderedDict()
+        self.stable_n = None
+        self.last_snap = None
+
+        self.file = None
+        self.map = None
+        self.size = 0
+        self.base_size = 0
+
+        self.stat = Counter()
+
+    # Files.
+
+    def open(self):
+        if self.file is None:
+            self.file = open(self.path, "ab")
+
+    def close(self):
+        self.unmap()
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def unmap(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+
+    def mapped(self):
+        # A memory map of the whole file, remapped after it grew.
+        if self.map is None or len(self.map) < self.size:
+            self.unmap()
+            with open(self.path, "rb") as f:
+                self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self.map
+
+    def frame(self, kind, n, d, payload):
+        data = self.codec.encode(payload) if payload is not None else b""
+        return _HEADER.pack(len(data), zlib.crc32(data), kind, n, _raw(d)) + data
+
+    def write(self, frames):
+        self.open()
+        data = b"".join(frames)
+        self.file.write(data)
+        self.file.flush()
+        self.sync_file(self.file.fileno())
+        self.size += len(data)
+        self.stat["bytes"] += len(data)
+        self.stat["fsyncs"] += 1
+
+    def read(self, offset, size):
+        m = self.mapped()
+        start = offset + _HEADER.size
+        view = memoryview(m)[start:start + size]
+        try:
+            return self.codec.decode(view)
+        finally:
+            view.release()
+
+    # The interface of pybft.merkle.versions.
+
+    def snap_field(self, snap):
+        # The snapshot to write, or _SAME if it did not change.
+        h = sha256(canon(snap)).digest()
+        if h == self.last_snap:
+            return _SAME
+        self.last_snap = h
+        return snap
+
+    def reset(self, n, d, snap, table):
+        # Hold checkpoint n alone, as the stable one. A checkpoint we hold
+        # already, as after a restart, keeps the records leading to it.
+        held = self.index.get(n)
+        if held is not None and held[1] == d and self.stable_n is not None:
+            self.truncate(n)
+        else:
+            self.rewrite(n, d, snap, table, [])
+        self.stat["resets"] += 1
+
+    def append(self, n, d, snap, delta):
+        payload = (self.snap_field(snap), tuple((c, t, r) for c, (t, r) in delta.items()))
+        frame = self.frame(_DELTA, n, d, payload)
+        self.index[n] = (_DELTA, d, self.size, len(frame) - _HEADER.size)
+        self.write([frame])
+        self.stat["deltas"] += 1
+
+    def has(self, n):
+        return n in self.index and n >= self.stable_n
+
+    def digest(self, n):
+        if not self.has(n):
+            raise KeyError(n)
+        return self.index[n][1]
+
+    def stable(self, n):
+        # Checkpoint n is stable: mark it, and compact once the log grew
+        # enough past the last base.
+        if n <= self.stable_n or n not in self.index:
+            return
+        self.stable_n = n
+        self.write([self.frame(_STABLE, n, self.index[n][1], None)])
+        if self.size > self.slack * max(self.base_size, 1 << 16):
+            snap, table = self.state(n)
+            later = [(k, v) for k, v in self.index.items() if k > n]
+            self.rewrite(n, self.index[n][1], snap, table, later)
+
+    def state(self, n):
+        # (snapshot, {client: (t, result)}) of checkpoint n, folding the
+        # records up to it.
+        start = perf_counter()
+        snap, table = None, {}
+        for k, (kind, d, offset, size) in self.index.items():
+            if k > n:
+                break
+            (s, entries) = self.read(offset, size)
+            if kind == _BASE:
+                table = {}
+            if s != _SAME:
+                snap = s
+            for (c, t, r) in entries:
+                table[c] = (t, r)
+        self.stat["reads"] += 1
+        self.stat["read_time"] += perf_counter() - start
+        return (snap, table)
+
+    # Compaction and recovery.
+
+    def rewrite(self, n, d, snap, table, later):
+        # A new log with checkpoint n as its base, followed by the records
+        # of the later checkpoints, copied as they are.
+        start = perf_counter()
+        base = self.frame(_BASE, n, d, (snap, tuple((c, t, r) for c, (t, r) in table.items())))
+        frames = [base, self.frame(_STABLE, n, d, None)]
+        index = OrderedDict([(n, (_BASE, d, 0, len(base) - _HEADER.size))])
+        offset = len(base) + len(frames[1])
+        for k, (kind, kd, koff, ksize) in later:
+            raw = bytes(self.mapped()[koff:koff + _HEADER.size + ksize])
+            frames.append(raw)
+            index[k] = (kind, kd, offset, ksize)
+            offset += len(raw)
+
+        self.close()
+        tmp = self.path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(b"".join(frames))
+            f.flush()
+            self.sync_file(f.fileno())
+        os.replace(tmp, self.path)
+        sync_dir(self.path, self.sync_file)
+
+        self.index = index
+        self.stable_n = n
+        self.size = offset
+        self.base_size = len(base)
+        self.last_snap = None if later else sha256(canon(snap)).digest()
+        self.stat["compactions"] += 1
+        self.stat["compaction_time"] += perf_counter() - start
+
+    def truncate(self, n):
+        # Drop the records after checkpoint n, which becomes stable.
+        (kind, d, offset, size) = self.index[n]
+        end = offset + _HEADER.size + size
+        for k in [k for k in self.index if k > n]:
+            del self.index[k]
+        self.close()
+        with open(self.path, "r+b") as f:
+            f.truncate(end)
+        self.size = end
+        self.last_snap = None
+        self.stable_n = n
+        self.write([self.frame(_STABLE, n, d, None)])
+
+    def load(self):
+        # Build the index from the record headers, up to the first torn or
+        # corrupt record, and return the stable checkpoint (n, d).
+        self.close()
+        self.index = OrderedDict()
+        self.stable_n = None
+        if not os.path.exists(self.path) or os.path.getsize(self.path) == 0:
+            self.size = 0
+            return None
+        self.size = os.path.getsize(self.path)
+        m = self.mapped()
+        pos, stable = 0, None
+        while pos + _HEADER.size <= len(m):
+            size, crc, kind, n, raw = _HEADER.unpack_from(m, pos)
+            end = pos + _HEADER.size + size
+            if end > len(m) or zlib.crc32(m[pos + _HEADER.size:end]) != crc:
+                break
+            if kind == _BASE:
+                self.index = OrderedDict()
+                self.base_size = end - pos
+            if kind == _STABLE:
+                stable = (n, raw.hex())
+            else:
+                self.index[n] = (kind, raw.hex(), pos, size)
+            pos = end
+        self.size = pos
+        self.unmap()
+        if pos < os.path.getsize(self.path):
+            with open(self.path, "r+b") as f:
+                f.truncate(pos)
+        if stable is None or stable[0] not in self.index:
+            return None
+        self.stable_n = stable[0]
+        return stable
+
+    def attach(self, rep):
+        # Keep the checkpoints of the replica on disk from now on,
+        # starting from its stable one.
+        chk, old = rep.chkpts, rep.chkpts.held
+        n = rep.stable_n()
+        snap, table = old.state(n)
+        self.index = OrderedDict()
+        self.stable_n = None
+        self.rewrite(n, chk.digest(n), snap, table, [])
+        if not old.durable:
+            for k, (d, ksnap, delta) in old.later.items():
+                if k > n:
+                    self.append(k, d, ksnap, delta)
+        chk.held = self
+
+    def recover(self, rep):
+        # Install the stable checkpoint of the log in a fresh replica, if
+        # any, and attach to it. Returns the seqno installed, or None. A
+        # write-ahead log recovers after it (see pybft.wal).
+        stable = self.load()
+        if stable is None:
+            self.attach(rep)
+            return None
+        (n, d) = stable
+        rep.chkpts.held = self
+        if rep.from_checkpoint(n, self.state_entries(n)) != d:
+            raise ValueError("Checkpoint %d does not match its digest" % n)
+        rep.checkpts_i = set([(n, d)])
+        rep.last_exec_i = max(rep.last_exec_i, n)
+        self.stat["recovered"] += 1
+        return n
+
+    def state_entries(self, n):
+        snap, table = self.state(n)
+        return (snap, tuple((c, t, r) for c, (t, r) in table.items()))
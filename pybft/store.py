@@ -0,0 +1,118 @@
+# A content-addressed store of request bodies. Each request referenced by
+# the message log, on its own or inside a PREPREPARE, a VIEWCHANGE or a
+# NEWVIEW, is held once, keyed by its digest. Incoming messages are
+# interned before they are handled: the copies of a request they carry
+# are replaced by the stored body, so the log holds references to one
+# body per digest and its digest is found in the cache by identity.
+#
+# The store watches the message log and counts the log messages that
+# reference each request, so a body is dropped with its last reference.
+
+from collections import Counter
+from sys import getsizeof
+
+
+def footprint(msgs):
+    # Bytes held by messages, counting objects they share only once.
+    seen = set()
+    total = 0
+    stack = list(msgs)
+    while stack:
+        x = stack.pop()
+        if id(x) in seen:
+            continue
+        seen.add(id(x))
+        total += getsizeof(x)
+        if isinstance(x, (tuple, frozenset)):
+            stack.extend(x)
+    return total
+
+
+class store(object):
+
+    def __init__(self, rep):
+        self.rep = rep
+
+        # Digest -> request body, and the number of log messages using it.
+        self.bodies = {}
+        self.refs = Counter()
+
+        self.stat = Counter()
+
+    def __len__(self):
+        return len(self.bodies)
+
+    def get(self, d):
+        return self.bodies.get(d)
+
+    def request(self, req):
+        # The stored body of a request, or the request if it is new.
+        body = self.bodies.get(self.rep.hash(req))
+        if body is None:
+            return req
+        if body is not req:
+            self.stat["shared"] += 1
+        return body
+
+    def payload(self, m):
+        rep = self.rep
+        if m is None:
+            return m
+        if m[0] == rep._BATCH:
+            return (m[0], tuple(self.request(req) for req in m[1]))
+        return self.request(m)
+
+    def message(self, msg):
+        # The message with its requests replaced by the stored bodies.
+        rep = self.rep
+        xtype = msg[0]
+        if xtype == rep._REQUEST and len(msg) == 4:
+            return self.request(msg)
+        if xtype == rep._PREPREPARE and len(msg) == 5:
+            (_, v, n, m, j) = msg
+            return (xtype, v, n, self.payload(m), j)
+        if xtype == rep._VIEWCHANGE and len(msg) == 7:
+            (_, v, n, s, C, P, j) = msg
+            return (xtype, v, n, s, C, frozenset(self.message(x) for x in P), j)
+        if xtype == rep._NEWVIEW and len(msg) == 6:
+            (_, v, X, O, N, j) = msg
+            return (xtype, v, frozenset(self.message(x) for x in X), \
+                    frozenset(self.message(x) for x in O), N, j)
+        return msg
+
+    def referenced(self, msg):
+        # The requests a log message references.
+        rep = self.rep
+        xtype = msg[0]
+        if xtype == rep._REQUEST:
+            return [msg]
+        if xtype == rep._PREPREPARE:
+            return list(rep.requests_of(msg[3]))
+        if xtype == rep._VIEWCHANGE:
+            return [req for x in msg[5] if x[0] == rep._PREPREPARE \
+                    for req in rep.requests_of(x[3])]
+        if xtype == rep._NEWVIEW:
+            return [req for x in msg[3] for req in rep.requests_of(x[3])] + \
+                   [req for x in msg[2] for req in self.referenced(x)]
+        return []
+
+    # Watcher interface of the message log.
+
+    def added(self, msg, d):
+        for req in self.referenced(msg):
+            h = self.rep.hash(req)
+            if h not in self.bodies:
+                self.bodies[h] = req
+                self.stat["stored"] += 1
+            self.refs[h] += 1
+
+    def discarded(self, msg, d):
+        for req in self.referenced(msg):
+            h = self.rep.hash(req)
+            if h not in self.refs:
+                continue
+            self.refs[h] -= 1
+            if self.refs[h] == 0:
+                del self.refs[h]
+                del self.bodies[h]
+                self.stat["released"] += 1
@@ -0,0 +1,129 @@
+# Request lifecycle tracing. A replica with a tracer timestamps the
+# transitions of every slot (v, n, d): PREPREPARE sent or accepted,
+# prepared (its COMMIT sent), committed (found committed when its turn to
+# execute comes) and executed. When a slot is executed the time spent in
+# each phase goes to a per-phase latency histogram:
+#
+#   prepare  preprepare -> prepared
+#   commit   prepared   -> committed
+#   execute  committed  -> executed
+#   total    preprepare -> executed
+#
+# Histograms have fixed, power of two buckets, so those of different
+# replicas, or of different runs, can be merged by adding counts.
+
+from collections import OrderedDict
+from time import perf_counter
+
+
+PHASES = ["prepare", "commit", "execute", "total"]
+
+# Upper bounds of the buckets, in seconds: 1us to about 36 minutes.
+BOUNDS = tuple(1e-6 * 2 ** k for k in range(32))
+
+
+class histogram(object):
+
+    def __init__(self):
+        self.counts = [0] * (len(BOUNDS) + 1)
+        self.total = 0
+        self.sum = 0.0
+
+    def add(self, x):
+        k = 0
+        while k < len(BOUNDS) and x > BOUNDS[k]:
+            k += 1
+        self.counts[k] += 1
+        self.total += 1
+        self.sum += x
+
+    def merge(self, other):
+        for k, c in enumerate(other.counts):
+            self.counts[k] += c
+        self.total += other.total
+        self.sum += other.sum
+        return self
+
+    def percentile(self, p):
+        # The upper bound of the bucket holding the p-th percentile.
+        if self.total == 0:
+            return None
+        rank = p / 100.0 * self.total
+        seen = 0
+        for k, c in enumerate(self.counts):
+            seen += c
+            if c and seen >= rank:
+                return BOUNDS[k] if k < len(BOUNDS) else float("inf")
+        return float("inf")
+
+    def mean(self):
+        return self.sum / self.total if self.total else None
+
+    def dump(self):
+        return {"count": self.total, "sum": self.sum, \
+                "buckets": [[BOUNDS[k] if k < len(BOUNDS) else None, c] \
+                            for k, c in enumerate(self.counts) if c]}
+
+    @staticmethod
+    def load(data):
+        h = histogram()
+        for bound, c in data["buckets"]:
+            k = BOUNDS.index(bound) if bound is not None else len(BOUNDS)
+            h.counts[k] += c
+        h.total = data["count"]
+        h.sum = data["sum"]
+        return h
+
+
+class tracer(object):
+
+    def __init__(self, clock=perf_counter, max_open=10000):
+        self.clock = clock
+        self.histograms = dict((phase, histogram()) for phase in PHASES)
+
+        # (v, n, d) -> {transition: time}, for slots not yet executed;
+        # the oldest are forgotten beyond max_open (aborted views).
+        self.open = OrderedDict()
+        self.max_open = max_open
+
+    def mark(self, v, n, d, transition):
+        key = (v, n, d)
+        times = self.open.get(key)
+        if times is None:
+            times = {}
+            self.open[key] = times
+            if len(self.open) > self.max_open:
+                self.open.popitem(last=False)
+        if transition not in times:
+            times[transition] = self.clock()
+
+        if transition == "executed":
+            del self.open[key]
+            self.record(times)
+
+    def record(self, times):
+        for phase, start, end in (("prepare", "preprepare", "prepared"), \
+                                  ("commit", "prepared", "committed"), \
+                                  ("execute", "committed", "executed"), \
+                                  ("total", "preprepare", "executed")):
+            if start in times and end in times:
+                self.histograms[phase].add(times[end] - times[start])
+
+    def merge(self, other):
+        for phase in PHASES:
+            self.histograms[phase].merge(other.histograms[phase])
+        return self
+
+    def dump(self):
+        return dict((phase, self.histograms[phase].dump()) for phase in PHASES)
+
+    def text(self):
+        lines = ["%-8s %8s %10s %10s %10s %10s" % ("phase", "count", "mean (us)", \
+                 "p50 (us)", "p90 (us)", "p99 (us)")]
+        for phase in PHASES:
+            h = self.histograms[phase]
+            if h.total:
+                lines += ["%-8s %8d %10.1f %10.1f %10.1f %10.1f" % (phase, h.total, \
+                          1e6 * h.mean(), 1e6 * h.percentile(50), \
+                          1e6 * h.percentile(90), 1e6 * h.percentile(99))]
+        return "\n".join(lines)
@@ -0,0 +1,352 @@
+# State transfer. A replica that fell behind a checkpoint its peers
+# certified, and whose slots they collected, fetches the state of that
+# checkpoint instead of the log leading to it, so catching up costs the
+# size of the state and not the number of slots missed.
+#
+# The reply table is split along the Merkle tree of the checkpoint (see
+# pybft.merkle): chunk k at level L holds the entries of the buckets under
+# node k of that level, and the level is picked by the serving peer so
+# that chunks hold about `chunk_size` entries. A replica first asks one of
+# the replicas that certified the checkpoint for its manifest, the service
+# snapshot and the 2^L node digests of level L, and checks it against the
+# digest of the checkpoint. It then asks for the chunks it misses from all
+# of those replicas in parallel, `window` at a time, checks each against
+# its node digest, and installs the checkpoint once it holds them all.
+#
+#   (_GETSTATE, n, d, ks, i)     asks for chunks ks, or the manifest if ()
+#   (_STATE, n, d, k, data, j)   chunk k, the manifest if k is -1, or that
+#                                j does not hold the checkpoint if k is -2
+#
+# Requests left unanswered are repeated to another replica after
+# `interval`, and replicas that no longer hold the checkpoint are not
+# asked again; once none is left, the replica moves to a newer one.
+# Verified chunks are kept when the replica moves to a newer checkpoint,
+# and reused wherever the new manifest has the same node digest, so an
+# interrupted transfer resumes where it stopped.
+
+from collections import Counter
+
+from pybft.merkle import merkle, fold, checkpoint_digest
+
+
+# The parts of a _STATE besides chunks.
+_MANIFEST = -1
+_GONE = -2
+
+
+class transfer(object):
+
+    def __init__(self, rep, chunk_size=256, window=4, interval=0.05, \
+                 patience=0.1, history=16):
+        self.rep = rep
+        self.chunk_size = chunk_size
+        self.window = window
+        self.interval = interval
+        self.history = history
+
+        # How long certified checkpoints must stay ahead of us before we
+        # fetch one, and since when they are.
+        self.patience = patience
+        self.behind = None
+
+        # CHECKPOINTs beyond our window, as (n, d) -> {sender: msg}.
+        self.votes = {}
+
+        # The checkpoint we fetch, its certifiers, its manifest, and the
+        # chunks held and asked for (k -> (peer, when)), and when a part
+        # of it last arrived.
+        self.target = None
+        self.peers = ()
+        self.manifest = None
+        self.asked_manifest = None
+        self.chunks = {}
+        self.asked = {}
+        self.turn = 0
+        self.progress = None
+
+        # Verified chunks of earlier targets: (level, k, digest) -> entries.
+        self.kept = {}
+
+        # The state of the checkpoint we last served, and its chunks.
+        self.served = None
+
+        self.stat = Counter()
+
+    # Learning that we are behind.
+
+    def heard(self, msg):
+        # A CHECKPOINT too far ahead for the log.
+        (_, v, n, d, j) = msg
+        rep = self.rep
+        if j == rep.i or not isinstance(j, int) or not 0 <= j < rep.R:
+            return
+        self.votes.setdefault((n, d), {})[j] = msg
+        if len(self.votes) > self.history:
+            del self.votes[min(self.votes)]
+
+    def certified(self):
+        # (n, d) -> the replicas that certified it, above our last execution.
+        rep = self.rep
+        out = {}
+        for (n, d) in rep.gc.quorums:
+            if n > rep.last_exec_i:
+                out[(n, d)] = rep.gc.votes[(n, d)]
+        for (n, d), senders in self.votes.items():
+            if n > rep.last_exec_i and len(senders) > rep.f:
+                out[(n, d)] = set(senders)
+        return out
+
+    def want(self, n, d, peers):
+        # Fetch checkpoint (n, d) now, from the given replicas.
+        rep = self.rep
+        if n <= rep.last_exec_i or \
+           (self.target is not None and self.target[0] >= n):
+            return
+        self.start(n, d, peers)
+
+    def tick(self):
+        rep = self.rep
+        if self.target is not None and rep.last_exec_i >= self.target[0]:
+            # We executed up to it meanwhile.
+            self.stop()
+            self.stat["overtaken"] += 1
+
+        # Fetch the newest checkpoint once we stayed behind long enough,
+        # and move to a newer one if the current transfer stalls, as its
+        # certifiers may have collected it meanwhile.
+        now = rep.clock()
+        ahead = self.certified()
+        if not ahead:
+            self.behind = None
+        else:
+            if self.behind is None:
+                self.behind = now
+            (n, d) = max(ahead)
+            if self.target is None:
+                if now - self.behind >= self.patience:
+                    self.start(n, d, ahead[(n, d)])
+            elif n > self.target[0] and now - self.progress >= self.interval:
+                self.stat["stalled"] += 1
+                self.start(n, d, ahead[(n, d)])
+        self.pump()
+
+    # Fetching.
+
+    def start(self, n, d, peers):
+        self.stop()
+        rep = self.rep
+        self.target = (n, d)
+        self.peers = tuple(sorted(j for j in peers if j != rep.i))
+        self.progress = rep.clock()
+        self.stat["started"] += 1
+        self.pump()
+
+    def stop(self):
+        # Keep the verified chunks for a later target.
+        if self.manifest is not None:
+            level, nodes = self.manifest[1], self.manifest[2]
+            for k, entries in self.chunks.items():
+                self.kept[(level, k, nodes[k])] = entries
+        self.target = None
+        self.manifest = None
+        self.asked_manifest = None
+        self.chunks = {}
+        self.asked = {}
+
+    def gone(self, j):
+        # Peer j no longer holds the checkpoint: ask the others instead.
+        self.peers = tuple(x for x in self.peers if x != j)
+        for k in [k for k, (x, _) in self.asked.items() if x == j]:
+            del self.asked[k]
+        if self.manifest is None:
+            self.asked_manifest = None
+        if not self.peers:
+            self.stop()
+            self.stat["abandoned"] += 1
+
+    def next_peer(self):
+        self.turn += 1
+        return self.peers[self.turn % len(self.peers)]
+
+    def pump(self):
+        # Ask for the manifest, or for the chunks not held nor asked for
+        # lately, spread over the certifiers.
+        rep = self.rep
+        if self.target is None or not self.peers:
+            return
+        (n, d) = self.target
+        now = rep.clock()
+
+        if self.manifest is None:
+            if self.asked_manifest is None or \
+               now - self.asked_manifest >= self.interval:
+                self.asked_manifest = now
+                rep.resend((rep._GETSTATE, n, d, (), rep.i), [self.next_peer()])
+                self.stat["asks"] += 1
+            return
+
+        todo = [k for k in range(len(self.manifest[2])) if k not in self.chunks]
+        todo = [k for k in todo if k not in self.asked or \
+                now - self.asked[k][1] >= self.interval]
+        busy = Counter(j for (j, t) in self.asked.values() \
+                       if now - t < self.interval)
+        batches = {}
+        for k in todo:
+            for _ in range(len(self.peers)):
+                j = self.next_peer()
+                if busy[j] < self.window:
+                    break
+            else:
+                break
+            busy[j] += 1
+            batches.setdefault(j, []).append(k)
+            self.asked[k] = (j, now)
+        for j, ks in batches.items():
+            rep.resend((rep._GETSTATE, n, d, tuple(ks), rep.i), [j])
+            self.stat["asks"] += 1
+
+    def arrived(self, msg):
+        (_, n, d, k, data, j) = msg
+        if self.target != (n, d) or j not in self.peers:
+            return
+        if k == _GONE:
+            self.gone(j)
+            self.pump()
+            return
+        try:
+            if k == _MANIFEST and self.manifest is None:
+                self.take_manifest(data)
+            elif self.manifest is not None and \
+                 0 <= k < len(self.manifest[2]) and k not in self.chunks:
+                self.take_chunk(k, data)
+        except (TypeError, ValueError):
+            self.stat["rejected"] += 1
+            return
+        self.progress = self.rep.clock()
+
+        m = self.manifest
+        if m is not None and len(self.chunks) == len(m[2]):
+            self.install()
+        else:
+            self.pump()
+
+    def take_manifest(self, data):
+        (snap, level, nodes) = data
+        depth = self.rep.chkpts.depth
+        if not 0 <= level <= depth or len(nodes) != 1 << level or \
+           checkpoint_digest(snap, fold(list(nodes))) != self.target[1]:
+            raise ValueError("Manifest does not match the checkpoint")
+        self.manifest = (snap, level, tuple(nodes))
+        self.stat["manifests"] += 1
+
+        # Empty chunks, and chunks we verified for an earlier target.
+        empty = merkle(depth).empty[level]
+        for k, node in enumerate(nodes):
+            entries = self.kept.get((level, k, node))
+            if entries is not None:
+                self.chunks[k] = entries
+                self.stat["reused"] += 1
+            elif node == empty:
+                self.chunks[k] = ()
+        self.kept = {}
+
+    def take_chunk(self, k, entries):
+        (_, level, nodes) = self.manifest
+        depth = self.rep.chkpts.depth
+        tree = merkle(depth)
+        for (c, t, r) in entries:
+            if tree.bucket(c) >> (depth - level) != k:
+                raise ValueError("Entry outside of its chunk")
+            tree.update(c, (t, r))
+        tree.root()
+        if tree.node(level, k) != nodes[k]:
+            raise ValueError("Chunk does not match the manifest")
+        self.chunks[k] = tuple(entries)
+        self.asked.pop(k, None)
+        self.stat["chunks"] += 1
+
+    def install(self):
+        # All chunks are in: install the checkpoint as our stable one, and
+        # resume from the slots after it.
+        rep = self.rep
+        (n, d) = self.target
+        snap = self.manifest[0]
+        entries = tuple(e for k in range(len(self.manifest[2])) \
+                        for e in self.chunks[k])
+        votes = list(self.votes.get((n, d), {}).values())
+        self.stop()
+        self.kept = {}
+
+        if rep.last_exec_i >= n:
+            return
+
+        # The manifest and the chunks were checked against d.
+        rep.from_checkpoint(n, (snap, entries))
+        self.stat["installed"] += 1
+
+        rep.last_exec_i = n
+        rep.checkpts_i = set([(n, d)])
+        own = (rep._CHECKPOINT, rep.view_i, n, d, rep.i)
+        rep.in_i.add(own)
+        rep.out_i.add(own)
+        rep.in_i |= votes
+        if rep.primary() == rep.i:
+            rep.seqno_i = max(rep.seqno_i, n)
+
+        # The requests of the clients executed in the state are done.
+        for c in list(rep.gc.by_client):
+            rep.gc.touch_client(c)
+        rep.gc.touch_checkpoints()
+        rep.certs.touched.update(xn for xn in rep.in_i.seqnos() if xn > n)
+        rep.make_progress()
+        rep.garbage_collect()
+
+    # Serving.
+
+    def level_for(self, count, depth):
+        level = 0
+        while level < depth and (count >> level) > self.chunk_size:
+            level += 1
+        return level
+
+    def state_of(self, n, d):
+        # The manifest and chunks of checkpoint (n, d), if we hold it.
+        rep = self.rep
+        if self.served is not None and self.served[0] == (n, d):
+            return self.served[1]
+        chk = rep.chkpts
+        if not chk.has(n) or chk.digest(n) != d:
+            return None
+        snap, entries = chk.state(n)
+        depth = chk.depth
+        level = self.level_for(len(entries), depth)
+        tree = merkle(depth)
+        chunks = [[] for _ in range(1 << level)]
+        for (c, t, r) in entries:
+            tree.update(c, (t, r))
+            chunks[tree.bucket(c) >> (depth - level)].append((c, t, r))
+        tree.root()
+        nodes = tuple(tree.node(level, k) for k in range(1 << level))
+        state = ((snap, level, nodes), [tuple(ch) for ch in chunks])
+        self.served = ((n, d), state)
+        return state
+
+    def answer(self, msg):
+        rep = self.rep
+        (_, n, d, ks, j) = msg
+        if j == rep.i or not isinstance(j, int) or not 0 <= j < rep.R:
+            return
+        state = self.state_of(n, d)
+        if state is None:
+            rep.resend((rep._STATE, n, d, _GONE, None, rep.i), [j])
+            self.stat["unknown"] += 1
+            return
+        manifest, chunks = state
+        if not ks:
+            rep.resend((rep._STATE, n, d, _MANIFEST, manifest, rep.i), [j])
+            self.stat["served"] += 1
+            return
+        for k in ks[:self.window]:
+            if isinstance(k, int) and 0 <= k < len(chunks):
+                rep.resend((rep._STATE, n, d, k, chunks[k], rep.i), [j])
+                self.stat["served"] += 1
@@ -0,0 +1,214 @@
+# A write-ahead log for a replica. The log watches the message log of the
+# replica and appends every message it accepts, including its own
+# PREPREPAREs, PREPAREs, COMMITs, CHECKPOINTs, VIEWCHANGEs and NEWVIEWs,
+# before they are sent. Records are buffered and written with a single
+# fsync per group: when the outbox drains, since messages must be on disk
+# before they leave, or when `group` records are waiting.
+#
+# A record is a length, a CRC32 and a message encoded with the wire codec
+# (see pybft.codec); a torn or corrupt tail is ignored on recovery. When
+# the low watermark advances, the log is rewritten to start with the
+# state of the stable checkpoint, or only its digest when the checkpoints
+# are on disk (see pybft.snapstore), followed by the messages still in the
+# message log, so its size stays bounded by the window. The new log is
+# synced, renamed over the old one and its directory synced, so that the
+# rename survives a crash. Compaction thus costs O(window) records, and
+# two fsyncs, per stable checkpoint: with the default checkpoint interval
+# of 10 and window of 30, up to three times the records appended meanwhile.
+#
+# Recovery restores the stable checkpoint, replays the messages, derives
+# the view and the last sequence number from them, and executes again the
+# committed slots, so the replica resumes where it crashed.
+
+import os
+import zlib
+from collections import Counter
+from struct import Struct
+from time import perf_counter
+
+from pybft.codec import wirecodec
+
+
+_HEADER = Struct(">II")
+
+# Record tags: the stable checkpoint (n, digest, state), its state being
+# None if the checkpoints are on disk, and a message.
+_STABLE = "S"
+_MSG = "M"
+
+
+def read_records(path):
+    # The records of a log file, up to the first torn or corrupt one.
+    if not os.path.exists(path):
+        return []
+    codec = wirecodec()
+    with open(path, "rb") as f:
+        data = f.read()
+    records, pos = [], 0
+    while pos + _HEADER.size <= len(data):
+        size, crc = _HEADER.unpack_from(data, pos)
+        start = pos + _HEADER.size
+        payload = data[start:start + size]
+        if len(payload) < size or zlib.crc32(payload) != crc:
+            break
+        try:
+            records.append(codec.decode(payload))
+        except ValueError:
+            break
+        pos = start + size
+    return records
+
+
+def sync_dir(path, sync=os.fsync):
+    # Make the renames into the directory of path durable.
+    fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        sync(fd)
+    finally:
+        os.close(fd)
+
+
+class wal(object):
+
+    def __init__(self, path, group=64, sync=os.fsync):
+        self.path = path
+        self.group = group
+        self.sync_file = sync
+        self.codec = wirecodec()
+        self.rep = None
+
+        self.buffer = []
+        self.file = None
+        self.stat = Counter()
+
+    def open(self):
+        if self.file is None:
+            self.file = open(self.path, "ab")
+
+    def close(self):
+        self.sync()
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def frame(self, record):
+        payload = self.codec.encode(record)
+        return _HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+    def append(self, record):
+        self.buffer.append(self.frame(record))
+        self.stat["records"] += 1
+        if len(self.buffer) >= self.group:
+            self.sync()
+
+    def sync(self):
+        # Write the waiting records and make them durable, in one fsync.
+        if not self.buffer:
+            return
+        start = perf_counter()
+        self.open()
+        data = b"".join(self.buffer)
+        self.buffer = []
+        self.file.write(data)
+        self.file.flush()
+        self.sync_file(self.file.fileno())
+        self.stat["bytes"] += len(data)
+        self.stat["fsyncs"] += 1
+        self.stat["time"] += perf_counter() - start
+
+    def compact(self):
+        # Rewrite the log from the stable checkpoint and the message log,
+        # and replace the old one atomically.
+        rep = self.rep
+        start = perf_counter()
+        self.buffer = []
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+        tmp = self.path + ".tmp"
+        with open(tmp, "wb") as f:
+            # The state goes along, unless the checkpoints are on disk.
+            n = rep.stable_n()
+            state = None if rep.chkpts.held.durable else rep.checkpoint_state(n)
+            f.write(self.frame((_STABLE, n, rep.stable_chkpt(), state)))
+            for msg in rep.in_i:
+                f.write(self.frame((_MSG, msg)))
+            f.flush()
+            self.sync_file(f.fileno())
+        os.replace(tmp, self.path)
+        sync_dir(self.path, self.sync_file)
+        self.stat["compactions"] += 1
+        self.stat["time"] += perf_counter() - start
+
+    def attach(self, rep):
+        # Log the replica from now on, starting from its current state.
+        self.rep = rep
+        rep.wal = self
+        rep.in_i.watchers.append(self)
+        self.compact()
+
+    def recover(self, rep):
+        # Rebuild a fresh replica from the log, if any, and attach to it.
+        records = read_records(self.path)
+        if records:
+            self.replay(rep, records)
+        self.attach(rep)
+        return len(records)
+
+    def replay(self, rep, records):
+        stable = [r for r in records if r[0] == _STABLE]
+        if stable:
+            (_, n, d, state) = stable[-1]
+            if state is None:
+                # The checkpoint store was recovered first, and is at
+                # least as recent (see pybft.snapstore).
+                if n > rep.stable_n() or (n == rep.stable_n() and d != rep.stable_chkpt()):
+                    raise ValueError("Checkpoint %d is not in the checkpoint store" % n)
+                n, d = rep.stable_n(), rep.stable_chkpt()
+            elif rep.from_checkpoint(n, state) != d:
+                raise ValueError("Checkpoint %d does not match its digest" % n)
+            if n > 0:
+                rep.in_i -= [msg for xn in rep.in_i.seqnos() if xn < n \
+                             for msg in rep.in_i.at_seqno(xn)]
+                rep.in_i.low = n
+                rep.gc.low = n
+            rep.checkpts_i = set([(n, d)])
+            rep.last_exec_i = n
+
+        for r in records:
+            if r[0] == _MSG:
+                rep.in_i.add(r[1])
+
+        # The view is the highest we moved to, and the sequence number the
+        # highest we assigned.
+        for msg in rep.in_i.of_type(rep._VIEWCHANGE):
+            if msg[-1] == rep.i:
+                rep.view_i = max(rep.view_i, msg[1])
+        for msg in rep.in_i.of_type(rep._NEWVIEW):
+            rep.view_i = max(rep.view_i, msg[1])
+            if msg[-1] == rep.i:
+                rep.seqno_i = max([rep.seqno_i] + [pp[2] for pp in msg[3] | msg[4]])
+        for msg in rep.in_i.of_type(rep._PREPREPARE):
+            if msg[-1] == rep.i:
+                rep.seqno_i = max(rep.seqno_i, msg[2])
+        if rep.primary() == rep.i:
+            rep.seqno_i = max(rep.seqno_i, rep.last_exec_i)
+
+            # The requests not proposed yet wait for a batch again.
+            for req in rep.in_i.of_type(rep._REQUEST):
+                if rep.is_pending(req):
+                    rep.pending_i[req] = rep.clock()
+
+        rep.certs.touched.update(rep.in_i.seqnos())
+        rep.make_progress()
+        rep.garbage_collect()
+        self.stat["replayed"] += len(records)
+
+    # Watcher interface of the message log.
+
+    def added(self, msg, d):
+        self.append((_MSG, msg))
+
+    def discarded(self, msg, d):
+        pass
@@ -0,0 +1,21 @@
+# Helpers shared by the tests
+
+import sys
+sys.path += ["."]
+
+from pybft.replica import replica
+
+
+def requests(N, start=0, clients=None, size=None):
+    # Requests start..N-1, each from its own client at timestamp 10, or
+    # from `clients` clients in turn with increasing timestamps. Payloads
+    # are b"message<x>", or `size` bytes.
+    reqs = []
+    for x in range(start, N):
+        o = (b"%08d" % x) * (size // 8) if size else b"message%d" % x
+        if clients is None:
+            t, c = 10, b"%d" % x
+        else:
+            t, c = x // clients + 1, b"%d" % (x % clients)
+        reqs.append((replica._REQUEST, o, t, c))
+    return reqs
@@ -0,0 +1,84 @@
+# Tests
+
+import sys
+sys.path += ["."]
+
+from pybft.replica import replica
+from pybft.sim import simulator
+
+
+def test_admission_per_client_and_total():
+    r = replica(0, 4)
+    r.batch_size = 100
+    r.batch_timeout = 1.0
+    r.clock = lambda: 0.0
+    r.admission.per_client = 2
+    r.admission.total = 3
+
+    reqs = [(r._REQUEST, b"op%d" % t, t, b"A") for t in range(1, 4)]
+    for req in reqs:
+        r.route_receive(req)
+    assert reqs[0] in r.in_i and reqs[1] in r.in_i and reqs[2] not in r.in_i
+    assert (r._BUSY, 0, 3, b"A", 0) in r.out_i
+
+    # Retries of logged requests are always admitted.
+    r.route_receive(reqs[0])
+    assert r.admission.stat["client_busy"] == 1
+
+    r.route_receive((r._REQUEST, b"op", 1, b"B"))
+    r.route_receive((r._REQUEST, b"op", 1, b"C"))
+    assert (r._REQUEST, b"op", 1, b"C") not in r.in_i
+    assert r.admission.stat["busy"] == 1
+
+    bundles = dict(r.out_i.drain())
+    assert [m[0] for m in bundles[b"A"]] == [r._BUSY]
+    assert [m[0] for m in bundles[b"C"]] == [r._BUSY]
+
+
+def test_pending_round_robin():
+    r = replica(0, 4)
+    r.batch_size = 100
+    r.batch_timeout = 1.0
+    r.clock = lambda: 0.0
+
+    # A backlog where client A came first and sent most requests.
+    A = [(r._REQUEST, b"op%d" % t, t, b"A") for t in range(1, 9)]
+    B = [(r._REQUEST, b"op%d" % t, t, b"B") for t in range(1, 3)]
+    for req in A[:3] + B + A[3:]:
+        r.route_receive(req)
+    assert len(r.pending_i) == 10
+
+    r.batch_size = 4
+    assert r.send_batches()
+    preps = sorted((m for m in r.out_i if m[0] == r._PREPREPARE), key=lambda m: m[2])
+    assert preps[0][3] == (r._BATCH, (A[0], B[0], A[1], B[1]))
+    assert preps[1][3] == (r._BATCH, tuple(A[2:6]))
+    assert list(r.pending_i) == A[6:]
+    assert r.send_batches(force=True) and len(r.pending_i) == 0
+
+
+def test_sim_overload_degrades_gracefully():
+    sim = simulator(f=1, seed=2, retry=0.005)
+    for r in sim.replicas:
+        r.admission.total = 5
+    reqs = [(replica._REQUEST, b"message%d" % x, 10, b"%d" % x) for x in range(60)]
+    rep = sim.run(reqs, in_flight=30)
+
+    assert rep["requests"] == 60 and rep["busy"] > 0
+    assert all(len(r.in_i.of_type(r._REQUEST)) <= 5 for r in sim.replicas)
+
+
+def test_rejected_preprepares_are_admitted():
+    r = replica(1, 4)
+    r.admission.per_client = 2
+    r.admission.total = 5
+
+    # PREPREPAREs from a replica that is not the primary do not fill
+    # the log past the bounds.
+    for n in range(1, 5):
+        reqs = tuple((r._REQUEST, b"op", 10 * n + k, b"%d" % k) for k in range(4))
+        r.route_receive((r._PREPREPARE, 0, n, (r._BATCH, reqs), 2))
+    logged = list(r.filter_type(r._REQUEST))
+    assert len(logged) == 5
+    assert all(sum(1 for req in logged if req[3] == c) <= 2 for c in set(req[3] for req in logged))
+    assert r.admission.stat["busy"] + r.admission.stat["client_busy"] > 0
@@ -0,0 +1,68 @@
+# Tests
+
+import sys
+sys.path += ["."]
+
+from pybft.replica import replica
+from pybft.auth import authenticator, keyring
+from pybft.codec import wirecodec
+from pybft.net import server
+
+
+def test_authenticator_vector():
+    keys = keyring(b"secret")
+    auths = [authenticator(i, 4, keys) for i in range(4)]
+
+    payload = b"some message"
+    env = auths[1].seal(payload)
+    for a in auths:
+        sender, p, tags = a.open(env)
+        assert sender == 1 and bytes(p) == payload
+        assert a.verify(sender, p, tags)
+
+    # Tampered payload, or a sender claiming to be someone else
+    sender, p, tags = auths[2].open(env)
+    assert not auths[2].verify(sender, b"some messagf", tags)
+    assert not auths[2].verify(3, p, tags)
+
+    # A different master secret
+    other = authenticator(1, 4, keyring(b"other"))
+    assert not auths[2].verify(1, payload, other.seal(payload)[-4*32:])
+
+
+def test_authenticator_cache():
+    keys = keyring(b"secret")
+    a0, a1 = authenticator(0, 4, keys, cache_size=2), authenticator(1, 4, keys)
+
+    envs = [a1.seal(b"message%d" % x) for x in range(3)]
+    for env in envs + envs[2:]:
+        assert a0.verify(*a0.open(env))
+    assert a0.stat == {"hits": 1, "misses": 3, "failures": 0}
+    assert len(a0.cache) == 2
+
+    # Clients get a single tag
+    c = authenticator(b"client", 4, keys)
+    sender, p, tags = c.open(a1.seal(b"reply", to=b"client"))
+    assert len(tags) == 32 and c.verify(sender, p, tags)
+
+
+def test_server_drops_forged_frames():
+    keys = keyring(b"secret")
+    s = server(replica(0, 4))
+    s.rep.auth = authenticator(0, 4, keys)
+    codec = wirecodec()
+
+    request = (replica._REQUEST, b"message", 10, b"100")
+    assert s.unseal(authenticator(b"100", 4, keys).seal(codec.encode(request))) == request
+
+    # A client forging a request for another client
+    assert s.unseal(authenticator(b"101", 4, keys).seal(codec.encode(request))) is None
+
+    # A replica signing a PREPARE on behalf of another
+    prep = (replica._PREPARE, 0, 1, "00" * 32, 2)
+    assert s.unseal(authenticator(1, 4, keys).seal(codec.encode(prep))) is None
+    assert s.unseal(authenticator(2, 4, keys).seal(codec.encode(prep))) == prep
+
+    # Not signed with the shared keys
+    forged = authenticator(2, 4, keyring(b"other")).seal(codec.encode(prep))
+    assert s.unseal(forged) is None
@@ -0,0 +1,65 @@
+# Tests
+
+import sys
+sys.path += ["."]
+
+from pybft.replica import replica
+from tests.test_replica import driver
+
+
+def test_certificate_counts():
+    r = replica(1, 4)
+
+    request = (r._REQUEST, b"message", 10, b"100")
+    hm = r.hash(request)
+    r.in_i.add((r._PREPREPARE, 0, 1, request, 0))
+    r.in_i.add((r._PREPARE, 0, 1, hm, 0)) # From the primary: not counted
+    r.in_i.add((r._PREPARE, 0, 1, hm, 1))
+    assert not r.prepared(request, 0, 1)
+
+    r.in_i.add((r._PREPARE, 0, 1, hm, 2))
+    cert = r.certs.get(0, 1, hm)
+    assert cert.prepares == set([1, 2])
+    assert r.prepared(request, 0, 1)
+
+    for j in range(3):
+        r.in_i.add((r._COMMIT, 0, 1, hm, j))
+    assert r.commited(request, 0, 1)
+
+    r.in_i.discard((r._COMMIT, 0, 1, hm, 0))
+    assert not r.commited(request, 0, 1)
+
+    r.in_i -= set(r.in_i.at_slot(0, 1))
+    assert r.certs.get(0, 1, hm) is None
+    assert not r.certs.is_proposed(1, hm)
+
+
+def test_certificate_matches_reference():
+    dvr = driver(f=1)
+    reqs = [(replica._REQUEST, b"message%d" % x, 10, b"%d" % x) for x in range(25)]
+    dvr.execute(reqs, ordered=False)
+
+    for r in dvr.replicas:
+        M = set(r.in_i)
+        for (_, v, n, m, _) in r.filter_type(r._PREPREPARE):
+            assert r.prepared(m, v, n) == r.prepared(m, v, n, M)
+            assert r.commited(m, v, n) == r.commited(m, v, n, M)
+
+
+def test_progress_only_touched_slots():
+    r = replica(1, 4)
+
+    reqs = [(r._REQUEST, b"message%d" % n, 10, b"%d" % n) for n in (1, 2)]
+    for n, request in [(2, reqs[1]), (1, reqs[0])]:
+        hm = r.hash(request)
+        r.in_i.add((r._PREPREPARE, 0, n, request, 0))
+        r.in_i |= set((r._PREPARE, 0, n, hm, j) for j in (2, 3))
+        r.in_i |= set((r._COMMIT, 0, n, hm, j) for j in (0, 2, 3))
+
+    assert r.certs.touched == set([1, 2])
+
+    # Slot 2 is committed first, but executes after slot 1.
+    r.make_progress()
+    assert r.last_exec_i == 2
+    assert len(r.certs.touched) == 0
+    assert len([m for m in r.out_i if m[0] == r._REPLY]) == 2
@@ -0,0 +1,125 @@
+# Tests
+
+import sys
+sys.path += ["."]
+
+import pytest
+
+from pybft.client import client
+from pybft.replica import replica
+from pybft.sim import simulator, link
+from tests.test_service import counter
+
+
+class clock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def sent(cl):
+    return [(j, m) for j, msgs in cl.drain() for m in msgs]
+
+
+def test_reply_quorum():
+    cl = client(b"c", 4)
+    cl.submit(b"op")
+    [(j, req)] = sent(cl)
+    assert j == 0 and req == (replica._REQUEST, b"op", 1, b"c")
+
+    # f+1 = 2 replicas must agree on the result.
+    cl.receive((replica._REPLY, 0, 1, b"c", 1, b"good"))
+    cl.receive((replica._REPLY, 0, 1, b"c", 2, b"bad"))
+    cl.receive((replica._REPLY, 0, 1, b"c", 1, b"good"))
+    assert cl.completed() == []
+    cl.receive((replica._REPLY, 0, 1, b"c", 9, b"good"))
+    assert cl.completed() == []
+    cl.receive((replica._REPLY, 0, 1, b"c", 3, b"good"))
+    assert cl.completed() == [(b"op", b"good")] and not cl.busy()
+
+    # Late replies for a completed request are ignored.
+    cl.receive((replica._REPLY, 0, 1, b"c", 0, b"good"))
+    assert cl.completed() == []
+
+
+def test_retransmit_to_all_with_backoff():
+    cl = client(b"c", 4, timeout=0.1, max_timeout=0.3)
+    cl.clock = clock()
+    cl.submit(b"op")
+    assert [j for j, _ in sent(cl)] == [0]
+
+    cl.tick()
+    assert sent(cl) == []
+    cl.clock.now = 0.1
+    cl.tick()
+    assert [j for j, _ in sent(cl)] == [0, 1, 2, 3]
+
+    # The timeout doubles, up to max_timeout.
+    cl.clock.now = 0.25
+    cl.tick()
+    assert sent(cl) == []
+    cl.clock.now = 0.31
+    cl.tick()
+    assert len(sent(cl)) == 4
+    cl.clock.now = 0.65
+    cl.tick()
+    assert len(sent(cl)) == 4 and cl.stat["retries"] == 3
+
+    # A busy signal pushes the next retry back.
+    cl.clock.now = 0.85
+    cl.receive((replica._BUSY, 0, 1, b"c", 2))
+    cl.clock.now = 0.96
+    cl.tick()
+    assert sent(cl) == [] and cl.stat["busy"] == 1
+
+
+def test_view_from_replies():
+    cl = client(b"c", 4)
+    cl.submit(b"a")
+    sent(cl)
+    cl.receive((replica._REPLY, 2, 1, b"c", 1, None))
+    cl.receive((replica._REPLY, 1, 1, b"c", 2, None))
+    assert cl.view == 1
+    cl.submit(b"b")
+    assert sent(cl) == [(1, (replica._REQUEST, b"b", 2, b"c"))]
+
+
+def test_pipelined_lanes():
+    cl = client(b"c", 4, window=3, multicast=True)
+    for x in range(5):
+        cl.submit(x)
+    reqs = [m for j, m in sent(cl) if j == 0]
+    assert [(m[1], m[2], m[3]) for m in reqs] == \
+        [(0, 1, b"c/0"), (1, 1, b"c/1"), (2, 1, b"c/2")]
+    assert len(cl.queue) == 2
+
+    # A completion frees its lane for the next operation, with a newer
+    # timestamp on that lane.
+    for i in [0, 1]:
+        cl.receive((replica._REPLY, 0, 1, b"c/1", i, b"r"))
+    assert cl.completed() == [(1, b"r")]
+    assert [(m[1], m[2], m[3]) for j, m in sent(cl) if j == 0] == [(3, 2, b"c/1")]
+
+
+def test_lanes_need_bytes_ids():
+    for c in ["c", 7]:
+        with pytest.raises(TypeError):
+            client(c, 4, window=4)
+    with pytest.raises(ValueError):
+        client(b"c", 4, window=0)
+    assert client(b"c", 4, window=2).lanes == [b"c/0", b"c/1"]
+
+
+def test_closed_loop_in_simulator():
+    sim = simulator(f=1, seed=2, service=counter, default_link=link(loss=0.02))
+    clients = [client(b"a", 4, window=4, timeout=0.02), client(b"b", 4, timeout=0.02)]
+    ops = [[b"1"] * 40, [b"2"] * 10]
+    rep = sim.run_clients(clients, ops)
+    assert rep["requests"] == 50 and len(sim.latencies) == 50
+    assert clients[0].stat["completed"] == 40 and not clients[0].busy()
+
+    # Every operation executed exactly once.
+    assert all(r.service.total == 60 for r in sim.replicas if r.last_exec_i == \
+               max(s.last_exec_i for s in sim.replicas))
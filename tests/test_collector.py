@@ -0,0 +1,65 @@
+# Tests
+
+import sys
+sys.path += ["."]
+
+from pybft.replica import replica
+from tests.test_replica import driver
+
+
+def test_collect_only_when_watermark_advances():
+    dvr = driver(f=1)
+    reqs = [(replica._REQUEST, b"message%d" % x, 10, b"%d" % x) for x in range(35)]
+    dvr.execute(reqs, ordered=False)
+
+    for r in dvr.replicas:
+        n = r.stable_n()
+        assert n == r.gc.low
+        assert r.gc.stats["advances"] < r.gc.stats["runs"]
+        assert r.gc.stats["bytes"] > 0
+        assert all(xn >= n for xn in r.in_i.seqnos())
+        assert all(xn >= n for (xn, _) in r.checkpts_i)
+
+        # Nothing left to collect at the current watermark.
+        runs = r.gc.stats["advances"]
+        r.garbage_collect()
+        assert r.gc.stats["advances"] == runs
+
+
+def test_collect_executed_requests_by_client():
+    r = replica(1, 4)
+
+    request = (r._REQUEST, b"message", 10, b"100")
+    r.in_i.add(request)
+    assert r.gc.by_client[b"100"] == set([request])
+
+    r.garbage_collect()
+    assert request in r.in_i
+
+    r.last_rep_ti[b"100"] = 10
+    r.gc.touch_client(b"100")
+    r.garbage_collect()
+    assert request not in r.in_i
+    assert b"100" not in r.gc.by_client
+
+
+def test_no_slot_messages_below_watermark():
+    dvr = driver(f=1)
+    reqs = [(replica._REQUEST, b"message%d" % x, 10, b"%d" % x) for x in range(25)]
+    dvr.execute(reqs, ordered=False)
+
+    r = dvr.replicas[1]
+    n = r.stable_n()
+    assert n > 0 and r.in_i.low == n
+
+    # As from a NEWVIEW whose maxV is below our stable checkpoint.
+    request = (r._REQUEST, b"late", 10, b"late")
+    late = [(r._PREPREPARE, 1, n - 1, request, 1), \
+            (r._PREPARE, 1, n - 1, r.hash(request), 2)]
+    r.in_i |= late
+    assert all(msg not in r.in_i for msg in late)
+    assert all(xn >= n for xn in r.in_i.seqnos())
+
+    at_n = (r._PREPARE, 1, n, r.hash(request), 2)
+    r.in_i.add(at_n)
+    assert at_n in r.in_i
@@ -0,0 +1,50 @@
+# Tests
+
+import sys
+sys.path += ["."]
+
+from pybft.replica import replica
+from pybft.digest import digests, encode_request
+
+
+def test_canonical_request_encoding():
+    r = replica(0, 4)
+    m = (r._REQUEST, b"message", 10, b"100")
+
+    # Equal requests encode the same, distinct ones do not collide.
+    assert encode_request(m) == encode_request((r._REQUEST, b"message", 10.0, b"100"))
+    assert encode_request((r._REQUEST, b"message", 10.001, b"100")) != encode_request(m)
+    assert encode_request((r._REQUEST, b"mess", 10, b"age100")) != encode_request(m)
+
+    d = digests(r._BATCH)
+    assert d.of(m) == digests(r._BATCH).of((r._REQUEST, b"message", 10.0, b"100"))
+    assert d.of((r._REQUEST, b"message", 10.001, b"100")) != d.of(m)
+
+
+def test_digest_lru():
+    r = replica(0, 4)
+    d = digests(r._BATCH, size=3)
+    reqs = [(r._REQUEST, b"message%d" % x, 10, b"%d" % x) for x in range(4)]
+
+    hs = [d.of(m) for m in reqs[:3]]
+    assert d.stat == {"hits": 0, "misses": 3, "evictions": 0}
+
+    # Touch the oldest, so that the second one is evicted next.
+    assert d.of(reqs[0]) == hs[0]
+    d.of(reqs[3])
+    assert d.stat == {"hits": 1, "misses": 4, "evictions": 1}
+    assert reqs[0] in d.cache and reqs[1] not in d.cache
+    assert d.of(reqs[1]) == hs[1]
+    assert 0 < d.hit_rate() < 1
+
+
+def test_batch_digest_from_request_digests():
+    r = replica(0, 4)
+    reqs = tuple((r._REQUEST, b"message%d" % x, 10, b"%d" % x) for x in range(5))
+    for m in reqs:
+        r.hash(m)
+
+    misses = r.digests.stat["misses"]
+    h = r.hash((r._BATCH, reqs))
+    assert r.digests.stat["misses"] == misses + 1
+    assert r.hash((r._BATCH, reqs)) == h
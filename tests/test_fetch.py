@@ -0,0 +1,110 @@
+# Tests
+
+import sys
+sys.path += ["."]
+
+from pybft.replica import replica
+from pybft.codec import wirecodec
+from pybft.sim import simulator, link
+from tests.common import requests
+
+
+def test_refs_digest_as_bodies():
+    r = replica(0, 4)
+    req1, req2 = requests(2, clients=10, size=64)
+    for m in [req1, (r._BATCH, (req1, req2))]:
+        pp = (r._PREPREPARE, 0, 1, m, 0)
+        stripped = r.fetch.strip(pp)
+        assert r.hash(stripped[3]) == r.hash(m)
+        assert r.fetch.digests_of(stripped[3]) is not None
+        assert r.fetch.resolve(pp) is pp
+
+        codec = wirecodec()
+        assert codec.decode(codec.encode(stripped)) == stripped
+
+
+def test_primary_sends_digests():
+    r = replica(0, 4)
+    r.digest_preprepares = True
+    req = requests(1, clients=10, size=64)[0]
+    r.route_receive(req)
+    pp = (r._PREPREPARE, 0, 1, req, 0)
+    assert pp in r.in_i
+    assert r.fetch.strip(pp) in r.out_i and pp not in r.out_i
+
+
+def test_backup_fetches_missing_bodies():
+    primary, backup = replica(0, 4), replica(1, 4)
+    for r in (primary, backup):
+        r.digest_preprepares = True
+        r.clock = lambda: 0.0
+    req1, req2 = requests(2, clients=10, size=64)
+    primary.batch_size = 2
+    primary.batch_timeout = 1.0
+    primary.route_receive(req1)
+    primary.route_receive(req2)
+    pp = (primary._PREPREPARE, 0, 1, (primary._BATCH, (req1, req2)), 0)
+    assert pp in primary.in_i
+
+    # The backup knows one of the two bodies.
+    backup.route_receive(req1)
+    backup.out_i.clear()
+    backup.route_receive(primary.fetch.strip(pp))
+    assert pp not in backup.in_i
+    fetches = [m for m in backup.out_i if m[0] == backup._FETCH]
+    assert fetches == [(backup._FETCH, (backup.hash(req2),), 1)]
+    assert dict(backup.out_i.drain())[0] == fetches
+
+    # The primary answers with the body, which completes the PREPREPARE.
+    primary.out_i.clear()
+    primary.route_receive(fetches[0])
+    answer = dict(primary.out_i.drain())
+    assert answer == {1: [req2]}
+    admitted = backup.admission.stat["admitted"]
+    backup.route_receive(req2)
+    assert pp in backup.in_i
+    assert req2 in backup.in_i and backup.admission.stat["admitted"] == admitted + 1
+    assert (backup._PREPARE, 0, 1, backup.hash(pp[3]), 1) in backup.out_i
+    assert not backup.fetch.parked and not backup.fetch.waiting
+
+
+def test_unanswered_fetches_are_repeated():
+    backup = replica(1, 4)
+    now = [0.0]
+    backup.clock = lambda: now[0]
+    req = requests(1, clients=10, size=64)[0]
+    pp = backup.fetch.strip((backup._PREPREPARE, 0, 1, req, 0))
+    backup.route_receive(pp)
+    backup.out_i.drain()
+
+    backup.tick()
+    assert not backup.out_i
+    now[0] += backup.fetch.interval
+    backup.tick()
+    assert [m[0] for m in backup.out_i] == [backup._FETCH]
+
+    # A full PREPREPARE, say a retransmission, makes the parked one moot.
+    backup.route_receive((backup._PREPREPARE, 0, 1, req, 0))
+    backup.tick()
+    assert not backup.fetch.parked and backup.fetch.stat["forgotten"] == 1
+
+
+def test_sim_digest_preprepares():
+    bytes_from = []
+    for digest in (False, True):
+        sim = simulator(f=1, seed=4, batch_size=4, batch_timeout=0.001, wire=True, \
+                        multicast=True)
+        for r in sim.replicas:
+            r.digest_preprepares = digest
+        rep = sim.run(requests(60, clients=10, size=4096))
+        assert rep["requests"] == 60
+        bytes_from.append(rep["bytes_from"][0])
+    assert bytes_from[1] < bytes_from[0] / 2
+
+    # Without multicast, the backups fetch what they miss from the primary.
+    sim = simulator(f=1, seed=4, wire=True)
+    for r in sim.replicas:
+        r.digest_preprepares = True
+    rep = sim.run(requests(30, clients=10, size=64))
+    assert rep["requests"] == 30
+    assert rep["messages_by_type"][replica._FETCH] > 0
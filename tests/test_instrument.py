@@ -0,0 +1,57 @@
+# Tests
+
+import sys
+sys.path += ["."]
+
+from pybft.replica import replica
+from pybft.instrument import probes
+from pybft.sim import simulator
+from tests.common import requests
+
+
+def test_probes_time_steps_and_sizes():
+    sim = simulator(f=1, seed=1)
+    ps = [probes(r) for r in sim.replicas]
+    for p in ps:
+        p.enable()
+    assert sim.run(requests(30))["requests"] == 30
+
+    snap = ps[1].snapshot()
+    timers = snap["timers"]
+    assert timers["route_receive"]["calls"] == sum(snap["received"].values())
+    assert timers["execute"]["calls"] >= 30
+    assert timers["garbage_collect"]["calls"] == timers["route_receive"]["calls"]
+    assert timers["route_receive"]["seconds"] >= timers["make_progress"]["seconds"]
+
+    assert snap["sizes"]["in_i"]["peak"] >= snap["sizes"]["in_i"]["now"] > 0
+    assert snap["sizes"]["checkpts_i"]["peak"] >= 1
+    assert set(snap["peers"]) == set([0, 2, 3])
+    assert 0 < snap["digests"]["hit_rate"] < 1
+
+    text = ps[1].text()
+    assert "route_receive" in text and "|in_i|" in text
+
+
+def test_probes_disabled_leave_no_trace():
+    r = replica(1, 4)
+    p = probes(r)
+    p.enable()
+    assert "route_receive" in r.__dict__
+    r.route_receive((r._REQUEST, b"message", 10, b"1"))
+    assert p.calls["route_receive"] == 1 and p.calls["receive_request"] == 1
+
+    p.disable()
+    assert not any(name in r.__dict__ for name in p.steps)
+    r.route_receive((r._REQUEST, b"message", 11, b"1"))
+    assert p.calls["route_receive"] == 1
+
+
+def test_probes_count_peers_of_batches():
+    r = replica(1, 4)
+    p = probes(r)
+    p.enable()
+    d = "00" * 32
+    r.route_receive_many([(r._PREPARE, 0, 1, d, 2), (r._COMMIT, 0, 1, d, 3), \
+                          (r._REQUEST, b"message", 10, b"1"), (r._PREPARE, 0, 2, d, 2)])
+    assert p.snapshot()["peers"] == {2: 2, 3: 1}
+    assert p.calls["route_receive"] == 1
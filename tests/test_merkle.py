@@ -0,0 +1,61 @@
+# Tests
+
+import sys
+sys.path += ["."]
+
+from pybft.replica import replica
+from pybft.merkle import merkle, checkpointer, checkpoint_digest
+
+
+def test_merkle_root_incremental():
+    t = merkle(depth=8)
+    empty = t.root()
+    for c in range(100):
+        t.update(b"%d" % c, (1, b"r%d" % c))
+    first = t.root()
+    assert first != empty
+
+    # The same entries in another order give the same root.
+    u = merkle(depth=8)
+    for c in reversed(range(100)):
+        u.update(b"%d" % c, (1, b"r%d" % c))
+    assert u.root() == first
+
+    # A change recomputes one bucket and its path only.
+    hashes = t.stat["hashes"]
+    t.update(b"7", (2, b"x"))
+    assert t.root() != first
+    assert t.stat["hashes"] - hashes == 1 + 8
+    assert t.root() == t.root()
+
+
+def test_checkpointer_state_and_restore():
+    r = replica(0, 4)
+    chk = r.chkpts
+    chk.update(b"a", 1, b"ra")
+    d1 = chk.take(10)
+    chk.update(b"b", 1, b"rb")
+    chk.update(b"a", 2, b"ra2")
+    d2 = chk.take(20)
+    assert d1 != d2 and chk.digest(10) == d1 and chk.digest(20) == d2
+
+    snap, entries = chk.state(10)
+    assert sorted(entries) == [(b"a", 1, b"ra")]
+    snap, entries = chk.state(20)
+    assert sorted(entries) == [(b"a", 2, b"ra2"), (b"b", 1, b"rb")]
+
+    # Once stable, the earlier checkpoints fold into the base.
+    chk.stable(10)
+    assert chk.held.base[0] == 10 and list(chk.held.later) == [20]
+    assert chk.state(20) == (snap, entries)
+
+    r2 = replica(1, 4)
+    assert r2.from_checkpoint(20, chk.state(20)) == d2
+    assert r2.last_rep_ti[b"a"] == 2 and r2.last_rep_i[b"b"] == b"rb"
+    assert r2.chkpts.digest(20) == d2
+
+
+def test_checkpoint_digest_covers_snapshot():
+    root = merkle(depth=4).root()
+    assert checkpoint_digest(None, root) != checkpoint_digest((1,), root)
+    assert len(checkpoint_digest(None, root)) == 64
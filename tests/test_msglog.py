@@ -0,0 +1,54 @@
+# Tests
+
+import sys
+sys.path += ["."]
+
+from pybft.replica import replica
+from pybft.msglog import msglog
+
+
+def test_msglog_indexes():
+    r = replica(1, 4)
+    L = msglog([r._PREPARE, r._COMMIT], r.msg_digest)
+
+    request = (r._REQUEST, b"message", 10, b"100")
+    hm = r.hash(request)
+    p1 = (r._PREPARE, 0, 1, hm, 1)
+    p2 = (r._PREPARE, 0, 2, hm, 1)
+    c1 = (r._COMMIT, 0, 1, hm, 2)
+
+    L |= set([request, p1, p2, c1])
+    assert len(L) == 4
+    assert p1 in L
+    assert L.of_type(r._PREPARE) == set([p1, p2])
+    assert L.at_slot(0, 1) == set([p1, c1])
+    assert L.with_digest(hm) == set([request, p1, p2, c1])
+
+    L -= set([p1])
+    L.discard(p1)
+    assert p1 not in L
+    assert L.at_slot(0, 1) == set([c1])
+    assert L.with_digest(hm) == set([request, p2, c1])
+
+    L.remove(c1)
+    assert len(L.at_slot(0, 1)) == 0
+    assert (0, 1) not in L.by_slot
+
+
+def test_msglog_same_answers_as_set():
+    r = replica(0, 4)
+
+    request = (r._REQUEST, b"message", 10, b"100")
+    hm = r.hash(request)
+    M = set([(r._PREPREPARE, 0, 1, request, 0)])
+    M |= set((r._PREPARE, 0, 1, hm, j) for j in range(1, 4))
+    M |= set((r._COMMIT, 0, 1, hm, j) for j in range(3))
+
+    L = msglog([r._PREPREPARE, r._PREPARE, r._COMMIT, r._CHECKPOINT], \
+               r.msg_digest, M)
+
+    assert set(L) == M
+    assert r.prepared(request, 0, 1, L) == r.prepared(request, 0, 1, M)
+    assert r.commited(request, 0, 1, L) == r.commited(request, 0, 1, M)
+    assert r.compute_P(0, L) == r.compute_P(0, M)
+    assert set(r.filter_type(r._COMMIT, L)) == set(r.filter_type(r._COMMIT, M))
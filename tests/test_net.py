@@ -0,0 +1,142 @@
+# Tests
+
+import sys
+sys.path += ["."]
+
+import asyncio
+
+from pybft.replica import replica
+from pybft.net import server, frame, unframe
+from pybft.codec import wirecodec
+from pybft.auth import authenticator, keyring
+
+
+def test_framing_and_codec():
+    codec = wirecodec()
+    request = (replica._REQUEST, b"message", 10, b"100")
+    prep = (replica._PREPREPARE, 0, 1, request, 0)
+    vc = (replica._VIEWCHANGE, 1, 0, None, frozenset(), frozenset([prep]), 2)
+
+    buf = bytearray()
+    for m in [request, prep, vc]:
+        buf += frame(codec.encode(m))
+    tail = frame(codec.encode(request))
+    buf += tail[:3]
+
+    msgs = [codec.decode(p) for p in unframe(buf)]
+    assert msgs == [request, prep, vc]
+    assert bytes(buf) == tail[:3]
+
+
+async def cluster(f, reqs, keys=None):
+    R = 3*f + 1
+    servers = [server(replica(i, R)) for i in range(R)]
+    if keys is not None:
+        for s in servers:
+            s.rep.auth = authenticator(s.rep.i, R, keys)
+
+    codec = wirecodec()
+    def seal(req):
+        if keys is None:
+            return codec.encode(req)
+        return authenticator(req[3], R, keys).seal(codec.encode(req))
+
+    def unseal(p):
+        if keys is None:
+            return codec.decode(p)
+        auth = authenticator(b"reader", R, keys)
+        sender, payload, tags = auth.open(p)
+        msg = codec.decode(payload)
+        assert authenticator(msg[3], R, keys).verify(sender, payload, tags)
+        return msg
+    peers = {}
+    for s in servers:
+        peers[s.rep.i] = await s.start()
+    for s in servers:
+        s.peers = peers
+
+    # The client sends its requests to all replicas, and gets replies
+    # on the same connections.
+    conns = [await asyncio.open_connection(*peers[j]) for j in range(R)]
+    payload = b"".join(frame(seal(req)) for req in reqs)
+    for _, writer in conns:
+        writer.write(payload)
+        await writer.drain()
+
+    async def replies_from(reader):
+        got = set()
+        buf = bytearray()
+        while len(got) < len(reqs):
+            data = await reader.read(1 << 16)
+            assert data
+            buf += data
+            for p in unframe(buf):
+                (_, v, t, c, i, r) = unseal(p)
+                got.add((t, c))
+        return got
+
+    replies = await asyncio.wait_for(asyncio.gather( \
+                  *[replies_from(reader) for reader, _ in conns]), 10)
+
+    for _, writer in conns:
+        writer.close()
+    for s in servers:
+        await s.close()
+    return replies, servers
+
+
+def test_cluster_on_localhost():
+    reqs = [(replica._REQUEST, b"message%d" % x, 10, b"%d" % x) for x in range(20)]
+    replies, servers = asyncio.run(cluster(1, reqs))
+    for got in replies:
+        assert got == set((req[2], req[3]) for req in reqs)
+    # Messages to a peer travel in one bundle, sealed once.
+    assert sum(s.stat["writes"] for s in servers) < \
+           sum(s.stat["msgs_out"] for s in servers)
+    assert sum(s.stat["frames_out"] for s in servers) < \
+           sum(s.stat["msgs_out"] for s in servers)
+
+
+def test_cluster_with_authenticators():
+    keys = keyring(b"secret")
+    reqs = [(replica._REQUEST, b"message%d" % x, 10, b"%d" % x) for x in range(10)]
+    replies, servers = asyncio.run(cluster(1, reqs, keys))
+    for got in replies:
+        assert got == set((req[2], req[3]) for req in reqs)
+    assert all(s.stat["rejected"] == 0 for s in servers)
+    assert sum(s.rep.auth.stat["hits"] for s in servers) > 0
+    assert sum(s.stat["vouched"] for s in servers) > 0
+
+
+def test_forwarded_requests_need_client_tags():
+    keys = keyring(b"secret")
+    codec = wirecodec()
+    primary, backup = server(replica(0, 4)), server(replica(1, 4))
+    for s in [primary, backup]:
+        s.rep.auth = authenticator(s.rep.i, 4, keys)
+
+    req = (replica._REQUEST, b"message", 10, b"100")
+    forged = (replica._REQUEST, b"forged", 10, b"101")
+    client = authenticator(b"100", 4, keys).seal(codec.encode(req))
+    assert primary.unseal(client) == req and req in primary.sealed
+
+    # A replica forwarding a request it cannot vouch for is not believed,
+    # alone or in a PREPREPARE.
+    for msg in [forged, (replica._PREPREPARE, 0, 1, forged, 0), \
+                (replica._PREPREPARE, 0, 1, (replica._BATCH, (req, forged)), 0)]:
+        assert backup.unseal(primary.seal(msg)) is None
+    assert backup.stat["vouched"] == 0
+
+    # With the client's envelope, it is.
+    pp = (replica._PREPREPARE, 0, 1, req, 0)
+    bundle = (server._BUNDLE, pp) + tuple(primary.envelopes([pp]))
+    assert backup.unseal(primary.seal(bundle)) == (server._BUNDLE, pp)
+    assert backup.stat["vouched"] == 1 and req in backup.sealed
+
+    # A tampered envelope does not verify.
+    (_, c, payload, tags) = primary.envelopes([pp])[0]
+    other = server(replica(2, 4))
+    other.rep.auth = authenticator(2, 4, keys)
+    bad = (server._BUNDLE, pp, (server._SEALED, c, payload.replace(b"message", b"massage"), tags))
+    assert other.unseal(primary.seal(bad)) == (server._BUNDLE,)
+    assert other.stat["rejected"] == 1
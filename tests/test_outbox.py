@@ -0,0 +1,80 @@
+# Tests
+
+import sys
+sys.path += ["."]
+
+from pybft.replica import replica
+from pybft.outbox import outbox
+from pybft.auth import authenticator, keyring
+from pybft.codec import wirecodec
+from pybft.net import server
+
+
+def test_outbox_routes_in_order():
+    r = replica(1, 4)
+    out = r.out_i
+    request = (r._REQUEST, b"message", 10, b"100")
+    hm = r.hash(request)
+    p = (r._PREPARE, 0, 1, hm, 1)
+    c = (r._COMMIT, 0, 1, hm, 1)
+    reply = (r._REPLY, 0, 10, b"100", 1, None)
+    fwd = (r._COMMIT, 0, 1, hm, 2)
+
+    for m in [request, p, c, reply, fwd]:
+        out.add(m)
+    assert len(out) == 5 and p in out
+
+    bundles = dict(out.drain())
+    assert bundles[0] == [request, p, c, fwd]
+    assert bundles[2] == [p, c]
+    assert bundles[3] == [p, c, fwd]
+    assert bundles[b"100"] == [reply]
+    assert len(out) == 0
+
+
+def test_outbox_suppresses_duplicates():
+    r = replica(1, 4)
+    out = r.out_i
+    p = (r._PREPARE, 0, 1, "00" * 32, 1)
+
+    assert out.add(p) and not out.add(p)
+    out.drain()
+    assert not out.add(p) and out.drain() == []
+
+    # Retransmissions go out again, once per drain.
+    assert out.resend(p) and not out.resend(p)
+    assert [m for _, ms in out.drain() for m in ms] == [p] * 3
+
+    # The history of sent messages is bounded.
+    small = outbox(r, history=2)
+    for n in range(3):
+        small.add((r._PREPARE, 0, n, "00" * 32, 1))
+    small.drain()
+    assert small.add((r._PREPARE, 0, 0, "00" * 32, 1))
+
+
+def test_server_checks_every_message_of_a_bundle():
+    keys = keyring(b"secret")
+    s = server(replica(0, 4))
+    s.rep.auth = authenticator(0, 4, keys)
+    codec = wirecodec()
+
+    request = (replica._REQUEST, b"message", 10, b"100")
+    prep = (replica._PREPARE, 0, 1, "00" * 32, 2)
+    other = (replica._PREPARE, 0, 1, "00" * 32, 3)
+
+    # A forwarded request travels with its client's envelope.
+    fwd = server(replica(2, 4))
+    fwd.rep.auth = authenticator(2, 4, keys)
+    fwd.unseal(authenticator(b"100", 4, keys).seal(codec.encode(request)))
+    bundle = (s._BUNDLE, request, prep)
+    sealed = bundle + tuple(fwd.envelopes([request]))
+    assert s.unseal(authenticator(2, 4, keys).seal(codec.encode(sealed))) == bundle
+
+    forged = (s._BUNDLE, prep, other)
+    assert s.unseal(authenticator(2, 4, keys).seal(codec.encode(forged))) is None
+    assert s.unseal(authenticator(b"100", 4, keys).seal(codec.encode(bundle))) is None
+
+    # Without it, only the request is dropped.
+    s.sealed.clear()
+    assert s.unseal(authenticator(2, 4, keys).seal(codec.encode(bundle))) == (s._BUNDLE, prep)
@@ -130,6 +130,60 @@ def test_committed():
     M = set([prepr, p0, p1])
     assert not r.commited(request, 0, 1, M)
 
+def test_batch_digest():
+    r = replica(0, 4)
+
+    reqs = tuple((r._REQUEST, b"message%d" % x, 10, b"%d" % x) for x in range(3))
+    batch = (r._BATCH, reqs)
+    assert r.requests_of(batch) == reqs
+    assert r.requests_of(reqs[0]) == (reqs[0],)
+    assert r.requests_of(None) == ()
+
+    assert r.hash(batch) == r.hash((r._BATCH, reqs))
+    assert r.hash(batch) != r.hash((r._BATCH, reqs[::-1]))
+    assert r.hash(batch) not in [r.hash(req) for req in reqs]
+
+def test_batch_packing():
+    r = replica(0, 4)
+    r.batch_size = 3
+    r.batch_timeout = 1.0
+    now = [0.0]
+    r.clock = lambda: now[0]
+
+    reqs = [(r._REQUEST, b"message%d" % x, 10, b"%d" % x) for x in range(7)]
+    for req in reqs:
+        r.route_receive(req)
+
+    preps = sorted((m for m in r.out_i if m[0] == r._PREPREPARE), key=lambda m: m[2])
+    assert [m[3] for m in preps] == [(r._BATCH, tuple(reqs[0:3])), \
+                                     (r._BATCH, tuple(reqs[3:6]))]
+    assert list(r.pending_i) == reqs[6:]
+
+    # The last, partial, batch waits for its timeout.
+    assert not r.tick()
+    now[0] = 1.0
+    assert r.tick()
+    assert (r._PREPREPARE, 0, 3, reqs[6], 0) in r.out_i
+    assert len(r.pending_i) == 0
+
+def test_batch_execute_in_order():
+    r = replica(1, 4)
+
+    reqs = tuple((r._REQUEST, b"message%d" % x, 10 + x, b"100") for x in range(3))
+    batch = (r._BATCH, reqs)
+    hm = r.hash(batch)
+    r.route_receive((r._PREPREPARE, 0, 1, batch, 0))
+    for j in [2, 3]:
+        r.route_receive((r._PREPARE, 0, 1, hm, j))
+    for j in [0, 2]:
+        r.route_receive((r._COMMIT, 0, 1, hm, j))
+
+    assert r.last_exec_i == 1
+    assert r.last_rep_ti[b"100"] == 12
+    replies = [m for m in r.out_i if m[0] == r._REPLY]
+    assert sorted(m[2] for m in replies) == [10, 11, 12]
+    assert all(req not in r.in_i for req in reqs)
+
 def test_all_transitions():
     for _ in range(100):
         replicas = [ replica(i, 4) for i in range(4) ]
@@ -388,11 +442,18 @@ from collections import defaultdict
 import random
 
 class driver():
-    def __init__(self, f=1):
+    def __init__(self, f=1, batch_size=1, batch_timeout=0.0, service=None):
         n = 3*f+1
-        self.replicas = [replica(i, n) for i in range(n)]
+        self.replicas = [replica(i, n, service() if service else None) \
+                         for i in range(n)]
 
-        self.global_outs = [r.out_i for r in self.replicas]
+        # Replicas share a virtual clock, advanced when the network is idle.
+        self.now = 0.0
+        self.batch_timeout = batch_timeout
+        for r in self.replicas:
+            r.batch_size = batch_size
+            r.batch_timeout = batch_timeout
+            r.clock = lambda: self.now
 
         self.seen_replies = set()
         self.message_numbers = defaultdict(int)
@@ -402,20 +463,16 @@ class driver():
 
 
     def route_to(self):
-        # rx = replica(0,4)
-        for i, msgs in enumerate(self.global_outs):
+        # The outboxes route the messages: replica ids, or clients.
+        for i, r in enumerate(self.replicas):
             Ds = []
-            for m in msgs:
-                if m[0] == replica._REQUEST:
-                    primary = self.replicas[i].primary()
-                    Ds += [(self.replicas[primary], m)]
-                elif m[0] == replica._REPLY:
-                    self.seen_replies.add(m[1:4])
+            for dest, msgs in r.out_i.drain():
+                if isinstance(dest, int):
+                    Ds += [(self.replicas[dest], m) for m in msgs]
                 else:
-                    Ds += [(r, m) for r in self.replicas if r.i != m[-1]]
+                    self.seen_replies.update(m[1:4] for m in msgs if m[0] == replica._REPLY)
             self.message_numbers[i] += len(Ds)
             self.D += Ds
-            msgs.clear()
 
     def execute(self, msg_queue, ordered=True, in_flight=10):
         self.route_to()
@@ -444,6 +501,13 @@ class driver():
 
                 self.D.remove((dest, msg))
             
+            if len(self.D) == 0:
+                # Fire the batch timers
+                self.now += max(self.batch_timeout, 0.01)
+                for r in self.replicas:
+                    r.tick()
+                self.route_to()
+
             if len(self.D) == 0:
                 for r in self.replicas:
                     for m in r.unhandled_requests():
@@ -497,6 +561,35 @@ def test_driver_for_f3_many():
 
 
 
+def batching_gain(f, Msgs_N=50, batch_size=10):
+    # Messages and time per request, without and with batching.
+    import time
+    results = []
+    for size in [1, batch_size]:
+        dvr = driver(f, batch_size=size, batch_timeout=0.01)
+        reqs = [(replica._REQUEST, b"message%d" % x, 10, b"%d" % x) for x in range(Msgs_N)]
+
+        t0 = time.perf_counter()
+        dvr.execute(reqs, ordered=False)
+        t1 = time.perf_counter()
+
+        assert len(dvr.seen_replies) == Msgs_N
+        msgs = sum(dvr.message_numbers.values())
+        results += [(size, msgs / Msgs_N, Msgs_N / (t1 - t0))]
+
+    print("f=%d" % f)
+    for (size, msgs, rate) in results:
+        print("  batch_size=%2d: %8.1f msgs/request %8.1f requests/s" % (size, msgs, rate))
+    print("  gain: %2.2fx" % (results[1][2] / results[0][2]))
+    return results
+
+
+def test_driver_batching_gain():
+    for f in [1, 3]:
+        (_, msgs1, _), (_, msgs10, _) = batching_gain(f)
+        assert msgs10 < msgs1
+
+
 def test_view_change_cost():
     for _ in range(10):
         replicas = [ replica(i, 4) for i in range(4) ]
@@ -561,5 +654,110 @@ def test_view_change_cost():
         assert len(seen_replies) == 2
         # print(message_numbers)
 
+def test_null_slot_after_view_change():
+    replicas = [ replica(i, 4) for i in range(4) ]
+    chkpts = set()
+    for r in replicas:
+        chkpts |= set(r.filter_type(r._CHECKPOINT))
+
+    # Slot 2 prepared in view 0, slot 1 never proposed: the new view
+    # fills slot 1 with a null request.
+    req = (replica._REQUEST, b"message", 1, b"100")
+    d = replicas[0].hash(req)
+    prepared = set([(replica._PREPREPARE, 0, 2, req, 0), (replica._PREPARE, 0, 2, d, 1), \
+                    (replica._PREPARE, 0, 2, d, 2)])
+    for r in replicas[1:]:
+        r.in_i |= chkpts | prepared | set([req])
+        r.send_viewchange(1)
+
+    def deliver():
+        moved = True
+        while moved:
+            moved = False
+            for r in replicas:
+                for dest, msgs in r.out_i.drain():
+                    if isinstance(dest, int):
+                        for msg in msgs:
+                            replicas[dest].route_receive(msg)
+                            moved = True
+    deliver()
+
+    newview = [msg for msg in replicas[1].filter_type(replica._NEWVIEW)]
+    assert len(newview) == 1
+    assert newview[0][4] == frozenset([(replica._PREPREPARE, 1, 1, None, 1)])
+    for r in replicas[1:]:
+        assert r.last_exec_i == 2 and r.last_rep_ti[b"100"] == 1
+
+def test_preprepare_before_its_newview():
+    replicas = [ replica(i, 4) for i in range(4) ]
+    for r in replicas[1:]:
+        r.send_viewchange(1)
+    for r in replicas[2:]:
+        for dest, msgs in r.out_i.drain():
+            if dest == 1:
+                for msg in msgs:
+                    replicas[1].route_receive(msg)
+    assert replicas[1].has_new_view(1)
+
+    # The new primary proposes at once, and its PREPREPARE overtakes the
+    # NEWVIEW on the way to replica 2.
+    req = (replica._REQUEST, b"message", 1, b"100")
+    replicas[1].route_receive(req)
+    msgs = [msg for dest, ms in replicas[1].out_i.drain() if dest == 2 for msg in ms]
+    pp = [msg for msg in msgs if msg[0] == replica._PREPREPARE]
+    nv = [msg for msg in msgs if msg[0] == replica._NEWVIEW]
+    assert len(pp) == 1 and len(nv) == 1
+
+    backup = replicas[2]
+    backup.route_receive(pp[0])
+    assert pp[0] in backup.early_i
+    backup.route_receive(nv[0])
+    assert backup.early_i == set()
+    assert (replica._PREPARE, 1, pp[0][2], backup.hash(req), 2) in backup.in_i
+
+def test_route_receive_many_as_sequential():
+    import random
+    from pybft.sim import simulator, link
+
+    # Record what a backup receives in a simulated run with reordering
+    # and losses, then replay it one by one and in random chunks.
+    sim = simulator(f=1, seed=5, default_link=link(jitter=0.002, loss=0.01))
+    trace = []
+    backup = sim.replicas[1]
+    deliver = backup.route_receive
+    def record(msg):
+        trace.append(msg)
+        deliver(msg)
+    backup.route_receive = record
+    reqs = [(replica._REQUEST, b"message%d" % x, 10, b"%d" % (x % 7)) for x in range(80)]
+    sim.run(reqs)
+
+    def replay(chunked):
+        r = replica(1, 4)
+        r.clock = lambda: 0.0
+        out = set()
+        rng = random.Random(1)
+        i = 0
+        while i < len(trace):
+            k = rng.randint(1, 20) if chunked else 1
+            if chunked:
+                r.route_receive_many(trace[i:i+k])
+            else:
+                for msg in trace[i:i+k]:
+                    r.route_receive(msg)
+            i += k
+            for dest, msgs in r.out_i.drain():
+                out |= set((dest, msg) for msg in msgs)
+        return r, out
+
+    r1, out1 = replay(False)
+    r2, out2 = replay(True)
+    assert r1.last_exec_i == r2.last_exec_i > 0
+    assert set(r1.in_i) == set(r2.in_i)
+    assert r1.checkpts_i == r2.checkpts_i
+    assert r1.last_rep_ti == r2.last_rep_ti
+    assert out1 == out2
+    assert r2.gc.stats["runs"] < r1.gc.stats["runs"]
+
 if __name__ == "__main__":
-    test_driver_for_f3_many()
\ No newline at end of file
+    test_driver_for_f3_many()
@@ -0,0 +1,88 @@
+# Tests
+
+import sys
+sys.path += ["."]
+
+from pybft.replica import replica
+from pybft.sim import simulator, link
+from tests.common import requests
+
+
+def test_retry_resends_only_the_slot():
+    sim = simulator(f=1, seed=1)
+    reqs = requests(5)
+    assert sim.run(reqs)["requests"] == 5
+
+    r = sim.replicas[1]
+    (pp,) = r.certs.proposals(reqs[2])
+    r.route_receive(reqs[2])
+    bundles = dict(r.out_i.drain())
+
+    own = set(m for m in r.in_i.at_slot(pp[1], pp[2]) if m[-1] == r.i)
+    assert set(m[0] for m in own) == set([r._PREPARE, r._COMMIT])
+    for j in [0, 2, 3]:
+        assert set(bundles[j]) == own
+    assert [m[0] for m in bundles[reqs[2][3]]] == [r._REPLY]
+
+
+def test_retry_after_gc_resends_checkpoint():
+    sim = simulator(f=1, seed=1)
+    reqs = requests(25)
+    assert sim.run(reqs)["requests"] == 25
+
+    r = sim.replicas[1]
+    assert r.stable_n() >= 10 and not r.certs.proposals(reqs[0])
+    r.route_receive(reqs[0])
+    sent = [m for _, ms in r.out_i.drain() for m in ms if m[0] == r._CHECKPOINT]
+    assert sent and all(m[2] == r.stable_n() and m[-1] == r.i for m in sent)
+
+
+def test_retransmissions_rate_limited():
+    r = replica(0, 4)
+    now = [0.0]
+    r.clock = lambda: now[0]
+    retx = r.retx
+
+    assert all(retx.allow(1) for _ in range(retx.burst))
+    assert not retx.allow(1) and retx.allow(2)
+    now[0] += 1.0 / retx.rate
+    assert retx.allow(1) and not retx.allow(1)
+
+
+def test_peer_behind_gets_the_slot():
+    sim = simulator(f=1, seed=1)
+    reqs = requests(5)
+    assert sim.run(reqs)["requests"] == 5
+
+    r = sim.replicas[1]
+    (pp,) = r.certs.proposals(reqs[2])
+    commit = [m for m in r.in_i.at_slot(pp[1], pp[2]) \
+              if m[0] == r._COMMIT and m[-1] == 3][0]
+    r.route_receive(commit)
+    bundles = dict(r.out_i.drain())
+    assert list(bundles) == [3]
+    assert set(m[0] for m in bundles[3]) == set([r._PREPARE, r._COMMIT])
+
+
+def test_client_retries_under_loss_complete():
+    sim = simulator(f=1, seed=5, default_link=link(loss=0.02), retry=0.01)
+    rep = sim.run(requests(40))
+    assert rep["requests"] == 40
+    assert rep["messages_by_type"][replica._COMMIT] < 40 * 12 * 3
+
+
+def test_recent_retransmissions_give_way():
+    r = replica(0, 4)
+    now = [0.0]
+    r.clock = lambda: now[0]
+    m1 = (r._PREPARE, 0, 1, "d1", 0)
+    m2 = (r._PREPARE, 0, 2, "d2", 0)
+
+    # Retries for one message do not take every token.
+    for _ in range(3 * r.retx.burst):
+        r.retx.send([m1])
+        r.out_i.drain()
+    r.retx.send([m2])
+    bundles = dict(r.out_i.drain())
+    assert all(bundles[j] == [m2] for j in [1, 2, 3])
+    assert r.retx.stat["recent"] > 0
@@ -0,0 +1,74 @@
+# Tests
+
+import sys
+sys.path += ["."]
+
+from pybft.replica import replica
+from pybft.service import service
+from tests.test_replica import driver
+
+
+class counter(service):
+    # Adds the integer operations of all clients.
+    def __init__(self):
+        self.total = 0
+        self.batches = []
+
+    def execute_batch(self, ops):
+        self.batches.append(len(ops))
+        results = []
+        for (o, t, c) in ops:
+            self.total += int(o)
+            results.append(self.total)
+        return results
+
+    def snapshot(self):
+        return self.total
+
+    def restore(self, snap):
+        self.total = snap
+
+
+def test_service_batch_execute():
+    r = replica(1, 4, counter())
+
+    reqs = tuple((r._REQUEST, b"%d" % x, 10, b"%d" % x) for x in range(1, 4))
+    batch = (r._BATCH, reqs)
+    hm = r.hash(batch)
+    r.in_i.add((r._PREPREPARE, 0, 1, batch, 0))
+    r.in_i |= set((r._PREPARE, 0, 1, hm, j) for j in (2, 3))
+    r.in_i |= set((r._COMMIT, 0, 1, hm, j) for j in (0, 2, 3))
+    r.make_progress()
+
+    assert r.service.batches == [3]
+    assert r.service.total == 6
+    replies = set(m[3:] for m in r.out_i if m[0] == r._REPLY)
+    assert replies == set([(b"1", 1, 1), (b"2", 1, 3), (b"3", 1, 6)])
+
+
+def test_service_checkpoint():
+    r = replica(1, 4, counter())
+    r.service.total = 42
+    r.last_rep_i[b"100"] = 42
+    r.last_rep_ti[b"100"] = 10
+    r.chkpts.update(b"100", 10, 42)
+    chkpt = r.to_checkpoint(10)
+    state = r.checkpoint_state(10)
+    assert state[0] == 42
+
+    r2 = replica(2, 4, counter())
+    assert r2.from_checkpoint(10, state) == chkpt
+    assert r2.service.total == 42
+    assert r2.last_rep_i[b"100"] == 42 and r2.last_rep_ti[b"100"] == 10
+    assert r2.last_rep_ti[b"101"] == 0
+
+
+def test_service_driver():
+    dvr = driver(f=1, batch_size=5, batch_timeout=0.01, service=counter)
+    reqs = [(replica._REQUEST, b"1", 10, b"%d" % x) for x in range(25)]
+    dvr.execute(reqs, ordered=False)
+
+    assert len(dvr.seen_replies) == 25
+    for r in dvr.replicas:
+        assert r.service.total == 25
+        assert max(r.service.batches) > 1
@@ -0,0 +1,54 @@
+# Tests
+
+import sys
+sys.path += ["."]
+
+from pybft.replica import replica
+from pybft.sim import simulator, link, percentile
+from tests.common import requests
+
+
+def test_sim_completes_and_reports():
+    sim = simulator(f=1, seed=1)
+    rep = sim.run(requests(50))
+
+    assert rep["requests"] == 50
+    assert rep["throughput"] > 0
+    assert 0 < rep["latency_p50"] <= rep["latency_p90"] <= rep["latency_p99"]
+    assert rep["messages_by_type"][replica._PREPREPARE] > 0
+    assert rep["bytes"] > 0 and rep["dropped"] == 0
+
+
+def test_sim_deterministic():
+    reps = [simulator(f=1, seed=7, default_link=link(jitter=0.001)).run(requests(30)) \
+            for _ in range(2)]
+    assert reps[0] == reps[1]
+
+
+def test_sim_latency_bandwidth_loss():
+    fast = simulator(f=1, seed=3).run(requests(20))
+    slow = simulator(f=1, seed=3, default_link=link(latency=0.01)).run(requests(20))
+    assert slow["latency_p50"] > fast["latency_p50"]
+
+    narrow = simulator(f=1, seed=3, default_link=link(bandwidth=1e5)).run(requests(20))
+    assert narrow["latency_p50"] > fast["latency_p50"]
+
+    # Lossy links: client retries still get every request through.
+    lossy = simulator(f=1, seed=3, default_link=link(loss=0.05))
+    rep = lossy.run(requests(20))
+    assert rep["dropped"] > 0 and rep["requests"] == 20
+
+
+def test_sim_batching_f3():
+    plain = simulator(f=3, seed=2).run(requests(40), in_flight=20)
+    batched = simulator(f=3, seed=2, batch_size=10, batch_timeout=0.002) \
+                  .run(requests(40), in_flight=20)
+    assert batched["requests"] == plain["requests"] == 40
+    assert batched["messages"] < plain["messages"]
+
+
+def test_percentile():
+    xs = list(range(1, 101))
+    assert percentile(xs, 50) == 50
+    assert percentile(xs, 99) == 99
+    assert percentile([], 50) is None
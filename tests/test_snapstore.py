@@ -0,0 +1,106 @@
+# Tests
+
+import os
+import sys
+sys.path += ["."]
+
+from pybft.replica import replica
+from pybft.sim import simulator
+from pybft.snapstore import snapstore
+from pybft.wal import wal, read_records
+from tests.common import requests
+
+
+def fill(r, clients, t=1):
+    for c in range(clients):
+        r.chkpts.update(b"c%d" % c, t, b"r%d.%d" % (c, t))
+
+
+def test_deltas_match_memory(tmp_path):
+    mem, disk = replica(0, 4), replica(0, 4)
+    s = snapstore(str(tmp_path / "chk"))
+    s.attach(disk)
+    assert disk.chkpts.held is s
+
+    for r in [mem, disk]:
+        fill(r, 500)
+    size = os.path.getsize(s.path)
+    assert mem.to_checkpoint(10) == disk.to_checkpoint(10)
+    full = os.path.getsize(s.path) - size
+
+    # A checkpoint writes the entries changed since the previous one.
+    for r in [mem, disk]:
+        r.chkpts.update(b"c3", 2, b"x")
+    size = os.path.getsize(s.path)
+    assert mem.to_checkpoint(20) == disk.to_checkpoint(20)
+    assert os.path.getsize(s.path) - size < full / 50
+
+    for n in [10, 20]:
+        assert sorted(disk.checkpoint_state(n)[1]) == sorted(mem.checkpoint_state(n)[1])
+    assert disk.chkpts.has(10) and disk.chkpts.digest(20) == mem.chkpts.digest(20)
+
+
+def test_compaction_bounds_file(tmp_path):
+    r = replica(0, 4)
+    s = snapstore(str(tmp_path / "chk"), slack=2.0)
+    s.attach(r)
+    fill(r, 2000)
+    r.to_checkpoint(10)
+    r.chkpts.stable(10)
+    base = os.path.getsize(s.path)
+
+    for k in range(2, 200):
+        fill(r, 50, t=k)
+        r.to_checkpoint(10 * k)
+        r.chkpts.stable(10 * (k - 1))
+        assert os.path.getsize(s.path) <= 3 * max(base, 1 << 16)
+    assert s.stat["compactions"] > 1
+    assert not r.chkpts.has(10) and r.chkpts.has(1980)
+
+    entries = dict((c, (t, x)) for (c, t, x) in r.checkpoint_state(1990)[1])
+    assert entries[b"c3"] == (199, b"r3.199") and entries[b"c1999"] == (1, b"r1999.1")
+
+
+def test_restart_loads_stable_checkpoint(tmp_path):
+    path = str(tmp_path / "chk")
+    r = replica(0, 4)
+    s = snapstore(path)
+    s.attach(r)
+    fill(r, 100)
+    d = r.to_checkpoint(10)
+    r.checkpts_i.add((10, d))
+    r.chkpts.stable(10)
+    fill(r, 10, t=2)
+    r.to_checkpoint(20)
+    s.close()
+
+    after = replica(0, 4)
+    assert snapstore(path).recover(after) == 10
+    assert after.stable_chkpt() == d and after.last_exec_i == 10
+    assert after.last_rep_i[b"c5"] == b"r5.1" and after.last_rep_ti[b"c99"] == 1
+    assert after.chkpts.has(10) and not after.chkpts.has(20)
+
+
+def test_recover_with_write_ahead_log(tmp_path):
+    sim = simulator(f=1, seed=7)
+    i = 1
+    s = snapstore(str(tmp_path / "chk"))
+    w = wal(str(tmp_path / "log"), group=16)
+    s.attach(sim.replicas[i])
+    w.attach(sim.replicas[i])
+    assert sim.run(requests(37, clients=10))["requests"] == 37
+    before = sim.replicas[i]
+    before.out_i.drain()
+    w.file.close()
+    s.close()
+
+    # The log only names the stable checkpoint, found in the store.
+    assert all(rec[3] is None for rec in read_records(w.path) if rec[0] == "S")
+
+    after = replica(i, 4)
+    snapstore(s.path).recover(after)
+    wal(w.path).recover(after)
+    assert after.stable_chkpt() == before.stable_chkpt()
+    assert after.last_exec_i == before.last_exec_i
+    assert dict(after.last_rep_ti) == dict(before.last_rep_ti)
+    assert after.checkpts_i == before.checkpts_i
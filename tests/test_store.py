@@ -0,0 +1,79 @@
+# Tests
+
+import sys
+sys.path += ["."]
+
+from pybft.replica import replica
+from pybft.codec import wirecodec
+from pybft.sim import simulator
+from pybft.store import footprint
+
+
+def copy(msg):
+    codec = wirecodec()
+    return codec.decode(codec.encode(msg))
+
+
+def test_store_shares_request_bodies():
+    r = replica(1, 4)
+    req = (r._REQUEST, b"x" * 10000, 1, b"A")
+    pp = (r._PREPREPARE, 0, 1, req, 0)
+
+    r.route_receive(copy(req))
+    r.route_receive(copy(pp))
+    assert len(r.store) == 1
+    assert r.store.stat["shared"] == 1
+
+    body = r.store.get(r.hash(req))
+    assert body == req
+    logged = [m for m in r.in_i if m[0] in (r._REQUEST, r._PREPREPARE)]
+    assert len(logged) == 2
+    assert all(m is body or m[3] is body for m in logged)
+
+    # A VIEWCHANGE carrying the PREPREPARE refers to the same body.
+    vc = (r._VIEWCHANGE, 1, 0, r.stable_chkpt(), frozenset(), frozenset([copy(pp)]), 2)
+    vc = r.store.message(vc)
+    assert next(iter(vc[5]))[3] is body
+
+
+def test_store_releases_bodies():
+    r = replica(1, 4)
+    req = (r._REQUEST, b"op", 1, b"A")
+    batch = (r._BATCH, (req, (r._REQUEST, b"op", 2, b"B")))
+    pp = (r._PREPREPARE, 0, 1, batch, 0)
+
+    r.in_i.add(req)
+    r.in_i.add(pp)
+    assert len(r.store) == 2 and r.store.refs[r.hash(req)] == 2
+
+    r.in_i.discard(req)
+    assert len(r.store) == 2
+    r.in_i.discard(pp)
+    assert len(r.store) == 0 and not r.store.refs
+    assert r.store.stat["released"] == 2
+
+
+def test_store_footprint_on_wire():
+    reqs = [(replica._REQUEST, (b"%08d" % x) * 512, x // 10 + 1, b"%d" % (x % 10)) \
+            for x in range(30)]
+    sizes = []
+    for interned in (False, True):
+        sim = simulator(f=1, seed=2, batch_timeout=0.01, batch_size=10, wire=True)
+        peak = [0]
+        for r in sim.replicas:
+            if not interned:
+                r.store = None
+            def sampled(msg, r=r, deliver=r.route_receive):
+                deliver(msg)
+                peak[0] = max(peak[0], footprint(r.in_i))
+            r.route_receive = sampled
+        assert sim.run(reqs)["requests"] == 30
+        sizes.append(peak[0])
+    assert sizes[1] < sizes[0]
+
+
+def test_footprint_counts_shared_once():
+    body = b"x" * 1000
+    a = ("A", body)
+    b = ("B", body)
+    assert footprint([a, b]) < footprint([a, ("B", bytes(bytearray(body)))])
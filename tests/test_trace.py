@@ -0,0 +1,46 @@
+# Tests
+
+import sys
+sys.path += ["."]
+
+from pybft.replica import replica
+from pybft.trace import tracer, histogram, PHASES
+from pybft.sim import simulator, link
+
+
+def test_histogram_buckets_and_merge():
+    h1, h2 = histogram(), histogram()
+    for x in [1e-6, 3e-6, 1e-3]:
+        h1.add(x)
+    h2.add(1e-3)
+    assert h1.percentile(50) == 4e-6
+    assert h1.percentile(100) >= 1e-3
+
+    h1.merge(h2)
+    assert h1.total == 4 and h1.percentile(75) >= 1e-3
+    assert histogram.load(h1.dump()).dump() == h1.dump()
+
+
+def test_trace_phases_in_simulation():
+    sim = simulator(f=1, seed=4, default_link=link(latency=0.001))
+    tracers = []
+    for r in sim.replicas:
+        r.tracer = tracer(clock=lambda: sim.now)
+        tracers.append(r.tracer)
+
+    assert sim.run([(replica._REQUEST, b"message%d" % x, 10, b"%d" % x) \
+                    for x in range(20)])["requests"] == 20
+
+    # Backups see every phase of every slot they executed.
+    t = tracers[1]
+    assert t.histograms["total"].total == sim.replicas[1].last_exec_i
+    assert t.histograms["prepare"].total == t.histograms["total"].total
+    assert t.histograms["prepare"].percentile(50) >= 0.001
+
+    merged = tracer()
+    for t in tracers:
+        merged.merge(t)
+    dump = merged.dump()
+    assert set(dump) == set(PHASES)
+    assert dump["total"]["count"] == sum(t.histograms["total"].total for t in tracers)
+    assert "prepare" in merged.text()
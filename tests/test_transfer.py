@@ -0,0 +1,121 @@
+# Tests
+
+import sys
+sys.path += ["."]
+
+from pybft.replica import replica
+from pybft.sim import simulator, link
+from tests.common import requests
+
+
+def exchange(reps):
+    # Deliver the messages between replicas until none is left.
+    moved = True
+    while moved:
+        moved = False
+        for r in reps:
+            for dest, msgs in r.out_i.drain():
+                if isinstance(dest, int) and dest < len(reps):
+                    for m in msgs:
+                        reps[dest].route_receive(m)
+                        moved = True
+
+
+def serving(clients, n=10):
+    # Replicas 0 to 2 holding checkpoint n of a table with many clients.
+    reps = [replica(i, 4) for i in range(4)]
+    for r in reps:
+        r.transfer.chunk_size = 16
+        for c in range(clients):
+            r.chkpts.update(b"c%d" % c, 1, b"r%d" % c)
+    d = [r.chkpts.take(n) for r in reps[:3]][0]
+    return reps, d
+
+
+def test_transfer_in_chunks_from_several_peers():
+    reps, d = serving(200)
+    r3 = reps[3]
+    r3.transfer.want(10, d, [0, 1, 2])
+    exchange(reps)
+
+    t = r3.transfer.stat
+    assert t["installed"] == 1 and t["chunks"] == 16
+    assert all(reps[j].transfer.stat["served"] > 1 for j in range(3))
+    assert r3.last_exec_i == 10 and r3.stable_chkpt() == d
+    assert r3.last_rep_ti[b"c7"] == 1 and r3.last_rep_i[b"c7"] == b"r7"
+    assert r3.chkpts.digest(10) == d
+
+
+def test_transfer_rejects_bad_chunks():
+    reps, d = serving(200)
+    r3 = reps[3]
+    r3.transfer.want(10, d, [0, 1, 2])
+    ((j, (ask,)),) = r3.out_i.drain()
+    reps[j].route_receive(ask)
+    ((_, (manifest,)),) = reps[j].out_i.drain()
+    r3.route_receive(manifest)
+    assert r3.transfer.manifest is not None
+
+    # A chunk with a forged result is refused, and asked for again.
+    (j, ask) = [(j, m) for j, ms in r3.out_i.drain() for m in ms][0]
+    k = ask[3][0]
+    chunk = reps[j].transfer.state_of(10, d)[1][k]
+    forged = tuple((c, t, b"forged") for (c, t, r) in chunk)
+    r3.route_receive((replica._STATE, 10, d, k, forged, j))
+    assert r3.transfer.stat["rejected"] == 1 and k not in r3.transfer.chunks
+
+    r3.clock = lambda: 1e9
+    r3.transfer.pump()
+    assert any(k in m[3] for _, ms in r3.out_i.drain() for m in ms)
+
+
+def test_transfer_resumes_with_kept_chunks():
+    reps, d = serving(200)
+    r3 = reps[3]
+    r3.transfer.want(10, d, [0, 1, 2])
+
+    # The manifest arrives, then a single peer answers for its chunks
+    # before the transfer is interrupted.
+    for dest, msgs in r3.out_i.drain():
+        reps[dest].route_receive(msgs[0])
+        r3.route_receive(reps[dest].out_i.drain()[0][1][0])
+    ((j, ms), _, _) = r3.out_i.drain()
+    reps[j].route_receive(ms[0])
+    for m in reps[j].out_i.drain()[0][1]:
+        r3.route_receive(m)
+    held = len(r3.transfer.chunks)
+    assert 0 < held < 16
+
+    # The next checkpoint changes a single client: the chunks held are
+    # reused, and only the others are fetched.
+    for r in reps[:3]:
+        r.chkpts.update(b"c0", 2, b"new")
+    d2 = [r.chkpts.take(20) for r in reps[:3]][0]
+    r3.transfer.want(20, d2, [0, 1, 2])
+    exchange(reps)
+
+    t = r3.transfer.stat
+    assert t["installed"] == 1 and t["reused"] >= held - 1
+    assert t["chunks"] < held + 16
+    assert r3.stable_chkpt() == d2 and r3.last_rep_i[b"c0"] == b"new"
+
+
+def test_partitioned_replica_catches_up():
+    sim = simulator(f=1, seed=3)
+    for j in range(3):
+        sim.set_link(j, 3, link(loss=1.0))
+        sim.set_link(3, j, link(loss=1.0))
+    assert sim.run(requests(80))["requests"] == 80
+    assert sim.replicas[3].last_exec_i == 0
+
+    # Healed, it fetches the state of a checkpoint past the slots its
+    # peers collected, instead of being stuck behind them.
+    for j in range(3):
+        sim.set_link(j, 3, link())
+        sim.set_link(3, j, link())
+    assert sim.run(requests(600, start=80))["requests"] == 520
+
+    r3 = sim.replicas[3]
+    assert r3.transfer.stat["installed"] >= 1
+    assert r3.stable_n() > 80 and r3.last_exec_i >= r3.stable_n()
+    assert r3.stat[replica._STATE] > 0
@@ -0,0 +1,95 @@
+# Tests
+
+import os
+import sys
+sys.path += ["."]
+
+from pybft.replica import replica
+from pybft.sim import simulator
+from pybft.wal import wal, read_records
+from tests.common import requests
+
+
+def state(r):
+    return (r.view_i, r.seqno_i, r.last_exec_i, r.checkpts_i, dict(r.last_rep_ti), \
+            dict(r.last_rep_i), set(r.in_i))
+
+
+def test_records_and_torn_tail(tmp_path):
+    path = str(tmp_path / "log")
+    w = wal(path, group=2)
+    msgs = [(replica._PREPARE, 0, n, "00" * 32, 1) for n in range(1, 6)]
+    for msg in msgs:
+        w.append(("M", msg))
+    assert w.stat["fsyncs"] == 2
+    w.close()
+    assert [r[1] for r in read_records(path)] == msgs
+
+    # A torn last record is ignored.
+    size = os.path.getsize(path)
+    with open(path, "r+b") as f:
+        f.truncate(size - 3)
+    assert [r[1] for r in read_records(path)] == msgs[:-1]
+
+
+def test_group_commit_on_drain(tmp_path):
+    syncs = []
+    w = wal(str(tmp_path / "log"), group=1000, sync=syncs.append)
+    r = replica(1, 4)
+    r.garbage_collect()
+    w.attach(r)
+    # The new log and its directory.
+    compacted = len(syncs)
+    assert compacted == 2
+
+    req = requests(1, clients=10)[0]
+    r.route_receive(req)
+    r.route_receive((r._PREPREPARE, 0, 1, req, 0))
+    assert len(syncs) == compacted and w.buffer
+
+    # Everything accepted so far is on disk before the outbox drains.
+    r.out_i.drain()
+    assert len(syncs) == compacted + 1 and not w.buffer
+    msgs = [rec[1] for rec in read_records(w.path) if rec[0] == "M"]
+    assert (r._PREPARE, 0, 1, r.hash(req), 1) in msgs
+
+
+def test_recover_after_crash(tmp_path):
+    for N, i in [(25, 1), (37, 0)]:
+        path = str(tmp_path / ("log%d" % N))
+        sim = simulator(f=1, seed=N)
+        w = wal(path, group=16)
+        w.attach(sim.replicas[i])
+        assert sim.run(requests(N, clients=10))["requests"] == N
+
+        # The process dies: only what was synced survives.
+        before = sim.replicas[i]
+        before.out_i.drain()
+        w.file.close()
+
+        after = replica(i, 4)
+        assert wal(path).recover(after) > 0
+        assert state(after) == state(before)
+        assert after.stable_n() > 0 and after.in_i.low == before.in_i.low
+
+        # The recovered replica keeps taking part in the protocol.
+        for r in sim.replicas:
+            r.out_i.drain()
+        sim.replicas[i] = after
+        after.clock = lambda: sim.now
+        assert sim.run(requests(N + 10, start=N, clients=10))["requests"] == 10
+        assert after.last_exec_i > before.last_exec_i
+
+
+def test_compaction_bounds_log(tmp_path):
+    path = str(tmp_path / "log")
+    sim = simulator(f=1, seed=1)
+    w = wal(path)
+    w.attach(sim.replicas[1])
+    sim.run(requests(100, clients=10))
+    w.sync()
+
+    records = read_records(path)
+    assert records[0][0] == "S" and records[0][1] == sim.replicas[1].stable_n()
+    assert w.stat["compactions"] > 1
+    assert len(records) < w.stat["records"]